@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+"""
+Inter-annotator agreement over a whole corpus.
+
+For every file and namespace with several annotations (the SALAMI
+annotators of each segmentation level, the five SPAM annotators, or
+annotator-specific beat tracks), each pair of annotations is compared with:
+
+    - `boundary`: boundary hit rates (precision, recall and F-measure) with
+      0.5 and 3 seconds windows, for segment namespaces.
+    - `pairwise`: pairwise frame clustering (precision, recall and
+      F-measure) with 0.1 seconds frames, for segment namespaces.
+    - `beat_f`: beat F-measure with a 70 ms window, ignoring the first 5
+      seconds, for `beat`.
+
+The first annotation of a pair is the reference. Metrics follow the
+definitions of `mir_eval`, computed with numpy: hits are the maximal
+matching of the events, found with `np.searchsorted` (only the rare
+clusters with several candidate events on both sides are resolved by a
+greedy scan, which is maximal for events on a line), frame labels are
+filled with `np.searchsorted` over the frame grid, and pairwise clustering
+uses a label contingency table.
+
+Files are processed in parallel, and the results of each (file hash,
+metric) are cached as JSON, so rerunning the report only computes the
+metrics of new or modified files.
+
+Usage example:
+    ./agreement.py ../datasets/SALAMI salami_agreement.csv \
+--cache_dir agreement_cache/ -j 8
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import time
+
+from joblib import Parallel, delayed
+import numpy as np
+
+import corpus_io
+
+METRICS = ["boundary", "pairwise", "beat_f"]
+BOUNDARY_WINDOWS = [0.5, 3.0]
+FRAME_SIZE = 0.1
+BEAT_WINDOW = 0.07
+MIN_BEAT_TIME = 5.0
+
+
+def get_metrics(namespace):
+    """Metrics that apply to a namespace."""
+    if namespace == "beat":
+        return ["beat_f"]
+    if namespace.startswith("segment_"):
+        return ["boundary", "pairwise"]
+    return []
+
+
+def f_measure(precision, recall):
+    """Harmonic mean of precision and recall."""
+    if precision + recall == 0:
+        return 0.0
+    return 2 * precision * recall / (precision + recall)
+
+
+def _greedy_hits(reference, estimate, window):
+    """Size of the maximal matching of two sorted event arrays, by a greedy
+    scan (see `count_hits`)."""
+    hits, i, j = 0, 0, 0
+    while i < len(reference) and j < len(estimate):
+        if reference[i] < estimate[j] - window:
+            i += 1
+        elif estimate[j] < reference[i] - window:
+            j += 1
+        else:
+            hits += 1
+            i += 1
+            j += 1
+    return hits
+
+
+def count_hits(reference, estimate, window):
+    """Size of the maximal matching between two sorted event arrays, where
+    events match if they are at most window seconds apart.
+
+    The candidate references of each estimate are a range found with
+    `np.searchsorted`, and estimates whose ranges overlap form clusters. A
+    cluster with a single estimate or a single reference has exactly one
+    hit; the others (several close events on both sides) are resolved with
+    a greedy scan.
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    estimate = np.asarray(estimate, dtype=np.float64)
+    lo = np.searchsorted(reference, estimate - window, side="left")
+    hi = np.searchsorted(reference, estimate + window, side="right")
+    matched = hi > lo
+    lo, hi = lo[matched], hi[matched]
+    if not len(lo):
+        return 0
+    # Clusters of estimates with overlapping candidate ranges (the ranges
+    # are sorted, so a cluster starts where a range starts after the
+    # previous ones end)
+    starts = np.flatnonzero(np.r_[True, lo[1:] >= np.maximum.accumulate(
+        hi)[:-1]])
+    ends = np.r_[starts[1:], len(lo)]
+    n_est = ends - starts
+    n_ref = np.maximum.reduceat(hi, starts) - lo[starts]
+    simple = (n_est == 1) | (n_ref == 1)
+    hits = int(simple.sum())
+    est_index = np.flatnonzero(matched)
+    for start, end in zip(starts[~simple], ends[~simple]):
+        hits += _greedy_hits(
+            reference[lo[start]:hi[start:end].max()],
+            estimate[est_index[start]:est_index[end - 1] + 1], window)
+    return hits
+
+
+def get_boundaries(annotation):
+    """Sorted unique boundaries (starts and ends) of a segmentation, rounded
+    to 5 decimals to merge the ends and starts of consecutive segments."""
+    times = np.asarray(annotation["data"]["time"], dtype=np.float64)
+    ends = times + np.nan_to_num(np.asarray(annotation["data"]["duration"],
+                                            dtype=np.float64))
+    return np.unique(np.round(np.concatenate([times, ends]), 5))
+
+
+def boundary_scores(reference, estimate):
+    """Boundary hit rates of two segmentations, for each window."""
+    ref_bounds, est_bounds = get_boundaries(reference), \
+        get_boundaries(estimate)
+    scores = dict()
+    for window in BOUNDARY_WINDOWS:
+        hits = count_hits(ref_bounds, est_bounds, window)
+        precision = hits / float(len(est_bounds)) if len(est_bounds) else 0.
+        recall = hits / float(len(ref_bounds)) if len(ref_bounds) else 0.
+        scores["boundary_%.1f_precision" % window] = precision
+        scores["boundary_%.1f_recall" % window] = recall
+        scores["boundary_%.1f_f" % window] = f_measure(precision, recall)
+    return scores
+
+
+def get_frame_labels(annotation, n_frames):
+    """Labels of a segmentation sampled every FRAME_SIZE seconds (-1 where
+    no segment is active; later segments overwrite earlier ones)."""
+    _, codes = np.unique([json.dumps(value, sort_keys=True)
+                          for value in annotation["data"]["value"]],
+                         return_inverse=True)
+    starts = np.asarray(annotation["data"]["time"], dtype=np.float64)
+    ends = starts + np.nan_to_num(np.array(annotation["data"]["duration"],
+                                           dtype=np.float64))
+    frame_times = np.arange(n_frames) * FRAME_SIZE
+    lo = np.searchsorted(frame_times, starts)
+    hi = np.maximum(np.searchsorted(frame_times, ends), lo)
+    # Frames of all the segments at once, and the last segment of each frame
+    lengths = hi - lo
+    segments = np.repeat(np.arange(len(lo)), lengths)
+    frames = np.arange(lengths.sum()) + np.repeat(lo - np.cumsum(lengths) +
+                                                  lengths, lengths)
+    last = np.full(n_frames, -1, dtype=np.int64)
+    np.maximum.at(last, frames, segments)
+    codes = np.append(codes, -1)
+    return codes[last].astype(np.int64)
+
+
+def n_pairs(counts):
+    """Number of unordered pairs within groups of the given sizes."""
+    counts = np.asarray(counts, dtype=np.float64)
+    return (counts * (counts - 1) / 2).sum()
+
+
+def pairwise_scores(reference, estimate):
+    """Pairwise frame clustering scores of two segmentations."""
+    end = max(get_boundaries(reference).max(), get_boundaries(estimate).max())
+    n_frames = int(np.ceil(end / FRAME_SIZE))
+    ref_labels = get_frame_labels(reference, n_frames) + 1
+    est_labels = get_frame_labels(estimate, n_frames) + 1
+    # Contingency table of the (reference, estimate) label pairs
+    n_est = est_labels.max() + 1
+    joint = np.bincount(ref_labels * n_est + est_labels)
+    agree = n_pairs(joint)
+    ref_pairs = n_pairs(np.bincount(ref_labels))
+    est_pairs = n_pairs(np.bincount(est_labels))
+    precision = agree / est_pairs if est_pairs else 0.0
+    recall = agree / ref_pairs if ref_pairs else 0.0
+    return dict(pairwise_precision=precision, pairwise_recall=recall,
+                pairwise_f=f_measure(precision, recall))
+
+
+def beat_scores(reference, estimate):
+    """Beat F-measure of two beat annotations."""
+    ref_beats = np.sort(np.asarray(reference["data"]["time"],
+                                   dtype=np.float64))
+    est_beats = np.sort(np.asarray(estimate["data"]["time"],
+                                   dtype=np.float64))
+    ref_beats = ref_beats[ref_beats >= MIN_BEAT_TIME]
+    est_beats = est_beats[est_beats >= MIN_BEAT_TIME]
+    if len(ref_beats) == 0 or len(est_beats) == 0:
+        return dict(beat_f=0.0)
+    hits = count_hits(ref_beats, est_beats, BEAT_WINDOW)
+    return dict(beat_f=f_measure(hits / float(len(est_beats)),
+                                 hits / float(len(ref_beats))))
+
+
+METRIC_FUNCTIONS = dict(boundary=boundary_scores, pairwise=pairwise_scores,
+                        beat_f=beat_scores)
+
+
+def get_annotator(annotation, i):
+    """Name of the annotator of an annotation (its position if unknown)."""
+    annotator = annotation["annotation_metadata"].get("annotator") or {}
+    if isinstance(annotator, dict):
+        annotator = annotator.get("name") or annotator.get("id")
+    return str(annotator) if annotator else "#%d" % i
+
+
+def compute_metric(jam, metric):
+    """Computes a metric for all the pairs of annotations of a file.
+
+    Returns
+    -------
+    results : list
+        One dictionary per pair, with the namespace, the two annotators and
+        the scores.
+    """
+    by_namespace = dict()
+    for i, annotation in enumerate(corpus_io.iter_annotations(jam)):
+        if metric in get_metrics(annotation["namespace"]) and \
+                len(annotation["data"]["time"]):
+            by_namespace.setdefault(annotation["namespace"], []).append(
+                (get_annotator(annotation, i), annotation))
+    results = []
+    for namespace, annotations in sorted(by_namespace.items()):
+        for (name_a, ann_a), (name_b, ann_b) in \
+                itertools.combinations(annotations, 2):
+            scores = METRIC_FUNCTIONS[metric](ann_a, ann_b)
+            scores.update(namespace=namespace, reference=name_a,
+                          estimate=name_b)
+            results.append(scores)
+    return results
+
+
+def process_file(jams_file, metrics, cache_dir=None):
+    """Computes the agreement metrics of a file, using the cache.
+
+    Returns
+    -------
+    results : list
+        One dictionary per (pair, metric).
+    """
+    cache_files = dict()
+    results = dict()
+    if cache_dir is not None:
+        jams_hash = corpus_io.file_hash(jams_file)
+        for metric in metrics:
+            cache_files[metric] = os.path.join(
+                cache_dir, "%s.%s.json" % (jams_hash, metric))
+            if os.path.isfile(cache_files[metric]):
+                with open(cache_files[metric], "r") as fp:
+                    results[metric] = json.load(fp)
+    missing = [metric for metric in metrics if metric not in results]
+    if missing:
+        jam = corpus_io.load_jam(jams_file)
+        for metric in missing:
+            results[metric] = compute_metric(jam, metric)
+            if cache_dir is not None:
+                with open(cache_files[metric], "w") as fp:
+                    json.dump(results[metric], fp)
+    return [result for metric in metrics for result in results[metric]]
+
+
+def process(in_dir, out_file, metrics=METRICS, cache_dir=None, n_jobs=1):
+    """Computes the agreement of all the files of a corpus and writes a
+    CSV report with one row per pair of annotations.
+
+    Returns
+    -------
+    means : dict
+        Mean of each score, keyed by (namespace, score).
+    """
+    jams_files = corpus_io.find_jams(in_dir)
+    if cache_dir is not None and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    all_results = Parallel(n_jobs=n_jobs)(
+        delayed(process_file)(jams_file, metrics, cache_dir)
+        for jams_file in jams_files)
+
+    # Merge the metrics of each pair into a single row
+    rows = dict()
+    for jams_file, results in zip(jams_files, all_results):
+        track_id = corpus_io.get_track_id(jams_file, in_dir)
+        for result in results:
+            key = (track_id, result["namespace"], result["reference"],
+                   result["estimate"])
+            row = rows.setdefault(key, dict(track_id=track_id))
+            row.update(result)
+    rows = [rows[key] for key in sorted(rows)]
+    fields = ["track_id", "namespace", "reference", "estimate"]
+    scores = sorted(set(field for row in rows for field in row) -
+                    set(fields))
+    with open(out_file, "w") as fp:
+        writer = csv.DictWriter(fp, fieldnames=fields + scores)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    means = dict()
+    for namespace in sorted(set(row["namespace"] for row in rows)):
+        for score in scores:
+            values = [row[score] for row in rows
+                      if row["namespace"] == namespace and score in row]
+            if values:
+                means[namespace, score] = np.mean(values)
+    logging.info("Compared %d pairs of annotations in %d files.", len(rows),
+                 len(jams_files))
+    return means
+
+
+def main():
+    """Main function to compute the inter-annotator agreement."""
+    parser = argparse.ArgumentParser(
+        description="Computes the inter-annotator agreement of a corpus",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("in_dir",
+                        action="store",
+                        help="Folder with the JAMS files")
+    parser.add_argument("out_file",
+                        action="store",
+                        help="Output CSV report")
+    parser.add_argument("-m",
+                        action="store",
+                        dest="metrics",
+                        nargs="+",
+                        choices=METRICS,
+                        default=METRICS,
+                        help="Metrics to compute")
+    parser.add_argument("--cache_dir",
+                        action="store",
+                        default=None,
+                        help="Folder where the results are cached")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Compute the agreement
+    means = process(args.in_dir, args.out_file, args.metrics, args.cache_dir,
+                    args.n_jobs)
+    for (namespace, score), mean in sorted(means.items()):
+        logging.info("%s %s: %.3f", namespace, score, mean)
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+"""
+SQLite store of the annotations of one or several JAMS corpora.
+
+The database has three tables:
+
+    - `files`: one row per JAMS file, with its corpus, track ID, SHA-1
+      hash, title, artist, release and duration, plus its `file_metadata`
+      and `sandbox` as JSON.
+    - `annotations`: one row per annotation, with its namespace, annotator,
+      curator and corpus, plus its full `annotation_metadata` and `sandbox`
+      as JSON.
+    - `observations`: one row per observation, with its time, duration,
+      value and confidence.
+
+Strings and numbers are stored as SQL values, so they can be queried
+directly; other values (dictionaries, lists, booleans, NaN) are stored as
+JSON text, flagged by the `value_json` and `confidence_json` columns.
+Annotations are read with `corpus_io.iter_annotations`, so early (pyjams)
+files are stored with their JAMS >= 0.2 namespaces, and compacted
+`pitch_hz` annotations with their decoded observations.
+
+Files are parsed in parallel and inserted in batched transactions. Loading
+a folder again only replaces the files whose contents changed.
+
+Usage examples:
+    ./annotation_db.py load jams.db ../datasets/SALAMI ../datasets/Isophonics -j 4
+    ./annotation_db.py query jams.db "SELECT value, COUNT(*) FROM \
+observations JOIN annotations ON annotation_id = annotations.id WHERE \
+namespace = 'chord' GROUP BY value ORDER BY 2 DESC LIMIT 10"
+    ./annotation_db.py export jams.db out_dir --corpus SALAMI
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+
+import corpus_io
+import json_backend
+import pitch_encoding
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    corpus TEXT NOT NULL,
+    track_id TEXT NOT NULL,
+    path TEXT,
+    sha1 TEXT,
+    title TEXT,
+    artist TEXT,
+    release TEXT,
+    duration REAL,
+    file_metadata TEXT,
+    sandbox TEXT,
+    UNIQUE (corpus, track_id)
+);
+CREATE TABLE IF NOT EXISTS annotations (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    namespace TEXT NOT NULL,
+    annotator TEXT,
+    curator TEXT,
+    corpus TEXT,
+    time REAL,
+    duration REAL,
+    annotation_metadata TEXT,
+    sandbox TEXT
+);
+CREATE TABLE IF NOT EXISTS observations (
+    annotation_id INTEGER NOT NULL
+        REFERENCES annotations (id) ON DELETE CASCADE,
+    time REAL,
+    duration REAL,
+    value,
+    value_json INTEGER NOT NULL DEFAULT 0,
+    confidence,
+    confidence_json INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS files_corpus ON files (corpus);
+CREATE INDEX IF NOT EXISTS annotations_file ON annotations (file_id);
+CREATE INDEX IF NOT EXISTS annotations_namespace ON annotations (namespace);
+CREATE INDEX IF NOT EXISTS observations_annotation
+    ON observations (annotation_id, time);
+CREATE INDEX IF NOT EXISTS observations_value ON observations (value);
+CREATE INDEX IF NOT EXISTS observations_time ON observations (time);
+"""
+
+
+def connect(db_file):
+    """Opens the database, creating its tables if needed."""
+    db = sqlite3.connect(db_file)
+    db.execute("PRAGMA foreign_keys = ON")
+    db.execute("PRAGMA journal_mode = WAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def encode(value):
+    """Encodes a value for SQLite. Returns the stored value and whether it
+    is JSON-encoded."""
+    if value is None or isinstance(value, str):
+        return value, 0
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and \
+            not (isinstance(value, float) and
+                 (math.isnan(value) or math.isinf(value))):
+        return value, 0
+    return json.dumps(value, sort_keys=True), 1
+
+
+def decode(value, is_json):
+    """Decodes a value stored by `encode`."""
+    return json.loads(value) if is_json else value
+
+
+def get_name(person):
+    """Name (or ID) of an annotator or curator."""
+    if not isinstance(person, dict):
+        return person or None
+    return person.get("name") or person.get("id") or None
+
+
+def get_rows(jam):
+    """Converts a loaded JAMS into database rows. Runs in the loader
+    workers, so only the rows are sent back.
+
+    Returns
+    -------
+    file_row : tuple
+        Title, artist, release, duration, file metadata and sandbox.
+    annotations : list
+        For each annotation, a tuple of its row (without file ID) and the
+        list of its observation rows (without annotation ID).
+    """
+    file_metadata = jam.get("file_metadata", {})
+    file_row = (file_metadata.get("title") or None,
+                file_metadata.get("artist") or None,
+                file_metadata.get("release") or None,
+                corpus_io.get_duration(jam),
+                json.dumps(file_metadata),
+                json.dumps(jam.get("sandbox", {})))
+
+    raw_annotations = jam.get("annotations", [])
+    annotations = []
+    for i, annotation in enumerate(corpus_io.iter_annotations(jam)):
+        metadata = annotation["annotation_metadata"]
+        raw = raw_annotations[i] if i < len(raw_annotations) else {}
+        row = (i, annotation["namespace"],
+               get_name(metadata.get("annotator")),
+               get_name(metadata.get("curator")),
+               metadata.get("corpus") or None,
+               raw.get("time"), raw.get("duration"),
+               json.dumps(metadata), json.dumps(annotation["sandbox"]))
+        data = annotation["data"]
+        observations = [encode(value) + encode(confidence)
+                        for value, confidence in zip(data["value"],
+                                                     data["confidence"])]
+        observations = [(start, duration) + obs for start, duration, obs in
+                        zip(data["time"], data["duration"], observations)]
+        annotations.append((row, observations))
+    return file_row, annotations
+
+
+def insert(db, corpus, track_id, jams_file, sha1, rows):
+    """Inserts the rows of a file, replacing its previous version."""
+    db.execute("DELETE FROM files WHERE corpus = ? AND track_id = ?",
+               (corpus, track_id))
+    file_row, annotations = rows
+    file_id = db.execute(
+        "INSERT INTO files (corpus, track_id, path, sha1, title, artist, "
+        "release, duration, file_metadata, sandbox) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (corpus, track_id, jams_file, sha1) + file_row).lastrowid
+    for row, observations in annotations:
+        annotation_id = db.execute(
+            "INSERT INTO annotations (file_id, position, namespace, "
+            "annotator, curator, corpus, time, duration, "
+            "annotation_metadata, sandbox) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (file_id,) + row).lastrowid
+        db.executemany(
+            "INSERT INTO observations (annotation_id, time, duration, value, "
+            "value_json, confidence, confidence_json) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(annotation_id,) + obs for obs in observations])
+
+
+def load(db_file, in_dirs, n_jobs=1, batch_size=100):
+    """Loads corpora into the database.
+
+    Parameters
+    ----------
+    db_file : str
+        Path to the SQLite database.
+    in_dirs : list
+        Corpus folders to load. The corpus name is the folder name.
+    n_jobs : int
+        Number of processes parsing the files.
+    batch_size : int
+        Number of files inserted per transaction.
+
+    Returns
+    -------
+    n_files : int
+        Number of inserted (new or changed) files.
+    """
+    db = connect(db_file)
+    known = dict(((corpus, track_id), sha1) for corpus, track_id, sha1 in
+                 db.execute("SELECT corpus, track_id, sha1 FROM files"))
+    tracks = dict()
+    for in_dir in in_dirs:
+        corpus = os.path.basename(os.path.normpath(in_dir))
+        for jams_file in corpus_io.find_jams(in_dir):
+            track_id = corpus_io.get_track_id(jams_file, in_dir)
+            sha1 = corpus_io.file_hash(jams_file)
+            if known.get((corpus, track_id)) != sha1:
+                tracks[jams_file] = (corpus, track_id, sha1)
+    logging.info("Loading %d new or changed files.", len(tracks))
+
+    jams_files = sorted(tracks)
+    n_files = 0
+    for jams_file, rows in corpus_io.iter_load(jams_files, n_jobs,
+                                               func=get_rows):
+        corpus, track_id, sha1 = tracks[jams_file]
+        insert(db, corpus, track_id, jams_file, sha1, rows)
+        n_files += 1
+        if n_files % batch_size == 0:
+            db.commit()
+    db.commit()
+    db.close()
+    return n_files
+
+
+def export_jam(db, file_id):
+    """Rebuilds the JAMS of a file from the database.
+
+    Parameters
+    ----------
+    db : sqlite3.Connection
+        The database.
+    file_id : int
+        ID of the file.
+
+    Returns
+    -------
+    jam : dict
+        The JAMS, in the JAMS >= 0.2 format, with list-of-observations data.
+    """
+    file_metadata, sandbox = db.execute(
+        "SELECT file_metadata, sandbox FROM files WHERE id = ?",
+        (file_id,)).fetchone()
+    jam = dict(file_metadata=json.loads(file_metadata),
+               sandbox=json.loads(sandbox), annotations=[])
+    annotations = db.execute(
+        "SELECT id, namespace, time, duration, annotation_metadata, sandbox "
+        "FROM annotations WHERE file_id = ? ORDER BY position", (file_id,))
+    for annotation_id, namespace, start, duration, metadata, ann_sandbox in \
+            annotations.fetchall():
+        data = [dict(time=obs_time, duration=obs_duration,
+                     value=decode(value, value_json),
+                     confidence=decode(confidence, confidence_json))
+                for obs_time, obs_duration, value, value_json, confidence,
+                confidence_json in db.execute(
+                    "SELECT time, duration, value, value_json, confidence, "
+                    "confidence_json FROM observations "
+                    "WHERE annotation_id = ? ORDER BY rowid",
+                    (annotation_id,))]
+        sandbox = json.loads(ann_sandbox)
+        # Observations are stored decoded
+        sandbox.pop(pitch_encoding.SANDBOX_KEY, None)
+        jam["annotations"].append(dict(
+            namespace=namespace, time=start or 0, duration=duration,
+            annotation_metadata=json.loads(metadata), sandbox=sandbox,
+            data=data))
+    return jam
+
+
+def export(db_file, out_dir, corpus=None):
+    """Exports the files of the database as JAMS files, to
+    `out_dir/<corpus>/<track ID>.jams`. Returns the number of files."""
+    db = sqlite3.connect(db_file)
+    query = "SELECT id, corpus, track_id FROM files"
+    params = ()
+    if corpus is not None:
+        query += " WHERE corpus = ?"
+        params = (corpus,)
+    files = db.execute(query + " ORDER BY corpus, track_id",
+                       params).fetchall()
+    for file_id, file_corpus, track_id in files:
+        out_file = os.path.join(out_dir, file_corpus, track_id + ".jams")
+        if not os.path.isdir(os.path.dirname(out_file)):
+            os.makedirs(os.path.dirname(out_file))
+        json_backend.save_json(export_jam(db, file_id), out_file)
+    db.close()
+    return len(files)
+
+
+def main():
+    """Main function to load, query or export the database."""
+    parser = argparse.ArgumentParser(
+        description="SQLite store of JAMS annotations",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    load_parser = subparsers.add_parser("load", help="Load corpora")
+    load_parser.add_argument("db_file",
+                             action="store",
+                             help="SQLite database")
+    load_parser.add_argument("in_dirs",
+                             action="store",
+                             nargs="+",
+                             help="Corpus folders to load")
+    load_parser.add_argument("-j",
+                             action="store",
+                             dest="n_jobs",
+                             type=int,
+                             default=1,
+                             help="Number of CPUs to run in parallel.")
+    load_parser.add_argument("-b",
+                             action="store",
+                             dest="batch_size",
+                             type=int,
+                             default=100,
+                             help="Number of files inserted per transaction")
+    query_parser = subparsers.add_parser("query", help="Run an SQL query")
+    query_parser.add_argument("db_file",
+                              action="store",
+                              help="SQLite database")
+    query_parser.add_argument("sql",
+                              action="store",
+                              help="SQL query")
+    export_parser = subparsers.add_parser("export", help="Export JAMS files")
+    export_parser.add_argument("db_file",
+                               action="store",
+                               help="SQLite database")
+    export_parser.add_argument("out_dir",
+                               action="store",
+                               help="Output folder")
+    export_parser.add_argument("--corpus",
+                               action="store",
+                               default=None,
+                               help="Only export the files of this corpus")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    if args.command == "load":
+        n_files = load(args.db_file, args.in_dirs, args.n_jobs,
+                       args.batch_size)
+        logging.info("Loaded %d files.", n_files)
+    elif args.command == "query":
+        db = sqlite3.connect(args.db_file)
+        for row in db.execute(args.sql):
+            print("\t".join(str(value) for value in row))
+        db.close()
+    elif args.command == "export":
+        n_files = export(args.db_file, args.out_dir, args.corpus)
+        logging.info("Exported %d files.", n_files)
+    else:
+        parser.print_help()
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Beat-synchronous labels of the corpora with beats and time-aligned label
+annotations (e.g. `chord`, `key_mode` and `segment_open` in Isophonics, or
+`segment_open` in Harmonix).
+
+For every file, the labels of each namespace are sampled at the beats of
+its first `beat` annotation: each beat gets the label of the last
+observation started at or before it, if that observation is still active
+(its end is after the beat), and -1 otherwise. Observations are looked up
+for all the beats at once with `np.searchsorted`.
+
+Labels are encoded with the vocabularies of a `vocabulary.py` store (the
+missing vocabularies are built from the corpus and added to it), so codes
+are shared by all the files (to share them across corpora, build the store
+from all of them first with `vocabulary.py`). The output folder mirrors the
+corpus, with one `.npz` file per track holding:
+
+    - `beats`: beat times, in seconds (float64).
+    - `positions`: beat positions in the bar (NaN if unknown).
+    - `<namespace>`: label codes (int32), one per beat.
+
+A `manifest.json` records the key (file hash, namespaces and vocabularies)
+and number of beats of each track, so rerunning the alignment only processes
+new or modified files.
+
+Usage example:
+    ./beat_sync.py ../datasets/Isophonics isophonics_beats/ -n chord \
+key_mode segment_open -v vocabularies.json -j 8
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+
+from joblib import Parallel, delayed
+import numpy as np
+
+import corpus_io
+import lazy_jams
+import vocabulary
+
+MANIFEST = "manifest.json"
+
+
+def align(beats, columns, vocab):
+    """Samples the labels of an annotation at the given beats.
+
+    Parameters
+    ----------
+    beats : np.ndarray
+        Sorted beat times, in seconds.
+    columns : dict
+        Observation columns of the annotation.
+    vocab : vocabulary.Vocabulary
+        Vocabulary used to encode the labels.
+
+    Returns
+    -------
+    codes : np.ndarray
+        int32 label code of each beat (-1 where no observation is active).
+    """
+    times = np.asarray(columns["time"], dtype=np.float64)
+    ends = times + np.nan_to_num(np.asarray(columns["duration"],
+                                            dtype=np.float64))
+    codes = vocab.encode(columns["value"])
+    order = np.argsort(times, kind="stable")
+    times, ends, codes = times[order], ends[order], codes[order]
+
+    index = np.searchsorted(times, beats, side="right") - 1
+    active = index >= 0
+    active[active] = beats[active] < ends[index[active]]
+    return np.where(active, codes[np.maximum(index, 0)],
+                    vocabulary.UNKNOWN).astype(np.int32)
+
+
+def get_beats(jam):
+    """Sorted beat times and positions of the first beat annotation of a
+    lazily loaded JAMS (None if it has no beats)."""
+    for annotation in jam.iter_annotations("beat"):
+        times = np.asarray(annotation["data"]["time"], dtype=np.float64)
+        positions = np.array([value if isinstance(value, (int, float))
+                              else np.nan
+                              for value in annotation["data"]["value"]],
+                             dtype=np.float64)
+        order = np.argsort(times, kind="stable")
+        return times[order], positions[order]
+    return None
+
+
+def align_file(jams_file, out_file, vocabularies):
+    """Aligns the labels of a file to its beats and saves the arrays.
+
+    Returns
+    -------
+    n_beats : int
+        Number of beats (None if the file has no beats).
+    """
+    jam = lazy_jams.LazyJAMS(jams_file)
+    beats = get_beats(jam)
+    if beats is None:
+        return None
+    arrays = dict(beats=beats[0], positions=beats[1])
+    for namespace, vocab in sorted(vocabularies.items()):
+        for annotation in jam.iter_annotations(namespace):
+            arrays[namespace] = align(beats[0], annotation["data"], vocab)
+            break
+    np.savez(out_file, **arrays)
+    return len(beats[0])
+
+
+def get_key(jams_hash, vocabularies):
+    """Key of the arrays of a file: hash of the file and of the vocabularies
+    of the aligned namespaces."""
+    key = json.dumps([jams_hash] + [[namespace, vocab.labels] for namespace,
+                                    vocab in sorted(vocabularies.items())])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def process(in_dir, out_dir, namespaces, vocabulary_file, n_jobs=1):
+    """Aligns the labels of a corpus to its beats.
+
+    Returns
+    -------
+    manifest : dict
+        Key of the arrays and number of beats (None if the file has no
+        beats) of each track, keyed by track ID.
+    """
+    store = vocabulary.VocabularyStore(vocabulary_file)
+    missing = [namespace for namespace in namespaces
+               if namespace not in store]
+    if missing:
+        logging.info("Building the vocabularies of %s...", ", ".join(missing))
+        store.build([in_dir], missing, n_jobs)
+    vocabularies = dict((namespace, store.get(namespace) or
+                         vocabulary.Vocabulary(namespace, []))
+                        for namespace in namespaces)
+
+    manifest_file = os.path.join(out_dir, MANIFEST)
+    manifest = dict()
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, "r") as fp:
+            manifest = json.load(fp)
+
+    jams_files = corpus_io.find_jams(in_dir)
+    tracks = []
+    for jams_file in jams_files:
+        track_id = corpus_io.get_track_id(jams_file, in_dir)
+        key = get_key(corpus_io.file_hash(jams_file), vocabularies)
+        out_file = os.path.join(out_dir, track_id + ".npz")
+        cached_key, n_beats = manifest.get(track_id, (None, None))
+        if cached_key != key or \
+                (n_beats is not None and not os.path.isfile(out_file)):
+            tracks.append((track_id, jams_file, out_file, key))
+    logging.info("Aligning %d files (%d up to date)...", len(tracks),
+                 len(jams_files) - len(tracks))
+
+    for out_folder in set([out_dir] + [os.path.dirname(out_file)
+                                       for _, _, out_file, _ in tracks]):
+        if not os.path.isdir(out_folder):
+            os.makedirs(out_folder)
+    n_beats = Parallel(n_jobs=n_jobs)(
+        delayed(align_file)(jams_file, out_file, vocabularies)
+        for _, jams_file, out_file, _ in tracks)
+    for (track_id, _, _, key), count in zip(tracks, n_beats):
+        manifest[track_id] = [key, count]
+    with open(manifest_file, "w") as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+    return manifest
+
+
+def main():
+    """Main function to align the labels of a corpus to its beats."""
+    parser = argparse.ArgumentParser(
+        description="Aligns the labels of a corpus to its beats",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("in_dir",
+                        action="store",
+                        help="Folder with the JAMS files")
+    parser.add_argument("out_dir",
+                        action="store",
+                        help="Output folder of the beat-synchronous arrays")
+    parser.add_argument("-n",
+                        action="store",
+                        dest="namespaces",
+                        nargs="+",
+                        default=["chord", "key_mode", "segment_open"],
+                        help="Namespaces of the labels to align")
+    parser.add_argument("-v",
+                        action="store",
+                        dest="vocabulary_file",
+                        default="vocabularies.json",
+                        help="Vocabulary store used to encode the labels "
+                        "(missing vocabularies are added to it)")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Align the labels
+    manifest = process(args.in_dir, args.out_dir, args.namespaces,
+                       args.vocabulary_file, args.n_jobs)
+    logging.info("%d tracks with beats.",
+                 sum(n_beats is not None for _, n_beats in manifest.values()))
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,9 @@ Example:
 -o ~/datasets/McGill-Billboard \
 csv_index=~/billboard-2.0-index.csv
 
+With `--watch`, the parser then keeps watching the input folder, and
+reconverts the tracks whose lab files change.
+
 """
 
 __author__ = "E. J. Humphrey"
@@ -38,12 +41,15 @@ __version__ = "1.0"
 __email__ = "ejhumphrey@nyu.edu"
 
 import argparse
-import json
+import journal
+import json_backend
 import logging
 import os
 import sys
 import time
 import csv
+import sharding
+import watch
 
 sys.path.append("..")
 import pyjams
@@ -105,20 +111,57 @@ def create_JAMS(lab_file, out_file, index_data=None):
     jam.file_metadata.duration = end_times[-1]
 
     # Save JAMS
-    with open(out_file, "w") as fp:
-        json.dump(jam, fp, indent=2)
+    json_backend.save_json(jam, out_file)
+
+
+def get_key(lab_file):
+    """Key of a track: the name of the folder of its lab file."""
+    return lab_file.split("/")[-2]
 
 
-def process(in_dir, out_dir, index_file=None):
+def process(in_dir, out_dir, index_file=None, shard=None, resume=False):
     """Converts the original chord labfiles into the JAMS format, and saves
-    them in the out_dir folder."""
+    them in the out_dir folder (only the tracks of the given (i, N) shard,
+    if any, and not done by the interrupted run if resume is set)."""
 
     index = dict() if index_file is None else read_index(index_file)
     pyjams.util.smkdirs(out_dir)
-    for lab_file in pyjams.util.find_with_extension(in_dir, "lab"):
-        key = lab_file.split("/")[-2]
-        jams_file = os.path.join(out_dir, "%s.jams" % key)
-        create_JAMS(lab_file, jams_file, index.get(key, None))
+    lab_files, keys = sharding.select(
+        pyjams.util.find_with_extension(in_dir, "lab"), shard, key=get_key)
+    with journal.Journal(out_dir, shard, resume) as run:
+        for lab_file in run.todo(lab_files, key=get_key):
+            run.add(get_key(lab_file),
+                    convert_track(lab_file, out_dir, index))
+    sharding.write_manifest(out_dir, shard, keys, run.done)
+    return index
+
+
+def convert_track(lab_file, out_dir, index):
+    """Converts the lab file of a track, named after its folder, and returns
+    the path of its JAMS file."""
+    key = get_key(lab_file)
+    jams_file = os.path.join(out_dir, "%s.jams" % key)
+    # create_JAMS consumes the index data, so the index is kept intact
+    index_data = dict(index[key]) if key in index else None
+    create_JAMS(lab_file, jams_file, index_data)
+    return jams_file
+
+
+def watch_changes(in_dir, out_dir, index):
+    """Watches the input folder and reconverts the tracks whose lab files
+    change, until interrupted."""
+    def on_change(paths):
+        for lab_file in paths:
+            if lab_file.endswith(".lab") and os.path.isfile(lab_file):
+                logging.info("Converting %s...", lab_file)
+                # Files being edited may be empty or invalid for a while, so
+                # an error only skips the track until its next change
+                try:
+                    convert_track(lab_file, out_dir, index)
+                except Exception:
+                    logging.exception("Could not convert %s", lab_file)
+
+    watch.watch(in_dir, on_change)
 
 
 def main():
@@ -139,6 +182,20 @@ def main():
                         dest="index_file",
                         default="",
                         help="Path to the provided CSV track index.")
+    parser.add_argument("--watch",
+                        action="store_true",
+                        help="Keep watching the input folder and reconvert "
+                        "the tracks whose lab files change")
+    parser.add_argument("--shard",
+                        action="store",
+                        type=sharding.parse_shard,
+                        default=None,
+                        help="Only convert the i-th of N shards of the "
+                        "tracks, given as i/N")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Resume an interrupted run, skipping the tracks "
+                        "in its journal")
     args = parser.parse_args()
     start_time = time.time()
 
@@ -146,7 +203,10 @@ def main():
     logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
 
     # Run the parser
-    process(args.in_dir, args.out_dir, args.index_file)
+    index = process(args.in_dir, args.out_dir, args.index_file, args.shard,
+                    args.resume)
+    if args.watch:
+        watch_changes(args.in_dir, args.out_dir, index)
 
     # Done!
     logging.info("Done! Took %.2f seconds.", time.time() - start_time)
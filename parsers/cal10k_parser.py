@@ -13,6 +13,10 @@ import audioread
 import pandas as pd
 import jams
 
+import journal
+import json_backend
+import sharding
+
 __curator__ = dict(name='Derek Tingle')
 __corpus__ = 'CAL10K'
 
@@ -51,7 +55,8 @@ def save_jam(output_dir, jam, id_num, compress):
     outfile = os.path.join(output_dir, outfile)
 
     print('Saving {:s}'.format(outfile))
-    jam.save(outfile)
+    json_backend.save_jam(jam, outfile)
+    return outfile
 
 
 def process_track(input_dir, output_dir, metadata, tags, compress):
@@ -81,11 +86,13 @@ def process_track(input_dir, output_dir, metadata, tags, compress):
     jam.annotations.append(ann)
     jam.sandbox.content_path = metadata['filename']
 
-    save_jam(output_dir, jam, metadata.name, compress)
+    return save_jam(output_dir, jam, metadata.name, compress)
     
 
-def parse_cal10k(input_dir=None, output_dir=None, compress=False):
-    '''Convert CAL10K to jams format'''
+def parse_cal10k(input_dir=None, output_dir=None, compress=False, shard=None,
+                 resume=False):
+    '''Convert CAL10K to jams format (only the songs of the given (i, N)
+    shard, if any, and not done by the interrupted run if resume is set)'''
 
     # First, get the song list
     songs = pd.read_table(os.path.join(input_dir, 'songList.tab'),
@@ -97,15 +104,21 @@ def parse_cal10k(input_dir=None, output_dir=None, compress=False):
                            songs)
 
     # Finally, build out the JAMS list
-    for song_id, metadata in songs.iterrows():
-        try:
-            process_track(input_dir,
-                          output_dir,
-                          metadata,
-                          tag_matrix.loc[song_id].dropna().index,
-                          compress)
-        except IOError as exc:
-            print('Could not process file: {:s}, skipping.'.format(songs['filename'][song_id]))
+    rows, song_ids = sharding.select(songs.iterrows(), shard,
+                                     key=lambda row: row[0])
+    with journal.Journal(output_dir, shard, resume) as run:
+        for song_id, metadata in run.todo(rows, key=lambda row: row[0]):
+            try:
+                run.add(song_id,
+                        process_track(input_dir,
+                                      output_dir,
+                                      metadata,
+                                      tag_matrix.loc[song_id].dropna().index,
+                                      compress))
+            except IOError as exc:
+                print('Could not process file: {:s}, skipping.'.format(songs['filename'][song_id]))
+
+    sharding.write_manifest(output_dir, shard, song_ids, run.done)
 
 
 
@@ -124,6 +137,18 @@ def parse_arguments(args):
     parser.add_argument('-z', '--zip', dest='compress', 
                         action='store_true', help='Compress jams output')
 
+    parser.add_argument('--shard',
+                        dest='shard',
+                        type=sharding.parse_shard,
+                        default=None,
+                        help='Only convert the i-th of N shards of the '
+                        'tracks, given as i/N')
+
+    parser.add_argument('--resume', dest='resume',
+                        action='store_true',
+                        help='Resume an interrupted run, skipping the tracks '
+                        'in its journal')
+
     return vars(parser.parse_args(args))
 
 
@@ -13,6 +13,10 @@ import audioread
 import pandas as pd
 import jams
 
+import journal
+import json_backend
+import sharding
+
 __curator__ = dict(name='Doug Turnbull')
 __corpus__ = 'CAL500'
 
@@ -65,7 +69,8 @@ def save_jam(output_dir, jam, id_num, compress):
     outfile = os.path.join(output_dir, outfile)
 
     print('Saving {:s}'.format(outfile))
-    jam.save(outfile)
+    json_backend.save_jam(jam, outfile)
+    return outfile
 
 
 def process_track(input_dir, output_dir, metadata, tags, compress):
@@ -106,11 +111,13 @@ def process_track(input_dir, output_dir, metadata, tags, compress):
     jam.annotations.append(ann)
     jam.sandbox.content_path = metadata['track']
 
-    save_jam(output_dir, jam, metadata.name, compress)
+    return save_jam(output_dir, jam, metadata.name, compress)
 
 
-def parse_cal500(input_dir=None, output_dir=None, compress=False):
-    '''Convert CAL500 to jams format'''
+def parse_cal500(input_dir=None, output_dir=None, compress=False, shard=None,
+                 resume=False):
+    '''Convert CAL500 to jams format (only the songs of the given (i, N)
+    shard, if any, and not done by the interrupted run if resume is set)'''
 
     # First, get the song list
     songs = pd.read_table(os.path.join(input_dir, 'songNames.txt'),
@@ -120,17 +127,23 @@ def parse_cal500(input_dir=None, output_dir=None, compress=False):
     tag_matrix = load_tags(input_dir, songs)
 
     # Finally, build out the JAMS list
-    for _, metadata in songs.iterrows():
-        song_id = metadata['track']
-        try:
-            process_track(input_dir,
-                          output_dir,
-                          metadata,
-                          tag_matrix.loc[song_id][tag_matrix.loc[song_id].nonzero()[0]],
-                          compress)
+    rows, song_ids = sharding.select(songs.iterrows(), shard,
+                                     key=lambda row: row[1]['track'])
+    with journal.Journal(output_dir, shard, resume) as run:
+        for _, metadata in run.todo(rows, key=lambda row: row[1]['track']):
+            song_id = metadata['track']
+            try:
+                run.add(song_id,
+                        process_track(input_dir,
+                                      output_dir,
+                                      metadata,
+                                      tag_matrix.loc[song_id][tag_matrix.loc[song_id].nonzero()[0]],
+                                      compress))
+
+            except IOError as exc:
+                print('Could not process file: {:s}, skipping.'.format(song_id))
 
-        except IOError as exc:
-            print('Could not process file: {:s}, skipping.'.format(song_id))
+    sharding.write_manifest(output_dir, shard, song_ids, run.done)
 
 
 
@@ -149,6 +162,18 @@ def parse_arguments(args):
     parser.add_argument('-z', '--zip', dest='compress', 
                         action='store_true', help='Compress jams output')
 
+    parser.add_argument('--shard',
+                        dest='shard',
+                        type=sharding.parse_shard,
+                        default=None,
+                        help='Only convert the i-th of N shards of the '
+                        'tracks, given as i/N')
+
+    parser.add_argument('--resume', dest='resume',
+                        action='store_true',
+                        help='Resume an interrupted run, skipping the tracks '
+                        'in its journal')
+
     return vars(parser.parse_args(args))
 
 
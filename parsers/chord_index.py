@@ -0,0 +1,491 @@
+#!/usr/bin/env python
+"""
+Chord-progression n-gram index over the chord corpora (Billboard-Chords,
+Isophonics, tmc323 and RockCorpus).
+
+Chord labels are normalized to a root pitch class and a reduced quality
+(Harte labels as well as the Roman numerals of RockCorpus), consecutive
+repetitions are collapsed, and every n-gram of consecutive distinct chords
+(for every n up to `max_n`) is recorded with a posting pointing to its
+position in the chord sequence of its annotation. No-chord (`N`) and
+unknown (`X`) chords break progressions. The same n-grams are also indexed
+by their root intervals, to answer transposition-invariant queries.
+
+The index is a folder of `.npy` arrays (memory-mapped when queried) plus a
+`meta.json` file with the list of files and annotations. Queries longer
+than `max_n` are answered by looking up their first `max_n` chords and
+verifying the rest against the stored sequences.
+
+Usage examples:
+    ./chord_index.py build chord_idx ../datasets/Billboard-Chords \
+../datasets/Isophonics ../datasets/tmc323 ../datasets/RockCorpus
+    ./chord_index.py query chord_idx C:maj G:maj A:min F:maj [--transpose]
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import time
+
+from joblib import Parallel, delayed
+import numpy as np
+
+import corpus_io
+
+CHORD_NAMESPACES = ["chord", "chord_harte", "chord_roman"]
+
+NOTES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+
+# Normalized qualities of the Harte shorthands
+QUALITIES = {
+    "": "maj", "maj": "maj", "min": "min", "dim": "dim", "aug": "aug",
+    "7": "7", "9": "7", "11": "7", "13": "7",
+    "maj7": "maj7", "maj9": "maj7", "maj11": "maj7", "maj13": "maj7",
+    "min7": "min7", "min9": "min7", "min11": "min7", "min13": "min7",
+    "minmaj7": "minmaj7", "maj6": "maj6", "min6": "min6",
+    "dim7": "dim7", "hdim7": "hdim7", "sus2": "sus2", "sus4": "sus4",
+    "5": "5", "1": "1"
+}
+
+# Reductions of the normalized qualities (qualities left out of a reduction
+# are encoded as unknown chords)
+REDUCTIONS = {
+    "full": dict((q, q) for q in set(QUALITIES.values())),
+    "majmin": {"maj": "maj", "7": "maj", "maj7": "maj", "maj6": "maj",
+               "aug": "maj", "min": "min", "min7": "min", "min6": "min",
+               "minmaj7": "min", "dim": "min", "dim7": "min", "hdim7": "min"}
+}
+
+ROMAN_DEGREES = [("VII", 11), ("VI", 9), ("IV", 5), ("V", 7), ("III", 4),
+                 ("II", 2), ("I", 0)]
+
+NO_CHORD = "N"
+ARRAYS = ["codes", "times", "ann_offsets", "keys", "postings", "rel_keys",
+          "rel_postings"]
+
+
+def parse_root(root):
+    """Pitch class of a note name such as `C`, `F#` or `Bb`."""
+    pitch = NOTES[root[0].upper()]
+    for accidental in root[1:]:
+        pitch += 1 if accidental == "#" else -1 if accidental == "b" else 0
+    return pitch % 12
+
+
+def normalize_harte(label):
+    """Normalizes a Harte chord label.
+
+    Parameters
+    ----------
+    label : str
+        Chord label, e.g. `C:min7/b3`.
+
+    Returns
+    -------
+    chord : tuple or str
+        `(root, quality)` tuple, or `N` for no-chord and None for chords
+        that can not be parsed.
+    """
+    label = label.strip()
+    if label in ["N", ""]:
+        return NO_CHORD
+    match = re.match(r"^([A-Ga-g][#b]*)(?::([^(/]*))?(\([^)]*\))?(/.*)?$",
+                     label)
+    if match is None:
+        return None
+    shorthand = match.group(2) or ""
+    quality = QUALITIES.get(shorthand)
+    if not shorthand and match.group(3):
+        # Interval list only, e.g. `C:(1,b3,5)`
+        intervals = match.group(3)[1:-1].split(",")
+        quality = "min" if "b3" in intervals else \
+            "maj" if "3" in intervals else None
+    if quality is None:
+        return None
+    return parse_root(match.group(1)), quality
+
+
+def normalize_roman(value):
+    """Normalizes a Roman numeral chord value (`chord_roman` namespace).
+
+    Parameters
+    ----------
+    value : dict
+        Value with `tonic` (e.g. `C`) and `chord` (e.g. `V7/vi`) keys.
+
+    Returns
+    -------
+    chord : tuple or None
+        `(root, quality)` tuple, or None if it can not be parsed.
+    """
+    tonic = parse_root(value["tonic"])
+    chords = value["chord"].split("/")
+    for secondary in reversed(chords[1:]):
+        chord = normalize_roman({"tonic": value["tonic"], "chord": secondary})
+        if chord is None:
+            return None
+        tonic = chord[0]
+    match = re.match(r"^([b#]*)(VII|VI|IV|V|III|II|I)(.*)$", chords[0],
+                     re.IGNORECASE)
+    if match is None:
+        return None
+    accidentals, numeral, figure = match.groups()
+    root = tonic + dict(ROMAN_DEGREES)[numeral.upper()]
+    root += accidentals.count("#") - accidentals.count("b")
+    minor = numeral.islower()
+    figure = re.sub(r"add\d+", "", figure)
+    seventh = re.search(r"7|9|11|13|65|43|42", figure) is not None
+    if "x" in figure:
+        quality = "dim7"
+    elif "h" in figure:
+        quality = "hdim7"
+    elif "o" in figure:
+        quality = "dim"
+    elif "s4" in figure:
+        quality = "sus4"
+    elif figure.startswith("a"):
+        quality = "aug"
+    elif seventh:
+        quality = "min7" if minor else "7"
+    else:
+        quality = "min" if minor else "maj"
+    return root % 12, quality
+
+
+class ChordVocabulary(object):
+    """Integer codes of the normalized chords for a given reduction.
+
+    Code `12 * q + root` encodes quality number `q` on pitch class `root`,
+    and the last two codes are reserved for no-chord and unknown chords.
+    """
+    def __init__(self, reduction="majmin"):
+        self.reduction = reduction
+        self.qualities = sorted(set(REDUCTIONS[reduction].values()))
+        self.no_chord = 12 * len(self.qualities)
+        self.unknown = self.no_chord + 1
+        self.size = self.unknown + 1
+
+    def encode(self, chord):
+        """Code of a normalized chord, as returned by `normalize_harte` or
+        `normalize_roman`."""
+        if chord == NO_CHORD:
+            return self.no_chord
+        if chord is None:
+            return self.unknown
+        quality = REDUCTIONS[self.reduction].get(chord[1])
+        if quality is None:
+            return self.unknown
+        return 12 * self.qualities.index(quality) + chord[0]
+
+    def encode_label(self, label, namespace="chord"):
+        """Code of a chord label of a given namespace."""
+        if namespace == "chord_roman":
+            return self.encode(normalize_roman(label))
+        return self.encode(normalize_harte(label))
+
+    def decode(self, code):
+        """Label of a chord code."""
+        if code == self.no_chord:
+            return NO_CHORD
+        if code == self.unknown:
+            return "X"
+        return "%s:%s" % (corpus_io.PITCH_CLASSES[code % 12],
+                          self.qualities[code // 12])
+
+    def relative(self, codes):
+        """Transposition-invariant codes of a chord sequence: the root of
+        each chord is expressed relative to the root of the first chord.
+
+        Parameters
+        ----------
+        codes : np.ndarray
+            `(n_windows, n)` matrix of chord codes (no N or X chords).
+        """
+        roots = codes % 12
+        return codes - roots + (roots - roots[:, :1]) % 12
+
+
+def get_sequence(annotation, vocabulary):
+    """Chord code sequence of an annotation, with consecutive repetitions
+    collapsed.
+
+    Returns
+    -------
+    codes : np.ndarray
+        Chord codes.
+    times : np.ndarray
+        Start time of each chord.
+    """
+    codes = np.array([vocabulary.encode_label(value, annotation["namespace"])
+                      for value in annotation["data"]["value"]],
+                     dtype=np.int64)
+    times = np.asarray(annotation["data"]["time"], dtype=np.float64)
+    order = np.argsort(times, kind="mergesort")
+    codes, times = codes[order], times[order]
+    changes = np.ones(len(codes), dtype=bool)
+    changes[1:] = codes[1:] != codes[:-1]
+    return codes[changes], times[changes]
+
+
+def read_sequences(jams_file, vocabulary):
+    """Reads the chord sequences of all the chord annotations of a file.
+
+    Returns
+    -------
+    sequences : list
+        `(annotation number, namespace, corpus, codes, times)` tuples.
+    """
+    jam = corpus_io.load_jam(jams_file)
+    sequences = []
+    for i, annotation in enumerate(corpus_io.iter_annotations(jam)):
+        if annotation["namespace"] not in CHORD_NAMESPACES:
+            continue
+        codes, times = get_sequence(annotation, vocabulary)
+        sequences.append((i, annotation["namespace"],
+                          annotation["annotation_metadata"].get("corpus"),
+                          codes, times))
+    return sequences
+
+
+def get_windows(codes, ann_offsets, n, vocabulary):
+    """Finds all the n-grams without N or X chords that do not cross
+    annotation boundaries.
+
+    Returns
+    -------
+    positions : np.ndarray
+        Position of the first chord of each n-gram.
+    windows : np.ndarray
+        `(n_windows, n)` matrix with the chord codes of each n-gram.
+    """
+    if len(codes) < n:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, n), dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, n)
+    positions = np.arange(len(windows))
+    # Annotation of the first and last chord of each window
+    first = np.searchsorted(ann_offsets, positions, side="right")
+    last = np.searchsorted(ann_offsets, positions + n - 1, side="right")
+    valid = (first == last) & np.all(windows < vocabulary.no_chord, axis=1)
+    return positions[valid], windows[valid]
+
+
+def encode_keys(windows, vocabulary):
+    """Encodes n-gram windows as int64 keys. Codes are shifted by one so
+    that n-grams of different lengths get different keys."""
+    keys = np.zeros(len(windows), dtype=np.int64)
+    for column in windows.T:
+        keys = keys * (vocabulary.size + 1) + column + 1
+    return keys
+
+
+def build(out_dir, in_dirs, max_n=4, reduction="majmin", n_jobs=1):
+    """Builds a chord n-gram index.
+
+    Parameters
+    ----------
+    out_dir : str
+        Folder where the index is stored.
+    in_dirs : list
+        Folders with the JAMS files to index.
+    max_n : int
+        Maximum length of the indexed n-grams.
+    reduction : str
+        Chord quality reduction (`majmin` or `full`).
+    n_jobs : int
+        Number of parallel jobs.
+    """
+    vocabulary = ChordVocabulary(reduction)
+    assert (vocabulary.size + 1) ** max_n < 2 ** 63, "max_n is too large"
+
+    jams_files = []
+    for in_dir in in_dirs:
+        jams_files += corpus_io.find_jams(in_dir)
+    all_sequences = Parallel(n_jobs=n_jobs)(
+        delayed(read_sequences)(jams_file, vocabulary)
+        for jams_file in jams_files)
+
+    annotations = []
+    codes = []
+    times = []
+    for file_id, sequences in enumerate(all_sequences):
+        for ann_number, namespace, corpus, seq_codes, seq_times in sequences:
+            annotations.append([file_id, ann_number, namespace, corpus])
+            codes.append(seq_codes)
+            times.append(seq_times)
+    lengths = np.array([len(c) for c in codes], dtype=np.int64)
+    arrays = dict(codes=np.concatenate(codes + [[]]).astype(np.int16),
+                  times=np.concatenate(times + [[]]),
+                  ann_offsets=np.concatenate(([0], np.cumsum(lengths))))
+
+    all_keys, all_positions, all_rel_keys = [], [], []
+    for n in range(1, max_n + 1):
+        positions, windows = get_windows(arrays["codes"].astype(np.int64),
+                                         arrays["ann_offsets"][1:], n,
+                                         vocabulary)
+        all_keys.append(encode_keys(windows, vocabulary))
+        all_rel_keys.append(encode_keys(vocabulary.relative(windows),
+                                        vocabulary))
+        all_positions.append(positions)
+    for name, keys in [("", all_keys), ("rel_", all_rel_keys)]:
+        keys = np.concatenate(keys)
+        positions = np.concatenate(all_positions).astype(np.int32)
+        order = np.argsort(keys, kind="mergesort")
+        arrays[name + "keys"] = keys[order]
+        arrays[name + "postings"] = positions[order]
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    for name in ARRAYS:
+        np.save(os.path.join(out_dir, name + ".npy"), arrays[name])
+    meta = dict(reduction=reduction, max_n=max_n, files=jams_files,
+                annotations=annotations)
+    with open(os.path.join(out_dir, "meta.json"), "w") as fp:
+        json.dump(meta, fp, indent=2)
+    logging.info("Indexed %d chords from %d annotations in %d files.",
+                 len(arrays["codes"]), len(annotations), len(jams_files))
+
+
+class ChordIndex(object):
+    """Chord n-gram index built by `build`.
+
+    Parameters
+    ----------
+    index_dir : str
+        Folder where the index is stored.
+    """
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "meta.json"), "r") as fp:
+            self.meta = json.load(fp)
+        self.vocabulary = ChordVocabulary(self.meta["reduction"])
+        self.arrays = dict(
+            (name, np.load(os.path.join(index_dir, name + ".npy"),
+                           mmap_mode="r"))
+            for name in ARRAYS)
+
+    def query(self, labels, transpose=False):
+        """Finds the occurrences of a chord progression.
+
+        Parameters
+        ----------
+        labels : list
+            Harte chord labels of the progression, e.g.
+            `["C:maj", "G:maj", "A:min", "F:maj"]`.
+        transpose : bool
+            Whether to match the progression in any transposition.
+
+        Returns
+        -------
+        results : list
+            `(jams_file, annotation number, start time, matched labels)`
+            tuples, one per occurrence.
+        """
+        codes = [self.vocabulary.encode_label(label) for label in labels]
+        codes = np.array([code for i, code in enumerate(codes)
+                          if i == 0 or code != codes[i - 1]], dtype=np.int64)
+        if len(codes) == 0 or np.any(codes >= self.vocabulary.no_chord):
+            raise ValueError("Progression with no-chord or unknown chords: "
+                             "%s" % labels)
+        if transpose:
+            codes = self.vocabulary.relative(codes[np.newaxis])[0]
+        prefix = "rel_" if transpose else ""
+        n = min(len(codes), self.meta["max_n"])
+        key = encode_keys(codes[np.newaxis, :n], self.vocabulary)[0]
+        keys = self.arrays[prefix + "keys"]
+        low, high = np.searchsorted(keys, [key, key + 1])
+        positions = np.asarray(self.arrays[prefix + "postings"][low:high],
+                               dtype=np.int64)
+        ann_offsets = self.arrays["ann_offsets"]
+        ann_ids = np.searchsorted(ann_offsets, positions, side="right") - 1
+
+        # Verify the chords that do not fit in the indexed n-grams
+        if len(codes) > n:
+            fits = positions + len(codes) <= ann_offsets[ann_ids + 1]
+            positions, ann_ids = positions[fits], ann_ids[fits]
+            windows = np.asarray(self.arrays["codes"],
+                                 dtype=np.int64)[positions[:, np.newaxis] +
+                                                 np.arange(len(codes))]
+            if transpose:
+                windows = self.vocabulary.relative(windows)
+            matches = np.all(windows == codes, axis=1)
+            positions, ann_ids = positions[matches], ann_ids[matches]
+
+        results = []
+        for position, ann_id in zip(positions, ann_ids):
+            file_id, ann_number = self.meta["annotations"][ann_id][:2]
+            matched = [self.vocabulary.decode(code) for code in
+                       self.arrays["codes"][position:position + len(codes)]]
+            results.append((self.meta["files"][file_id], ann_number,
+                            float(self.arrays["times"][position]), matched))
+        return sorted(results)
+
+
+def main():
+    """Main function to build or query a chord n-gram index."""
+    parser = argparse.ArgumentParser(
+        description="Chord-progression n-gram index",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    build_parser = subparsers.add_parser("build", help="Build an index")
+    build_parser.add_argument("index_dir",
+                              action="store",
+                              help="Output index folder")
+    build_parser.add_argument("in_dirs",
+                              action="store",
+                              nargs="+",
+                              help="Folders with the JAMS files to index")
+    build_parser.add_argument("-n",
+                              action="store",
+                              dest="max_n",
+                              type=int,
+                              default=4,
+                              help="Maximum n-gram length")
+    build_parser.add_argument("-r",
+                              action="store",
+                              dest="reduction",
+                              choices=sorted(REDUCTIONS.keys()),
+                              default="majmin",
+                              help="Chord quality reduction")
+    build_parser.add_argument("-j",
+                              action="store",
+                              dest="n_jobs",
+                              type=int,
+                              default=1,
+                              help="Number of CPUs to run in parallel.")
+    query_parser = subparsers.add_parser("query", help="Query an index")
+    query_parser.add_argument("index_dir",
+                              action="store",
+                              help="Index folder")
+    query_parser.add_argument("labels",
+                              action="store",
+                              nargs="+",
+                              help="Chord labels of the progression")
+    query_parser.add_argument("--transpose",
+                              action="store_true",
+                              help="Match the progression in any "
+                                   "transposition")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    if args.command == "build":
+        build(args.index_dir, args.in_dirs, args.max_n, args.reduction,
+              args.n_jobs)
+    elif args.command == "query":
+        index = ChordIndex(args.index_dir)
+        results = index.query(args.labels, args.transpose)
+        for jams_file, ann_number, start, matched in results:
+            print("%s [%d] %.3f: %s" % (jams_file, ann_number, start,
+                                         " ".join(matched)))
+        logging.info("%d occurrences found.", len(results))
+    else:
+        parser.print_help()
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+"""
+Helpers to read the JAMS files of the `datasets/` folder as plain JSON.
+
+The corpora in `datasets/` were converted over several years with different
+versions of JAMS, so the files come in three flavours:
+
+    - JAMS >= 0.2 files with an `annotations` list, whose `data` is either a
+      list of observations or a dictionary of columns.
+    - `pitch_hz` annotations stored with the uniform-hop encoding of
+      `pitch_encoding.py`.
+    - Early (pyjams) files with one list of annotations per namespace
+      (`chord`, `beat`, `note`, ...) and `start`/`end`/`label` records.
+
+`iter_annotations` hides these differences and yields every annotation with
+its observations as a dictionary of `time`, `duration`, `value` and
+`confidence` columns, which is what the corpus tools in this folder work on.
+
+`iter_load` reads many files at once, decompressing and parsing them across
+a process pool. Run as a script, it loads a whole corpus this way:
+
+    ./corpus_io.py ../datasets/CAL10K -j 8 --json_backend orjson
+"""
+
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import hashlib
+import logging
+import os
+import time
+
+import json_backend
+import pitch_encoding
+
+JAMS_EXTENSIONS = ["jams", "jamz"]
+
+FIELDS = ["time", "duration", "value", "confidence"]
+
+# Namespaces of the early (pyjams) files
+OLD_NAMESPACES = {
+    "beat": "beat",
+    "chord": "chord",
+    "key": "key_mode",
+    "melody": "pitch_hz",
+    "note": "note_midi",
+    "onset": "onset",
+    "segment": "segment_open",
+    "tag": "tag_open"
+}
+
+PITCH_CLASSES = ["C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb",
+                 "B"]
+
+
+def find_jams(root):
+    """Finds all the JAMS files (compressed or not) under a given folder.
+
+    Parameters
+    ----------
+    root : str
+        Path to the folder to search (or to a single JAMS file).
+
+    Returns
+    -------
+    files : list
+        Sorted list of paths to the JAMS files.
+    """
+    if os.path.isfile(root):
+        return [root]
+    files = []
+    for path, _, filenames in os.walk(root):
+        for filename in filenames:
+            if os.path.splitext(filename)[1][1:] in JAMS_EXTENSIONS:
+                files.append(os.path.join(path, filename))
+    return sorted(files)
+
+
+def open_jams(jams_file, mode="rb"):
+    """Opens a JAMS file, decompressing it if it is a `.jamz` file."""
+    if jams_file.endswith(".jamz"):
+        return gzip.open(jams_file, mode)
+    return open(jams_file, mode)
+
+
+def load_jam(jams_file, backend=None):
+    """Loads a JAMS file as a JSON dictionary, parsed with the given
+    `json_backend` backend (the fastest installed one by default)."""
+    with open_jams(jams_file) as fp:
+        return json_backend.loads(fp.read(), backend)
+
+
+def _load_batch(jams_files, backend, func):
+    """Loads a batch of JAMS files in a worker process, applying func to
+    each of them if given."""
+    results = []
+    for jams_file in jams_files:
+        jam = load_jam(jams_file, backend)
+        results.append(jam if func is None else func(jam))
+    return results
+
+
+def iter_load(jams_files, n_jobs=1, batch_size=32, max_in_flight=None,
+              backend=None, func=None):
+    """Loads many JAMS files, decompressing and parsing them in parallel.
+
+    Files are sent to a process pool in batches, and at most `max_in_flight`
+    batches are submitted (or waiting to be consumed) at any time, which
+    bounds the memory used by results that are not consumed yet.
+
+    Parameters
+    ----------
+    jams_files : list
+        Paths to the JAMS files.
+    n_jobs : int
+        Number of worker processes (-1 to use all the CPUs).
+    batch_size : int
+        Number of files loaded per task.
+    max_in_flight : int
+        Maximum number of pending batches (defaults to twice n_jobs).
+    backend : str
+        Name of the JSON backend (see `json_backend.get_backend`).
+    func : callable
+        Picklable function applied to each loaded JAMS in the workers, so
+        only its (smaller) result is sent back to the parent process.
+
+    Yields
+    ------
+    jams_file : str
+        Path to the JAMS file, in the order of jams_files.
+    jam : dict
+        The loaded JAMS (or the result of func on it).
+    """
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs == 1:
+        for jams_file in jams_files:
+            yield jams_file, _load_batch([jams_file], backend, func)[0]
+        return
+
+    max_in_flight = max_in_flight or 2 * n_jobs
+    batches = [jams_files[i:i + batch_size]
+               for i in range(0, len(jams_files), batch_size)]
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        for batch in batches:
+            pending.append((batch, pool.submit(_load_batch, batch, backend,
+                                               func)))
+            if len(pending) >= max_in_flight:
+                batch, future = pending.popleft()
+                for item in zip(batch, future.result()):
+                    yield item
+        while pending:
+            batch, future = pending.popleft()
+            for item in zip(batch, future.result()):
+                yield item
+
+
+def file_hash(path, block_size=1 << 20):
+    """Computes the SHA-1 hex digest of the contents of a file."""
+    sha = hashlib.sha1()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def get_track_id(jams_file, root):
+    """Identifier of a track: the path of its JAMS file relative to the
+    corpus root, without extension."""
+    if os.path.isfile(root):
+        root = os.path.dirname(root)
+    return os.path.splitext(os.path.relpath(jams_file, root))[0]
+
+
+def get_duration(jam):
+    """Gets the duration of a track, either from the file metadata or from
+    the end of its last observation."""
+    duration = jam.get("file_metadata", {}).get("duration")
+    if duration:
+        return float(duration)
+    duration = 0.0
+    for annotation in iter_annotations(jam):
+        for start, dur in zip(annotation["data"]["time"],
+                              annotation["data"]["duration"]):
+            duration = max(duration, start + (dur or 0.0))
+    return duration
+
+
+def _old_value(label, corpus):
+    """Converts the label of an early (pyjams) record into a value."""
+    value = label.get("value")
+    secondary = label.get("secondary_value")
+    if corpus == "Rock Corpus" and isinstance(value, str) and \
+            secondary is not None:
+        # Roman numerals, with the pitch class of the key as secondary value
+        return {"tonic": PITCH_CLASSES[int(secondary) % 12], "chord": value}
+    return value
+
+
+def _old_columns(data, corpus):
+    """Gets the observation columns of an early (pyjams) annotation."""
+    columns = {field: [] for field in FIELDS}
+    for record in data:
+        label = record.get("label", {})
+        if "start" in record:
+            start = record["start"]["value"]
+            duration = record["end"]["value"] - start
+        else:
+            start = record["time"]["value"]
+            duration = 0.0
+        columns["time"].append(start)
+        columns["duration"].append(duration)
+        columns["value"].append(_old_value(label, corpus))
+        columns["confidence"].append(label.get("confidence"))
+    return columns
+
+
+def get_columns(annotation):
+    """Gets the observation columns of a JAMS >= 0.2 annotation."""
+    encoding = annotation.get("sandbox", {}).get(pitch_encoding.SANDBOX_KEY)
+    if encoding is not None:
+        return pitch_encoding.decode_uniform_hop(encoding)
+    return pitch_encoding.get_columns(annotation["data"])
+
+
+def iter_annotations(jam, namespace=None):
+    """Iterates over the annotations of a JAMS dictionary.
+
+    Parameters
+    ----------
+    jam : dict
+        JAMS file loaded as JSON.
+    namespace : str
+        If given, only annotations of this namespace are returned.
+
+    Yields
+    ------
+    annotation : dict
+        Annotation with `namespace`, `annotation_metadata`, `sandbox` and
+        `data` keys, where `data` is a dictionary of observation columns.
+    """
+    if "annotations" in jam:
+        for annotation in jam["annotations"]:
+            if namespace is not None and annotation["namespace"] != namespace:
+                continue
+            yield {"namespace": annotation["namespace"],
+                   "annotation_metadata":
+                       annotation.get("annotation_metadata", {}),
+                   "sandbox": annotation.get("sandbox", {}),
+                   "data": get_columns(annotation)}
+        return
+
+    for key, annotations in sorted(jam.items()):
+        if key not in OLD_NAMESPACES:
+            continue
+        for annotation in annotations:
+            metadata = annotation.get("annotation_metadata", {})
+            ns = OLD_NAMESPACES[key]
+            data = _old_columns(annotation["data"], metadata.get("corpus"))
+            if ns == "chord" and data["value"] and \
+                    isinstance(data["value"][0], dict):
+                ns = "chord_roman"
+            if namespace is not None and ns != namespace:
+                continue
+            yield {"namespace": ns,
+                   "annotation_metadata": metadata,
+                   "sandbox": annotation.get("sandbox", {}),
+                   "data": data}
+
+
+def main():
+    """Main function to bulk load a corpus."""
+    parser = argparse.ArgumentParser(
+        description="Loads all the JAMS files of a corpus in parallel",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("in_dir",
+                        action="store",
+                        help="Folder with the JAMS files")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    parser.add_argument("-b",
+                        action="store",
+                        dest="batch_size",
+                        type=int,
+                        default=32,
+                        help="Number of files loaded per task")
+    parser.add_argument("--json_backend",
+                        action="store",
+                        default=None,
+                        choices=json_backend.BACKENDS,
+                        help="JSON backend (the fastest installed one by "
+                             "default)")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Load the corpus
+    jams_files = find_jams(args.in_dir)
+    n_annotations = 0
+    for _, jam in iter_load(jams_files, args.n_jobs, args.batch_size,
+                            backend=args.json_backend):
+        n_annotations += len(list(iter_annotations(jam)))
+    logging.info("Loaded %d annotations from %d files.", n_annotations,
+                 len(jams_files))
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""
+Packs a corpus of JAMS files into a single archive file, with an offset
+index for random access to any track.
+
+The archive layout is:
+
+    - A 32 bytes header: the `JAMSPACK` magic string, the format version
+      and the offset and length of the index (little-endian).
+    - The JAMS files, stored as is (`.jamz` files remain gzipped) and
+      concatenated in track ID order.
+    - The index: a JSON dictionary mapping each track ID (the path of its
+      JAMS file relative to the corpus folder, without extension) to the
+      offset, length and extension of the file.
+
+`CorpusArchive` memory-maps the archive, so opening a track is a single
+slice of the mapping, and copying a corpus is a single sequential copy.
+
+Usage examples:
+    ./corpus_pack.py pack ../datasets/CAL10K CAL10K.jpack
+    ./corpus_pack.py list CAL10K.jpack
+    ./corpus_pack.py get CAL10K.jpack 100 -o out.jamz
+    ./corpus_pack.py unpack CAL10K.jpack CAL10K/
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+import corpus_io
+import json_backend
+
+MAGIC = b"JAMSPACK"
+VERSION = 1
+HEADER = struct.Struct("<8sIxxxxQQ")
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def pack(in_dir, archive_file):
+    """Packs all the JAMS files of a folder into an archive.
+
+    Parameters
+    ----------
+    in_dir : str
+        Folder with the JAMS files.
+    archive_file : str
+        Path to the output archive.
+
+    Returns
+    -------
+    n_files : int
+        Number of packed files.
+
+    Raises
+    ------
+    ValueError
+        If a track has several files (e.g. both `.jams` and `.jamz`), as
+        the archive holds a single file per track ID.
+    """
+    jams_files, duplicates = dict(), dict()
+    for jams_file in corpus_io.find_jams(in_dir):
+        track_id = corpus_io.get_track_id(jams_file, in_dir)
+        if track_id in jams_files:
+            duplicates.setdefault(track_id, [jams_files[track_id]]).append(
+                jams_file)
+        jams_files[track_id] = jams_file
+    if duplicates:
+        raise ValueError("Several files for the same track ID: %s" %
+                         "; ".join(", ".join(files) for _, files in
+                                   sorted(duplicates.items())))
+    index = dict()
+    with open(archive_file, "wb") as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        for track_id in sorted(jams_files):
+            jams_file = jams_files[track_id]
+            with open(jams_file, "rb") as in_fp:
+                data = in_fp.read()
+            index[track_id] = [fp.tell(), len(data),
+                               os.path.splitext(jams_file)[1]]
+            fp.write(data)
+        index_offset = fp.tell()
+        index_data = json.dumps(index, sort_keys=True).encode("utf-8")
+        fp.write(index_data)
+        fp.seek(0)
+        fp.write(HEADER.pack(MAGIC, VERSION, index_offset, len(index_data)))
+    return len(index)
+
+
+class CorpusArchive(object):
+    """Read-only access to an archive built by `pack`.
+
+    Parameters
+    ----------
+    archive_file : str
+        Path to the archive.
+    """
+    def __init__(self, archive_file):
+        self.archive_file = archive_file
+        with open(archive_file, "rb") as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_offset, index_length = HEADER.unpack_from(
+            self._mmap)
+        if magic != MAGIC:
+            raise IOError("%s is not a JAMS archive" % archive_file)
+        if version != VERSION:
+            raise IOError("Unsupported archive version %d" % version)
+        self.index = json.loads(
+            self._mmap[index_offset:index_offset + index_length].decode(
+                "utf-8"))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, track_id):
+        return track_id in self.index
+
+    def __iter__(self):
+        return iter(self.track_ids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def track_ids(self):
+        """Sorted IDs of the tracks in the archive."""
+        return sorted(self.index)
+
+    def close(self):
+        """Unmaps the archive."""
+        self._mmap.close()
+
+    def get_bytes(self, track_id):
+        """Gets the contents of the JAMS file of a track, as stored (i.e.,
+        gzipped for `.jamz` files)."""
+        offset, length, _ = self.index[track_id]
+        return self._mmap[offset:offset + length]
+
+    def get_json(self, track_id):
+        """Gets the (decompressed) JSON document of a track."""
+        data = self.get_bytes(track_id)
+        if data[:2] == GZIP_MAGIC:
+            data = gzip.decompress(data)
+        return data
+
+    def load(self, track_id, backend=None):
+        """Loads the JAMS of a track as a JSON dictionary.
+
+        Parameters
+        ----------
+        track_id : str
+            ID of the track.
+        backend : str
+            Name of the JSON backend (see `json_backend.get_backend`).
+        """
+        return json_backend.loads(self.get_json(track_id), backend)
+
+    def extract(self, track_id, out_dir):
+        """Writes the JAMS file of a track back to a folder, at its original
+        relative path. Returns the path to the file."""
+        out_file = os.path.join(out_dir, track_id + self.index[track_id][2])
+        if not os.path.isdir(os.path.dirname(out_file)):
+            os.makedirs(os.path.dirname(out_file))
+        with open(out_file, "wb") as fp:
+            fp.write(self.get_bytes(track_id))
+        return out_file
+
+
+def main():
+    """Main function to pack, list or unpack archives."""
+    parser = argparse.ArgumentParser(
+        description="Single-file JAMS corpus archives",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    pack_parser = subparsers.add_parser("pack", help="Pack a corpus")
+    pack_parser.add_argument("in_dir",
+                             action="store",
+                             help="Folder with the JAMS files")
+    pack_parser.add_argument("archive_file",
+                             action="store",
+                             help="Output archive")
+    list_parser = subparsers.add_parser("list", help="List the tracks")
+    list_parser.add_argument("archive_file",
+                             action="store",
+                             help="Archive")
+    get_parser = subparsers.add_parser("get", help="Get the JAMS of a track")
+    get_parser.add_argument("archive_file",
+                            action="store",
+                            help="Archive")
+    get_parser.add_argument("track_id",
+                            action="store",
+                            help="ID of the track")
+    get_parser.add_argument("-o",
+                            action="store",
+                            dest="out_file",
+                            default=None,
+                            help="Output JAMS file, gzipped if it is a "
+                                 "`.jamz` file (standard output by default)")
+    unpack_parser = subparsers.add_parser("unpack", help="Unpack a corpus")
+    unpack_parser.add_argument("archive_file",
+                               action="store",
+                               help="Archive")
+    unpack_parser.add_argument("out_dir",
+                               action="store",
+                               help="Output folder")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    if args.command == "pack":
+        n_files = pack(args.in_dir, args.archive_file)
+        logging.info("Packed %d files into %s.", n_files, args.archive_file)
+    elif args.command == "list":
+        with CorpusArchive(args.archive_file) as archive:
+            for track_id in archive:
+                print(track_id)
+    elif args.command == "get":
+        with CorpusArchive(args.archive_file) as archive:
+            if args.out_file is not None and \
+                    args.out_file.endswith(".jamz"):
+                # Gzipped output: the stored file if it is gzipped already
+                data = archive.get_bytes(args.track_id)
+                if data[:2] != GZIP_MAGIC:
+                    data = gzip.compress(data)
+            else:
+                data = archive.get_json(args.track_id)
+        if args.out_file is None:
+            print(data.decode("utf-8"))
+        else:
+            with open(args.out_file, "wb") as fp:
+                fp.write(data)
+    elif args.command == "unpack":
+        with CorpusArchive(args.archive_file) as archive:
+            for track_id in archive:
+                archive.extract(track_id, args.out_dir)
+        logging.info("Unpacked %d files into %s.", len(archive),
+                     args.out_dir)
+    else:
+        parser.print_help()
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""
+Map-reduce statistics of one or several corpora.
+
+Each file is mapped to partial aggregates of its annotations, per
+namespace:
+
+    - `annotations`, `observations`: counts.
+    - `labels`: number of observations of each label, and `label_tracks`:
+      number of tracks with each label (e.g. tag frequencies of CAL500 and
+      CAL10K), for namespaces with non-numeric values.
+    - `segment_durations`: histogram of the segment durations, with 1
+      second bins, for `segment_*` namespaces.
+    - `beats` and `tempo`: number of beats and tempo (60 over the median
+      inter-beat interval) of each `beat` annotation.
+
+Partials are dictionaries of counts, histograms (dictionaries of counts)
+and lists of per-annotation samples, which are reduced by adding the counts
+and concatenating the lists, into corpus and global totals. The partials of
+each file are cached by file hash, so when a file changes (or is added)
+only its partials are recomputed, and the reduction is rerun from the
+cache.
+
+Usage example:
+    ./corpus_stats.py stats.json ../datasets/Harmonix ../datasets/SMC_MIREX \
+../datasets/CAL500 ../datasets/CAL10K --cache_dir stats_cache/ -j 8
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+import corpus_io
+import rasterize
+
+SEGMENT_BIN = 1.0
+# Number of most frequent labels in the summaries
+TOP_LABELS = 50
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def get_tempo(beats):
+    """Tempo of a beat annotation, in beats per minute (None if it has less
+    than two distinct beats)."""
+    intervals = np.diff(np.unique(np.asarray(beats, dtype=np.float64)))
+    if not len(intervals):
+        return None
+    return 60.0 / np.median(intervals)
+
+
+def get_partials(jam):
+    """Maps a loaded JAMS to the partial aggregates of its annotations.
+
+    Returns
+    -------
+    partials : dict
+        Number of files, total duration, and aggregates of each namespace
+        (in `namespaces`).
+    """
+    namespaces = dict()
+    for annotation in corpus_io.iter_annotations(jam):
+        namespace = annotation["namespace"]
+        data = annotation["data"]
+        stats = namespaces.setdefault(namespace,
+                                      dict(annotations=0, observations=0))
+        stats["annotations"] += 1
+        stats["observations"] += len(data["time"])
+        if namespace not in rasterize.VALUELESS_NAMESPACES and \
+                not all(value is None or _is_number(value)
+                        for value in data["value"]):
+            labels = stats.setdefault("labels", dict())
+            for value in data["value"]:
+                key = str(rasterize.value_key(value))
+                labels[key] = labels.get(key, 0) + 1
+            # Tracks are counted once per label, over all the annotations
+            stats["label_tracks"] = dict((label, 1) for label in labels)
+        if namespace.startswith("segment_"):
+            histogram = stats.setdefault("segment_durations", dict())
+            for duration in data["duration"]:
+                key = "%g" % (SEGMENT_BIN * ((duration or 0.0) //
+                                             SEGMENT_BIN))
+                histogram[key] = histogram.get(key, 0) + 1
+        if namespace == "beat":
+            stats.setdefault("beats", []).append(len(data["time"]))
+            tempo = get_tempo(data["time"])
+            if tempo is not None:
+                stats.setdefault("tempo", []).append(tempo)
+    return dict(files=1, duration=corpus_io.get_duration(jam),
+                namespaces=namespaces)
+
+
+def merge(total, partial):
+    """Reduces partial aggregates into total (in place): numbers are added,
+    dictionaries merged and lists concatenated."""
+    for key, value in partial.items():
+        if isinstance(value, dict):
+            merge(total.setdefault(key, dict()), value)
+        elif isinstance(value, list):
+            total.setdefault(key, []).extend(value)
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def describe(samples):
+    """Summary statistics of a list of samples."""
+    samples = np.asarray(samples, dtype=np.float64)
+    return dict(count=len(samples), mean=samples.mean(),
+                std=samples.std(), min=samples.min(),
+                median=np.median(samples), max=samples.max())
+
+
+def summarize(totals):
+    """Summary of reduced aggregates: samples are described by their
+    statistics, histograms are sorted, and only the most frequent labels
+    are kept."""
+    summary = dict(files=totals.get("files", 0),
+                   hours=totals.get("duration", 0.0) / 3600,
+                   namespaces=dict())
+    for namespace, stats in sorted(totals.get("namespaces", {}).items()):
+        ns_summary = dict(annotations=stats["annotations"],
+                          observations=stats["observations"])
+        if "labels" in stats:
+            ns_summary["n_labels"] = len(stats["labels"])
+            for key in ["labels", "label_tracks"]:
+                ns_summary[key] = sorted(stats[key].items(),
+                                         key=lambda x: (-x[1], x[0]))[
+                                             :TOP_LABELS]
+        if "segment_durations" in stats:
+            ns_summary["segment_durations"] = sorted(
+                ([float(key), count]
+                 for key, count in stats["segment_durations"].items()))
+        for key in ["beats", "tempo"]:
+            if stats.get(key):
+                ns_summary[key] = describe(stats[key])
+        summary["namespaces"][namespace] = ns_summary
+    return summary
+
+
+def load_partials(jams_files, cache_dir=None, n_jobs=1):
+    """Gets the partial aggregates of files, from the cache or computed in
+    parallel.
+
+    Returns
+    -------
+    partials : list
+        Partial aggregates of each file.
+    """
+    partials = dict()
+    cache_files = dict()
+    if cache_dir is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        for jams_file in jams_files:
+            cache_files[jams_file] = os.path.join(
+                cache_dir, "%s.json" % corpus_io.file_hash(jams_file))
+            if os.path.isfile(cache_files[jams_file]):
+                with open(cache_files[jams_file], "r") as fp:
+                    partials[jams_file] = json.load(fp)
+    missing = [jams_file for jams_file in jams_files
+               if jams_file not in partials]
+    logging.info("Computing the partials of %d files (%d cached)...",
+                 len(missing), len(partials))
+    for jams_file, partial in corpus_io.iter_load(missing, n_jobs,
+                                                  func=get_partials):
+        partials[jams_file] = partial
+        if cache_dir is not None:
+            with open(cache_files[jams_file], "w") as fp:
+                json.dump(partial, fp)
+    return [partials[jams_file] for jams_file in jams_files]
+
+
+def process(in_dirs, out_file, namespaces=None, cache_dir=None, n_jobs=1):
+    """Computes the statistics of several corpora and writes them as JSON,
+    with one summary per corpus and a global summary.
+
+    Returns
+    -------
+    stats : dict
+        The written statistics.
+    """
+    jams_files = dict()
+    for in_dir in in_dirs:
+        corpus = os.path.basename(os.path.normpath(in_dir))
+        jams_files[corpus] = corpus_io.find_jams(in_dir)
+    partials = load_partials(sum(jams_files.values(), []), cache_dir, n_jobs)
+
+    corpora, global_totals = dict(), dict()
+    position = 0
+    for corpus, files in jams_files.items():
+        totals = dict()
+        for partial in partials[position:position + len(files)]:
+            if namespaces is not None:
+                partial = dict(partial, namespaces=dict(
+                    (namespace, stats) for namespace, stats in
+                    partial["namespaces"].items() if namespace in namespaces))
+            merge(totals, partial)
+        position += len(files)
+        corpora[corpus] = summarize(totals)
+        merge(global_totals, totals)
+
+    stats = dict(corpora=corpora, all=summarize(global_totals))
+    with open(out_file, "w") as fp:
+        json.dump(stats, fp, indent=2)
+    return stats
+
+
+def main():
+    """Main function to compute corpus statistics."""
+    parser = argparse.ArgumentParser(
+        description="Computes the statistics of one or several corpora",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("out_file",
+                        action="store",
+                        help="Output JSON file")
+    parser.add_argument("in_dirs",
+                        action="store",
+                        nargs="+",
+                        help="Folders with the JAMS files")
+    parser.add_argument("-n",
+                        action="store",
+                        dest="namespaces",
+                        nargs="+",
+                        default=None,
+                        help="Namespaces to summarize (all by default)")
+    parser.add_argument("--cache_dir",
+                        action="store",
+                        default=None,
+                        help="Folder where the partials of each file are "
+                        "cached")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Compute the statistics
+    stats = process(args.in_dirs, args.out_file, args.namespaces,
+                    args.cache_dir, args.n_jobs)
+    logging.info("%d files, %.1f hours, %d namespaces.", stats["all"]["files"],
+                 stats["all"]["hours"], len(stats["all"]["namespaces"]))
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+"""
+Finds duplicate annotations and files across corpora, e.g. the SPAM tracks
+that also appear in Isophonics and SALAMI, and optionally builds a
+deduplicated view of the corpora.
+
+Annotations are compared by content, ignoring their metadata:
+
+    - Exact duplicates have the same canonical hash: the SHA-1 of the
+      namespace and the observations serialized as JSON with sorted keys,
+      with all floats rounded to `precision` decimals.
+    - Near duplicates have the same namespace and number of observations,
+      times and durations that differ by at most `tolerance` seconds, and
+      the same values once strings are lowercased and stripped.
+
+The hash of a file is the hash of the sorted hashes of its annotations, so
+files with the same annotations in any order are exact duplicates.
+Annotations with fewer than `min_observations` observations (e.g. single
+key annotations) are not reported, as they match by chance, and are never
+compared as near duplicates.
+
+Files can also reference a track of another corpus by their name, as SPAM
+does with `SALAMI_1072.jams` or `Isophonics_02 Under Pressure.jams`: such
+files annotate the same recording as the file with the same name (without
+the corpus prefix) in the referenced corpus, even if their annotations
+differ. They are reported as `same_track` pairs.
+
+In the deduplicated view, the corpora are processed in the given order and
+a file is left out if each of its annotations duplicates (exactly or
+nearly, exactly only for the short ones) an annotation of a file already
+kept, or, with `--drop_same_track`,
+if it references a track of a corpus with precedence. Kept files are
+hard-linked (or symlinked) into the view, so it takes no space.
+
+Usage example:
+    ./dedup.py ../datasets/Isophonics ../datasets/SALAMI ../datasets/SPAM \
+-o duplicates.json --view dedup_view/ -j 4
+"""
+
+import argparse
+import collections
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+import corpus_io
+
+
+def canonical(value, precision):
+    """Rounds all the floats of a JSON value."""
+    if isinstance(value, float):
+        return round(value, precision) if value == value else None
+    if isinstance(value, dict):
+        return dict((key, canonical(x, precision))
+                    for key, x in value.items())
+    if isinstance(value, list):
+        return [canonical(x, precision) for x in value]
+    return value
+
+
+def annotation_hash(annotation, precision=3):
+    """Canonical content hash of an annotation as returned by
+    `corpus_io.iter_annotations`."""
+    data = annotation["data"]
+    observations = [list(obs) for obs in zip(data["time"], data["duration"],
+                                             data["value"],
+                                             data["confidence"])]
+    document = json.dumps([annotation["namespace"],
+                           canonical(observations, precision)],
+                          sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(document.encode("utf-8")).hexdigest()
+
+
+def normalize_value(value):
+    """Normalizes a value for near-duplicate comparisons."""
+    if isinstance(value, str):
+        return value.strip().lower()
+    return json.dumps(value, sort_keys=True)
+
+
+def get_fingerprints(jam, precision=3, min_observations=4):
+    """Computes the hashes of the annotations of a loaded JAMS.
+
+    Returns
+    -------
+    file_hash : str
+        Hash of the sorted annotation hashes.
+    hashes : list
+        Hashes of all the annotations, by position in the file.
+    annotations : list
+        For each annotation with at least min_observations observations, a
+        dictionary with its `position` in the file, `namespace`, `hash`,
+        `time` and `duration` arrays and normalized `values`.
+    """
+    hashes, annotations = [], []
+    for i, annotation in enumerate(corpus_io.iter_annotations(jam)):
+        ann_hash = annotation_hash(annotation, precision)
+        hashes.append(ann_hash)
+        data = annotation["data"]
+        if len(data["time"]) < min_observations:
+            continue
+        annotations.append(dict(
+            position=i, namespace=annotation["namespace"], hash=ann_hash,
+            time=np.array([np.nan if x is None else x for x in data["time"]],
+                          dtype=np.float64),
+            duration=np.array([0.0 if x is None else x
+                               for x in data["duration"]], dtype=np.float64),
+            values=[normalize_value(value) for value in data["value"]]))
+    file_hash = hashlib.sha1(
+        "".join(sorted(hashes)).encode("utf-8")).hexdigest()
+    return file_hash, hashes, annotations
+
+
+def is_near(a, b, tolerance):
+    """Whether two fingerprinted annotations are near duplicates."""
+    return a["namespace"] == b["namespace"] and \
+        len(a["time"]) == len(b["time"]) and \
+        a["values"] == b["values"] and \
+        np.allclose(a["time"], b["time"], rtol=0, atol=tolerance,
+                    equal_nan=True) and \
+        np.allclose(a["duration"], b["duration"], rtol=0, atol=tolerance)
+
+
+def find_references(in_dirs):
+    """Finds the files that reference a track of another corpus by their
+    name (`<corpus>_<name>.jams`).
+
+    Returns
+    -------
+    pairs : list
+        [referencing file, referenced file] pairs.
+    """
+    by_name = dict()
+    for in_dir in in_dirs:
+        corpus = os.path.basename(os.path.normpath(in_dir))
+        by_name[corpus] = dict(
+            (os.path.splitext(os.path.basename(jams_file))[0], jams_file)
+            for jams_file in corpus_io.find_jams(in_dir))
+    pairs = []
+    for corpus, files in sorted(by_name.items()):
+        for name, jams_file in sorted(files.items()):
+            prefix, _, reference = name.partition("_")
+            if prefix != corpus and reference in by_name.get(prefix, {}):
+                pairs.append([jams_file, by_name[prefix][reference]])
+    return pairs
+
+
+def find_duplicates(in_dirs, precision=3, tolerance=0.05,
+                    min_observations=4, n_jobs=1):
+    """Finds duplicate files and annotations across corpora.
+
+    Parameters
+    ----------
+    in_dirs : list
+        Corpus folders, in order of precedence.
+    precision : int
+        Number of decimals kept in the canonical hashes.
+    tolerance : float
+        Maximum time difference of near duplicates, in seconds.
+    min_observations : int
+        Minimum number of observations of a reported annotation.
+    n_jobs : int
+        Number of processes loading the files.
+
+    Returns
+    -------
+    report : dict
+        `files` (groups of exact duplicate files), `annotations` (groups of
+        exact duplicate annotations, as [file, position] pairs),
+        `near_annotations` (pairs of near duplicate annotations),
+        `same_track` (see `find_references`) and `duplicate_files` (files
+        whose annotations all duplicate those of files with precedence,
+        with the file they duplicate the most, and that have at least one
+        annotation with min_observations observations).
+    """
+    jams_files = []
+    for in_dir in in_dirs:
+        jams_files += corpus_io.find_jams(in_dir)
+    func = functools.partial(get_fingerprints, precision=precision,
+                             min_observations=min_observations)
+    fingerprints = list(corpus_io.iter_load(jams_files, n_jobs, func=func))
+
+    # Exact duplicates
+    by_file_hash = collections.defaultdict(list)
+    by_ann_hash = collections.defaultdict(list)
+    for jams_file, (file_hash, _, annotations) in fingerprints:
+        by_file_hash[file_hash].append(jams_file)
+        for annotation in annotations:
+            by_ann_hash[annotation["hash"]].append(
+                (jams_file, annotation["position"]))
+    file_groups = [files for files in by_file_hash.values() if len(files) > 1]
+    ann_groups = [anns for anns in by_ann_hash.values()
+                  if len(set(jams_file for jams_file, _ in anns)) > 1]
+
+    # Near duplicates, compared within (namespace, length, rounded span)
+    # buckets and their neighbours
+    buckets = collections.defaultdict(list)
+    for jams_file, (_, _, annotations) in fingerprints:
+        for annotation in annotations:
+            span = int(np.nan_to_num(annotation["time"]).max() // 1)
+            key = (annotation["namespace"], len(annotation["time"]), span)
+            buckets[key].append((jams_file, annotation))
+    near = []
+    for (namespace, length, span), members in buckets.items():
+        neighbours = members + buckets.get((namespace, length, span + 1), [])
+        for i, (file_a, ann_a) in enumerate(members):
+            for file_b, ann_b in neighbours[i + 1:]:
+                if file_a != file_b and ann_a["hash"] != ann_b["hash"] and \
+                        is_near(ann_a, ann_b, tolerance):
+                    near.append([[file_a, ann_a["position"]],
+                                 [file_b, ann_b["position"]]])
+
+    # Files whose annotations all duplicate earlier files
+    order = dict((jams_file, i) for i, jams_file in enumerate(jams_files))
+    matches = collections.defaultdict(dict)
+    for group in ann_groups:
+        for file_a, pos_a in group:
+            for file_b, _ in group:
+                if order[file_b] < order[file_a]:
+                    matches[file_a].setdefault(pos_a, []).append(file_b)
+    for (file_a, pos_a), (file_b, pos_b) in near:
+        if order[file_b] < order[file_a]:
+            file_a, pos_a, file_b, pos_b = file_b, pos_b, file_a, pos_a
+        matches[file_b].setdefault(pos_b, []).append(file_a)
+    # Short annotations are not reported, but must have an exact duplicate
+    # in an earlier file too (the first file of each hash)
+    first_file = dict()
+    for jams_file, (_, hashes, _) in fingerprints:
+        for ann_hash in hashes:
+            first_file.setdefault(ann_hash, jams_file)
+    duplicate_files = dict()
+    for group in file_groups:
+        for jams_file in group[1:]:
+            duplicate_files[jams_file] = group[0]
+    for jams_file, (_, hashes, annotations) in fingerprints:
+        positions = [annotation["position"] for annotation in annotations]
+        if jams_file in duplicate_files or not positions:
+            continue
+        short = [ann_hash for position, ann_hash in enumerate(hashes)
+                 if position not in positions]
+        if all(position in matches[jams_file] for position in positions) \
+                and all(order[first_file[ann_hash]] < order[jams_file]
+                        for ann_hash in short):
+            sources = collections.Counter(
+                source for position in positions
+                for source in matches[jams_file][position])
+            duplicate_files[jams_file] = sources.most_common(1)[0][0]
+
+    return dict(files=file_groups,
+                annotations=[[list(ann) for ann in group]
+                             for group in ann_groups],
+                near_annotations=near,
+                same_track=find_references(in_dirs),
+                duplicate_files=duplicate_files)
+
+
+def make_view(in_dirs, out_dir, duplicate_files, symlink=False):
+    """Builds a deduplicated view of the corpora, linking every file that is
+    not a duplicate to `out_dir/<corpus>/<relative path>`.
+
+    Returns
+    -------
+    n_files : int
+        Number of linked files.
+    """
+    n_files = 0
+    for in_dir in in_dirs:
+        corpus = os.path.basename(os.path.normpath(in_dir))
+        for jams_file in corpus_io.find_jams(in_dir):
+            if jams_file in duplicate_files:
+                continue
+            out_file = os.path.join(out_dir, corpus,
+                                    os.path.relpath(jams_file, in_dir))
+            if not os.path.isdir(os.path.dirname(out_file)):
+                os.makedirs(os.path.dirname(out_file))
+            if os.path.lexists(out_file):
+                os.remove(out_file)
+            if symlink:
+                os.symlink(os.path.abspath(jams_file), out_file)
+            else:
+                os.link(jams_file, out_file)
+            n_files += 1
+    return n_files
+
+
+def main():
+    """Main function to find duplicates."""
+    parser = argparse.ArgumentParser(
+        description="Finds duplicate annotations and files across corpora",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("in_dirs",
+                        action="store",
+                        nargs="+",
+                        help="Corpus folders, in order of precedence")
+    parser.add_argument("-o",
+                        action="store",
+                        dest="out_file",
+                        default=None,
+                        help="Output JSON report")
+    parser.add_argument("--precision",
+                        action="store",
+                        type=int,
+                        default=3,
+                        help="Number of decimals kept in the hashes")
+    parser.add_argument("--tolerance",
+                        action="store",
+                        type=float,
+                        default=0.05,
+                        help="Maximum time difference of near duplicates, "
+                             "in seconds")
+    parser.add_argument("--min_observations",
+                        action="store",
+                        type=int,
+                        default=4,
+                        help="Minimum number of observations of a reported "
+                             "annotation")
+    parser.add_argument("--view",
+                        action="store",
+                        dest="view_dir",
+                        default=None,
+                        help="Output folder of the deduplicated view")
+    parser.add_argument("--drop_same_track",
+                        action="store_true",
+                        help="Leave files referencing a track of a corpus "
+                             "with precedence out of the view")
+    parser.add_argument("--symlink",
+                        action="store_true",
+                        help="Use symbolic links instead of hard links in "
+                             "the view")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Find the duplicates
+    report = find_duplicates(args.in_dirs, args.precision, args.tolerance,
+                             args.min_observations, args.n_jobs)
+    logging.info("%d groups of identical files, %d groups of identical "
+                 "annotations, %d pairs of near-identical annotations, "
+                 "%d files referencing another corpus.",
+                 len(report["files"]), len(report["annotations"]),
+                 len(report["near_annotations"]), len(report["same_track"]))
+    for jams_file, source in sorted(report["duplicate_files"].items()):
+        logging.info("%s duplicates %s", jams_file, source)
+    if args.out_file is not None:
+        with open(args.out_file, "w") as fp:
+            json.dump(report, fp, indent=2)
+
+    # Deduplicated view
+    if args.view_dir is not None:
+        duplicate_files = dict(report["duplicate_files"])
+        if args.drop_same_track:
+            order = dict((jams_file, i)
+                         for i, in_dir in enumerate(args.in_dirs)
+                         for jams_file in corpus_io.find_jams(in_dir))
+            for jams_file, reference in report["same_track"]:
+                if order[reference] < order[jams_file]:
+                    duplicate_files.setdefault(jams_file, reference)
+        n_files = make_view(args.in_dirs, args.view_dir, duplicate_files,
+                            args.symlink)
+        logging.info("Linked %d files into %s.", n_files, args.view_dir)
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
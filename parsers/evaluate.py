@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+"""
+Batch evaluation of estimate JAMS files against the references of
+`datasets/`.
+
+Estimates are matched to references by track ID (the path relative to the
+corpus root, without extension), or by file name when the estimate tree is
+flat. With several reference corpora, the estimates of a corpus are looked
+for in the subfolder of the estimate folder named as the corpus, if any.
+
+Each pair only parses the annotations of the evaluated namespace (see
+`lazy_jams.py`) and is scored with `mir_eval`, according to the namespace:
+
+    - `chord`: `mir_eval.chord.evaluate` (root, majmin, sevenths, ...).
+    - `segment_*`: `mir_eval.segment.evaluate` (boundary detection,
+      pairwise clustering, NCE, ...).
+    - `beat`: `mir_eval.beat.evaluate` (F-measure, Cemgil, P-score, ...).
+    - `pitch_hz`: `mir_eval.melody.evaluate` (voicing, raw pitch and
+      chroma accuracies, ...).
+
+The first annotation of the namespace is used on each side, unless the
+index of the reference annotation is given. Pairs are scored in parallel,
+and rows are written to the CSV report (one column per metric) as they are
+computed. The mean of each metric per corpus is written to a summary CSV.
+
+Usage example:
+    ./evaluate.py estimates/ chords.csv ../datasets/Billboard-Chords \
+../datasets/Isophonics -n chord -s chords_summary.csv -j 8
+"""
+
+import argparse
+import csv
+import logging
+import os
+import time
+
+from joblib import Parallel, delayed
+import mir_eval
+import numpy as np
+
+import corpus_io
+import lazy_jams
+
+
+def get_task(namespace):
+    """Evaluation task of a namespace (None if it is not supported)."""
+    if namespace == "chord":
+        return "chord"
+    if namespace.startswith("segment_"):
+        return "segment"
+    if namespace == "beat":
+        return "beat"
+    if namespace == "pitch_hz":
+        return "melody"
+    return None
+
+
+def find_estimates(est_dir, ref_dir):
+    """Matches the estimate files of a corpus with its reference files.
+
+    Returns
+    -------
+    pairs : list
+        (track_id, reference_file, estimate_file) tuples, sorted by track
+        ID.
+    missing : list
+        Track IDs of the references without estimate.
+    """
+    corpus = os.path.basename(os.path.normpath(ref_dir))
+    if os.path.isdir(os.path.join(est_dir, corpus)):
+        est_dir = os.path.join(est_dir, corpus)
+    estimates = dict((corpus_io.get_track_id(est_file, est_dir), est_file)
+                     for est_file in corpus_io.find_jams(est_dir))
+    # Fall back to file names, if they are unique
+    by_name = dict()
+    for track_id, est_file in estimates.items():
+        by_name.setdefault(os.path.basename(track_id), []).append(est_file)
+
+    pairs, missing = [], []
+    for ref_file in corpus_io.find_jams(ref_dir):
+        track_id = corpus_io.get_track_id(ref_file, ref_dir)
+        est_file = estimates.get(track_id)
+        if est_file is None and \
+                len(by_name.get(os.path.basename(track_id), [])) == 1:
+            est_file = by_name[os.path.basename(track_id)][0]
+        if est_file is None:
+            missing.append(track_id)
+        else:
+            pairs.append((track_id, ref_file, est_file))
+    return sorted(pairs), missing
+
+
+def get_annotation(jams_file, namespace, index=0):
+    """Observation columns of the index-th annotation of a namespace, or
+    None if there is no such annotation."""
+    jam = lazy_jams.LazyJAMS(jams_file)
+    for i, annotation in enumerate(jam.iter_annotations(namespace)):
+        if i == index:
+            return annotation["data"]
+    return None
+
+
+def to_intervals(columns):
+    """Interval array and labels of observation columns. Boundaries are
+    rounded to 5 decimals, so that the end of a segment and the start of the
+    next one are equal despite the float noise of time + duration."""
+    times = np.asarray(columns["time"], dtype=np.float64)
+    durations = np.nan_to_num(np.asarray(columns["duration"],
+                                         dtype=np.float64))
+    intervals = np.round(np.column_stack([times, times + durations]), 5)
+    return intervals, [str(value) for value in columns["value"]]
+
+
+def evaluate_chord(reference, estimate):
+    """Chord recognition scores."""
+    ref_intervals, ref_labels = to_intervals(reference)
+    est_intervals, est_labels = to_intervals(estimate)
+    return mir_eval.chord.evaluate(ref_intervals, ref_labels, est_intervals,
+                                   est_labels)
+
+
+def evaluate_segment(reference, estimate):
+    """Structural segmentation scores."""
+    ref_intervals, ref_labels = to_intervals(reference)
+    est_intervals, est_labels = to_intervals(estimate)
+    return mir_eval.segment.evaluate(ref_intervals, ref_labels,
+                                     est_intervals, est_labels)
+
+
+def evaluate_beat(reference, estimate):
+    """Beat tracking scores."""
+    return mir_eval.beat.evaluate(
+        np.sort(np.asarray(reference["time"], dtype=np.float64)),
+        np.sort(np.asarray(estimate["time"], dtype=np.float64)))
+
+
+def evaluate_melody(reference, estimate):
+    """Melody extraction scores."""
+    return mir_eval.melody.evaluate(
+        np.asarray(reference["time"], dtype=np.float64),
+        np.asarray(reference["value"], dtype=np.float64),
+        np.asarray(estimate["time"], dtype=np.float64),
+        np.asarray(estimate["value"], dtype=np.float64))
+
+
+TASK_FUNCTIONS = dict(chord=evaluate_chord, segment=evaluate_segment,
+                      beat=evaluate_beat, melody=evaluate_melody)
+
+
+def evaluate_pair(ref_file, est_file, namespace, ref_index=0):
+    """Scores an estimate file against a reference file.
+
+    Returns
+    -------
+    scores : dict
+        Score of each metric (None if the pair could not be evaluated).
+    error : str
+        Reason why the pair was not evaluated (None otherwise).
+    """
+    reference = get_annotation(ref_file, namespace, ref_index)
+    if reference is None or not len(reference["time"]):
+        return None, "no reference %s annotation" % namespace
+    estimate = get_annotation(est_file, namespace)
+    if estimate is None:
+        return None, "no estimated %s annotation" % namespace
+    try:
+        scores = TASK_FUNCTIONS[get_task(namespace)](reference, estimate)
+    except Exception as e:
+        # mir_eval raises e.g. InvalidChordException (not a ValueError) on
+        # unparseable labels, which must not abort the whole run
+        return None, "%s: %s" % (type(e).__name__, e)
+    return dict((metric, float(score)) for metric, score in scores.items()), \
+        None
+
+
+def process(est_dir, ref_dirs, out_file, namespace, summary_file=None,
+            ref_index=0, n_jobs=1):
+    """Evaluates the estimates of several corpora and writes a CSV report
+    with one row per track.
+
+    Returns
+    -------
+    means : dict
+        Mean of each metric, keyed by (corpus, metric).
+    """
+    if get_task(namespace) is None:
+        raise ValueError("Namespace %s can not be evaluated" % namespace)
+    pairs = []
+    for ref_dir in ref_dirs:
+        corpus = os.path.basename(os.path.normpath(ref_dir))
+        corpus_pairs, missing = find_estimates(est_dir, ref_dir)
+        if missing:
+            logging.warning("%s: %d references have no estimate.", corpus,
+                            len(missing))
+        pairs += [(corpus, track_id, ref_file, est_file)
+                  for track_id, ref_file, est_file in corpus_pairs]
+    logging.info("Evaluating %d estimates...", len(pairs))
+
+    results = Parallel(n_jobs=n_jobs, return_as="generator")(
+        delayed(evaluate_pair)(ref_file, est_file, namespace, ref_index)
+        for _, _, ref_file, est_file in pairs)
+    metrics, sums, counts = [], dict(), dict()
+    with open(out_file, "w") as fp:
+        writer = None
+        for (corpus, track_id, _, _), (scores, error) in zip(pairs, results):
+            if scores is None:
+                logging.warning("%s/%s not evaluated: %s", corpus, track_id,
+                                error)
+                continue
+            if writer is None:
+                metrics = list(scores)
+                writer = csv.DictWriter(fp, fieldnames=["corpus", "track_id"] +
+                                        metrics)
+                writer.writeheader()
+            row = dict(scores, corpus=corpus, track_id=track_id)
+            writer.writerow(row)
+            for metric, score in scores.items():
+                sums[corpus, metric] = sums.get((corpus, metric), 0.) + score
+            counts[corpus] = counts.get(corpus, 0) + 1
+
+    means = dict((key, total / counts[key[0]]) for key, total in sums.items())
+    if summary_file is not None:
+        with open(summary_file, "w") as fp:
+            writer = csv.writer(fp)
+            writer.writerow(["corpus", "n_tracks"] + metrics)
+            for corpus in sorted(counts):
+                writer.writerow([corpus, counts[corpus]] +
+                                [means[corpus, metric] for metric in metrics])
+    logging.info("Evaluated %d of %d estimates.", sum(counts.values()),
+                 len(pairs))
+    return means
+
+
+def main():
+    """Main function to evaluate estimates against the references."""
+    parser = argparse.ArgumentParser(
+        description="Evaluates estimate JAMS files against the references",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("est_dir",
+                        action="store",
+                        help="Folder with the estimate JAMS files")
+    parser.add_argument("out_file",
+                        action="store",
+                        help="Output CSV report, with one row per track")
+    parser.add_argument("ref_dirs",
+                        action="store",
+                        nargs="+",
+                        help="Folders with the reference JAMS files")
+    parser.add_argument("-n",
+                        action="store",
+                        dest="namespace",
+                        default="chord",
+                        help="Namespace to evaluate")
+    parser.add_argument("-s",
+                        action="store",
+                        dest="summary_file",
+                        default=None,
+                        help="Output CSV with the means of each corpus")
+    parser.add_argument("--ref_index",
+                        action="store",
+                        type=int,
+                        default=0,
+                        help="Index of the reference annotation of the "
+                        "namespace (e.g., of the annotator)")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Evaluate the estimates
+    means = process(args.est_dir, args.ref_dirs, args.out_file,
+                    args.namespace, args.summary_file, args.ref_index,
+                    args.n_jobs)
+    for (corpus, metric), mean in sorted(means.items()):
+        logging.info("%s %s: %.3f", corpus, metric, mean)
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,10 @@ import time
 
 import jams
 
+import journal
+import json_backend
+import sharding
+
 __author__ = "Oriol Nieto"
 __license__ = "MIT"
 __version__ = "1.1"
@@ -63,7 +67,7 @@ def create_annotation(ann, ann_id):
 
 def parse_song(song_file, out_dir):
     """Parses a single song contained in the given pickle file and
-    places it in the output dir."""
+    places it in the output dir, returning the path of its JAMS file."""
     with open(song_file, "rb") as f:
         song = pickle.load(f)
 
@@ -74,21 +78,28 @@ def parse_song(song_file, out_dir):
         jam.annotations.append(pattern_ann)
 
     out_file = os.path.join(out_dir, song_title + ".jams")
-    jam.save(out_file)
+    json_backend.save_jam(jam, out_file)
+    return out_file
 
 
-def process(in_dir, out_dir):
-    """Converts the original HEMAN files into the JAMS format, and saves
-    them in the out_dir folder."""
+def process(in_dir, out_dir, shard=None, resume=False):
+    """Converts the original HEMAN files into the JAMS format (only the songs
+    of the given (i, N) shard, if any, and not done by the interrupted run if
+    resume is set), and saves them in the out_dir folder."""
 
     # Check if output folder and create it if needed:
     if not os.path.exists(out_dir):
         os.makedirs(out_dir)
 
     # Do one song at a time
-    song_files = glob.glob(os.path.join(in_dir, "*.pkl"))
-    for song_file in song_files:
-        parse_song(song_file, out_dir)
+    get_title = lambda song_file: os.path.basename(song_file)[:-4]
+    song_files, track_ids = sharding.select(
+        sorted(glob.glob(os.path.join(in_dir, "*.pkl"))), shard,
+        key=get_title)
+    with journal.Journal(out_dir, shard, resume) as run:
+        for song_file in run.todo(song_files, key=get_title):
+            run.add(get_title(song_file), parse_song(song_file, out_dir))
+    sharding.write_manifest(out_dir, shard, track_ids, run.done)
 
 
 if __name__ == '__main__':
@@ -101,6 +112,16 @@ if __name__ == '__main__':
     parser.add_argument("out_dir",
                         action="store",
                         help="Output JAMS folder")
+    parser.add_argument("--shard",
+                        action="store",
+                        type=sharding.parse_shard,
+                        default=None,
+                        help="Only convert the i-th of N shards of the "
+                        "tracks, given as i/N")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Resume an interrupted run, skipping the tracks "
+                        "in its journal")
     args = parser.parse_args()
     start_time = time.time()
 
@@ -108,7 +129,7 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
 
     # Run the parser
-    process(args.in_dir, args.out_dir)
+    process(args.in_dir, args.out_dir, args.shard, args.resume)
 
     # Done!
     logging.info("Done! Took %.2f seconds." % (time.time() - start_time))
@@ -33,6 +33,10 @@ import time
 
 import jams
 
+import journal
+import json_backend
+import sharding
+
 # Map of JAMS attributes to Isophonics directories.
 ISO_ATTRS = {'beat': 'beat',
              'chord': 'chordlab',
@@ -120,13 +124,18 @@ def fix_silence(annot):
     annot.data.drop(idxs, inplace=True)
 
 
-def process(in_dir, out_dir):
-    """Converts the original Isophonic files into the JAMS format, and saves
-    them in the out_dir folder."""
+def process(in_dir, out_dir, shard=None, resume=False):
+    """Converts the original Isophonic files into the JAMS format (only the
+    tracks of the given (i, N) shard, if any, and not done by the interrupted
+    run if resume is set), and saves them in the out_dir folder."""
     all_jams = dict()
     output_paths = dict()
     all_labs = jams.util.find_with_extension(in_dir, 'lab', 5)
     all_labs += jams.util.find_with_extension(in_dir, 'txt', 4)
+    all_labs, titles = sharding.select(all_labs, shard,
+                                       key=jams.util.filebase)
+    run = journal.Journal(out_dir, shard, resume)
+    all_labs = run.todo(all_labs, key=jams.util.filebase)
 
     for lab_file in all_labs:
         title = jams.util.filebase(lab_file)
@@ -175,10 +184,13 @@ def process(in_dir, out_dir):
         jam.annotations[-1].annotation_metadata = ann_meta
 
     logging.info("Saving and validating JAMS...")
-    for title in all_jams:
-        out_file = output_paths[title]
-        jams.util.smkdirs(os.path.split(out_file)[0])
-        all_jams[title].save(out_file)
+    with run:
+        for title in all_jams:
+            out_file = output_paths[title]
+            jams.util.smkdirs(os.path.split(out_file)[0])
+            json_backend.save_jam(all_jams[title], out_file)
+            run.add(title, out_file)
+    sharding.write_manifest(out_dir, shard, titles, run.done)
 
 
 if __name__ == '__main__':
@@ -191,6 +203,16 @@ if __name__ == '__main__':
     parser.add_argument("out_dir",
                         action="store",
                         help="Output JAMS folder")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Resume an interrupted run, skipping the tracks "
+                        "in its journal")
+    parser.add_argument("--shard",
+                        action="store",
+                        type=sharding.parse_shard,
+                        default=None,
+                        help="Only convert the i-th of N shards of the "
+                        "tracks, given as i/N")
     args = parser.parse_args()
     start_time = time.time()
 
@@ -198,7 +220,7 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
 
     # Run the parser
-    process(args.in_dir, args.out_dir)
+    process(args.in_dir, args.out_dir, args.shard, args.resume)
 
     # Done!
     logging.info("Done! Took %.2f seconds." % (time.time() - start_time))
@@ -13,8 +13,11 @@ import argparse
 import csv
 import glob
 import jams
+import journal
+import json_backend
 import logging
 import os
+import sharding
 import time
 
 
@@ -210,7 +213,7 @@ def parse_patterns(csv_file, kern_file, patterns, out_file):
     jam.annotations.append(annot)
 
     # Save file
-    jam.save(out_file)
+    json_backend.save_jam(jam, out_file)
 
 
 def get_gt_patterns(annotators):
@@ -241,8 +244,10 @@ def get_gt_patterns(annotators):
     return P
 
 
-def process(jku_dir, out_dir):
-    """Main process to parse the ground truth csv files.
+def process(jku_dir, out_dir, shard=None, resume=False):
+    """Main process to parse the ground truth csv files (only the pieces of
+    the given (i, N) shard, if any, and not done by the interrupted run if
+    resume is set).
 
     Parameters
     ----------
@@ -250,54 +255,79 @@ def process(jku_dir, out_dir):
         Directory where the JKU Dataset is located.
     out_dir: string
         Directory in which to put the parsed files.
+    shard: tuple
+        (i, N) shard of the pieces to parse, or None to parse them all.
+    resume: bool
+        Whether to skip the pieces and types in the journal of the
+        interrupted run.
     """
     # Check if output folder and create it if needed:
     if not os.path.exists(out_dir):
         os.makedirs(out_dir)
 
     # Get all the music pieces in the ground truth
-    pieces = glob.glob(os.path.join(jku_dir, "groundTruth", "*"))
+    pieces, piece_names = sharding.select(
+        sorted(glob.glob(os.path.join(jku_dir, "groundTruth", "*"))), shard,
+        key=os.path.basename)
 
     # Two types of patterns for each piece
     types = ["monophonic", "polyphonic"]
 
+    # Journal of the parsed files, keyed by piece and type
+    run = journal.Journal(out_dir, shard, resume)
+    get_key = lambda piece_type: "%s/%s" % (os.path.basename(piece_type[0]),
+                                            piece_type[1])
+
     # Main loop to retrieve all the patterns from the GT
     all_patterns = []
     csv_files = []
     kern_files = []
-    for piece in pieces:
-        logging.info("Reading piece %s" % piece)
-        for type in types:
-            # Get the main csv and kern file
-            csv_files.append(glob.glob(os.path.join(piece, type, "csv",
-                                                    "*.csv"))[0])
-            kern_files.append(glob.glob(os.path.join(piece, type, "kern",
-                                                    "*.krn"))[0])
-
-            # Get all the annotators for the current piece
-            annotators = glob.glob(os.path.join(piece, type,
-                                                "repeatedPatterns", "*"))
-
-            # Based on the readme.txt of JKU, these are the valid annotators
-            # (thanks Colin! :-)
-            if type == "polyphonic":
-                valid_annotators = ['barlowAndMorgensternRevised',
-                                    'bruhn',
-                                    'schoenberg',
-                                    'sectionalRepetitions',
-                                    'tomCollins']
-                for annotator in annotators:
-                    if os.path.split(annotator)[1] not in valid_annotators:
-                        annotators.remove(annotator)
-
-            all_patterns.append(get_gt_patterns(annotators))
+    keys = []
+    for piece, type in run.todo([(piece, type) for piece in pieces
+                                 for type in types], key=get_key):
+        logging.info("Reading piece %s (%s)" % (piece, type))
+        keys.append(get_key((piece, type)))
+        # Get the main csv and kern file
+        csv_files.append(glob.glob(os.path.join(piece, type, "csv",
+                                                "*.csv"))[0])
+        kern_files.append(glob.glob(os.path.join(piece, type, "kern",
+                                                "*.krn"))[0])
+
+        # Get all the annotators for the current piece
+        annotators = glob.glob(os.path.join(piece, type,
+                                            "repeatedPatterns", "*"))
+
+        # Based on the readme.txt of JKU, these are the valid annotators
+        # (thanks Colin! :-)
+        if type == "polyphonic":
+            valid_annotators = ['barlowAndMorgensternRevised',
+                                'bruhn',
+                                'schoenberg',
+                                'sectionalRepetitions',
+                                'tomCollins']
+            for annotator in annotators:
+                if os.path.split(annotator)[1] not in valid_annotators:
+                    annotators.remove(annotator)
+
+        all_patterns.append(get_gt_patterns(annotators))
 
     # For the patterns of one given file, parse them into a single file
-    for csv_file, kern_file, patterns in zip(csv_files, kern_files,
-                                             all_patterns):
-        logging.info("Parsing file %s" % csv_file)
-        out_file = get_out_file(patterns, out_dir)
-        parse_patterns(csv_file, kern_file, patterns, out_file)
+    with run:
+        for csv_file, kern_file, patterns, key in zip(csv_files, kern_files,
+                                                      all_patterns, keys):
+            logging.info("Parsing file %s" % csv_file)
+            out_file = get_out_file(patterns, out_dir)
+            parse_patterns(csv_file, kern_file, patterns, out_file)
+            run.add(key, out_file)
+
+    # A piece is converted once the files of all its types are
+    outputs = dict()
+    for key, out_file in run.done.items():
+        outputs.setdefault(key.split("/")[0], []).append(out_file)
+    sharding.write_manifest(out_dir, shard, piece_names,
+                            dict((piece, out_files) for piece, out_files
+                                 in outputs.items()
+                                 if len(out_files) == len(types)))
 
 
 if __name__ == '__main__':
@@ -310,6 +340,16 @@ if __name__ == '__main__':
     parser.add_argument("out_dir",
                         action="store",
                         help="Output dir")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Resume an interrupted run, skipping the tracks "
+                        "in its journal")
+    parser.add_argument("--shard",
+                        action="store",
+                        type=sharding.parse_shard,
+                        default=None,
+                        help="Only convert the i-th of N shards of the "
+                        "tracks, given as i/N")
     args = parser.parse_args()
     start_time = time.time()
 
@@ -318,7 +358,7 @@ if __name__ == '__main__':
         level=logging.INFO)
 
     # Run the algorithm
-    process(args.jku_dir, args.out_dir)
+    process(args.jku_dir, args.out_dir, args.shard, args.resume)
 
     # Done!
     logging.info("Done! Took %.2f seconds." % (time.time() - start_time))
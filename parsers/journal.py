@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Append-only journal of the tracks completed by a parser run, to resume a
+crashed or preempted run where it stopped.
+
+JAMS files are written atomically by `json_backend.save_json` (temporary
+file, fsync, rename), so a killed parser never leaves a truncated file, but
+a renamed file is only durable once its folder is synced too. The journal
+keeps the completed tracks in memory, and every `batch_size` tracks it syncs
+the folders of their files at once, then appends their IDs to the journal
+file and syncs it. A track is thus only in the journal once its file is on
+disk, and `--resume` skips exactly the tracks of the journal. Each line of
+the journal holds a track ID and the path of its file (relative to the
+output folder), so that the shard manifests list the actual outputs.
+
+Journals are kept in the `.journal` folder of the output folder, one per
+shard (see `sharding.py`). Usage example (from a parser):
+
+    >>> with journal.Journal(out_dir, shard, resume) as run:
+    ...     for track_id in run.todo(track_ids, key=lambda x: x):
+    ...         out_file = convert(track_id)
+    ...         run.add(track_id, out_file)
+"""
+
+import logging
+import os
+
+JOURNAL_FOLDER = ".journal"
+BATCH_SIZE = 64
+
+
+def get_journal_file(out_dir, shard=None):
+    """Path of the journal of a run (of a given (i, N) shard, if any)."""
+    name = "journal.txt" if shard is None else "journal-%d-of-%d.txt" % shard
+    return os.path.join(out_dir, JOURNAL_FOLDER, name)
+
+
+def sync_folder(folder):
+    """Syncs a folder, making the renames of its files durable."""
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_journal(journal_file):
+    """Reads the tracks of a journal, dropping a line left incomplete by a
+    crash (the file is truncated after the last complete line).
+
+    Returns
+    -------
+    done : dict
+        Output file of each completed track (relative to the output folder,
+        None if unknown), keyed by track ID.
+    """
+    if not os.path.isfile(journal_file):
+        return dict()
+    with open(journal_file, "rb+") as fp:
+        data = fp.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            fp.truncate(end)
+    done = dict()
+    for line in data[:end].decode("utf-8").splitlines():
+        track_id, _, out_file = line.partition("\t")
+        done[track_id] = out_file or None
+    return done
+
+
+class Journal(object):
+    """Journal of the tracks completed by a parser run.
+
+    Parameters
+    ----------
+    out_dir : str
+        Output folder of the run.
+    shard : tuple
+        (i, N) shard of the run, or None.
+    resume : bool
+        Whether to resume from the existing journal (otherwise it is
+        restarted).
+    batch_size : int
+        Number of tracks synced at once.
+    """
+    def __init__(self, out_dir, shard=None, resume=False,
+                 batch_size=BATCH_SIZE):
+        self.out_dir = out_dir
+        self.journal_file = get_journal_file(out_dir, shard)
+        self.batch_size = batch_size
+        folder = os.path.dirname(self.journal_file)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.done = read_journal(self.journal_file) if resume else dict()
+        self.fp = open(self.journal_file, "ab" if resume else "wb")
+        self.pending = []
+        self.folders = set()
+
+    def __contains__(self, track_id):
+        return str(track_id) in self.done
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def todo(self, items, key):
+        """Items whose track (given by the key function) is not done yet."""
+        items = list(items)
+        keys = [str(key(item)) for item in items]
+        todo = [item for item, track_id in zip(items, keys)
+                if track_id not in self.done]
+        done = set(keys) & set(self.done)
+        if done:
+            logging.info("Resuming: %d tracks already done, %d to go.",
+                         len(done), len(set(keys) - done))
+        return todo
+
+    def add(self, track_id, out_file=None):
+        """Records a completed track (whose last written file is
+        out_file)."""
+        if out_file is not None:
+            self.folders.add(os.path.dirname(os.path.abspath(out_file)))
+            out_file = os.path.relpath(out_file, self.out_dir)
+        self.pending.append((str(track_id), out_file))
+        if len(self.pending) >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        """Syncs the folders of the pending tracks, and appends them to the
+        journal."""
+        if not self.pending:
+            return
+        for folder in self.folders:
+            sync_folder(folder)
+        self.fp.write("".join("%s\t%s\n" % (track_id, out_file or "")
+                              for track_id, out_file in self.pending)
+                      .encode("utf-8"))
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.done.update(self.pending)
+        self.pending = []
+        self.folders = set()
+
+    def close(self):
+        """Commits the pending tracks and closes the journal."""
+        if self.fp.closed:
+            return
+        self.commit()
+        self.fp.close()
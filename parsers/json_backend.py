@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+Pluggable JSON backend used to read and write JAMS files.
+
+The standard library `json` module is slow on the large MedleyDB, Harmonix
+and tmc323 files. This module uses the fastest available backend among
+orjson, ujson and simdjson (for reading only), and falls back to `json`
+otherwise. A specific backend can be requested by name, or for the whole
+process with the `JAMS_JSON_BACKEND` environment variable.
+
+All backends produce standard JSON: files written with one backend load
+identically with any other (float formatting may differ, but every float
+round-trips to the same value). The standard library is used for
+documents that a fast backend can not handle: objects it can not serialize
+(e.g. numpy scalars), and the non-standard `NaN` and `Infinity` values that
+`json` reads and writes (SMC_MIREX files have them), which orjson would
+reject when reading and write as `null`.
+"""
+
+import gzip
+import importlib
+import json
+import math
+import os
+
+BACKENDS = ["orjson", "ujson", "simdjson", "json"]
+
+ENV_VARIABLE = "JAMS_JSON_BACKEND"
+
+# Backends that can serialize
+WRITERS = ["orjson", "ujson", "json"]
+
+
+def _import(name):
+    """Imports a backend module, returning None if it is not installed."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def get_backend(name=None, write=False):
+    """Gets the name of the JSON backend to use.
+
+    Parameters
+    ----------
+    name : str
+        Requested backend. If None, the `JAMS_JSON_BACKEND` environment
+        variable is used (falling back to the first available writer if it
+        names a backend that can only read, such as simdjson), and otherwise
+        the first available backend.
+    write : bool
+        Whether the backend is needed to serialize.
+
+    Returns
+    -------
+    name : str
+        Name of an installed backend.
+    """
+    candidates = WRITERS if write else BACKENDS
+    if name is None:
+        name = os.environ.get(ENV_VARIABLE)
+        if write and name in BACKENDS and name not in WRITERS:
+            name = None
+    if name is not None:
+        if name not in candidates:
+            raise ValueError("Unknown JSON backend %s (choose from %s)" %
+                             (name, candidates))
+        if _import(name) is None:
+            raise ImportError("JSON backend %s is not installed" % name)
+        return name
+    for candidate in candidates:
+        if _import(candidate) is not None:
+            return candidate
+
+
+def is_finite(obj):
+    """Checks that a JSON object has no NaN or infinite float."""
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, float):
+            if math.isnan(obj) or math.isinf(obj):
+                return False
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+    return True
+
+
+def loads(data, backend=None):
+    """Parses a JSON document.
+
+    Parameters
+    ----------
+    data : bytes or str
+        The JSON document.
+    backend : str
+        Name of the backend (see `get_backend`).
+    """
+    backend = get_backend(backend)
+    try:
+        if backend == "simdjson":
+            if not isinstance(data, bytes):
+                data = data.encode("utf-8")
+            return _import("simdjson").Parser().parse(data).as_dict()
+        return _import(backend).loads(data)
+    except ValueError:
+        if backend == "json":
+            raise
+    return json.loads(data)
+
+
+def dumps(obj, indent=None, backend=None):
+    """Serializes an object as a JSON document.
+
+    Parameters
+    ----------
+    obj : object
+        Object to serialize.
+    indent : int
+        Indentation level (None for a compact document). orjson only
+        supports an indentation of 2, other values fall back to ujson or
+        the standard library.
+    backend : str
+        Name of the backend (see `get_backend`).
+
+    Returns
+    -------
+    document : bytes
+        The UTF-8 encoded JSON document.
+    """
+    backend = get_backend(backend, write=True)
+    if backend == "orjson" and indent not in [None, 2]:
+        backend = "ujson" if _import("ujson") is not None else "json"
+    if backend != "json" and not is_finite(obj):
+        backend = "json"
+    try:
+        if backend == "orjson":
+            orjson = _import("orjson")
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2
+                                if indent else 0)
+        if backend == "ujson":
+            return _import("ujson").dumps(
+                obj, indent=indent or 0, ensure_ascii=False).encode("utf-8")
+    except (TypeError, OverflowError):
+        pass
+    return json.dumps(obj, indent=indent).encode("utf-8")
+
+
+def open_file(path, mode="rb"):
+    """Opens a file, compressing it with gzip if it is a `.jamz` file."""
+    if path.endswith(".jamz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def load(path, backend=None):
+    """Loads a JSON (or gzipped `.jamz`) file."""
+    with open_file(path, "rb") as fp:
+        return loads(fp.read(), backend)
+
+
+def save_json(obj, path, indent=2, backend=None):
+    """Saves an object to a JSON (or gzipped `.jamz`) file.
+
+    The file is written atomically: the document goes to a temporary file of
+    the same folder, which is synced and renamed over path, so a crash never
+    leaves a truncated file (see `journal.py` to make the rename durable).
+    """
+    document = dumps(obj, indent=indent, backend=backend)
+    folder, name = os.path.split(path)
+    tmp_path = os.path.join(folder, ".%s.%d.tmp" % (name, os.getpid()))
+    try:
+        with open(tmp_path, "wb") as fp:
+            if path.endswith(".jamz"):
+                with gzip.GzipFile(name, "wb", fileobj=fp) as gz:
+                    gz.write(document)
+            else:
+                fp.write(document)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_jam(jam, path, strict=True, backend=None):
+    """Validates and saves a jams.JAMS object, as `jam.save` does, but
+    serializing it with the selected JSON backend.
+
+    Parameters
+    ----------
+    jam : jams.JAMS
+        The JAMS object.
+    path : str
+        Output path (`.jams` or gzipped `.jamz`).
+    strict : bool
+        Whether validation errors raise an exception.
+    backend : str
+        Name of the backend (see `get_backend`).
+    """
+    jam.validate(strict=strict)
+    save_json(jam.__json__, path, indent=2, backend=backend)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+Lazy loading of JAMS files: metadata is parsed eagerly, while the `data` of
+each annotation is kept as an unparsed byte span until it is accessed.
+
+The JAMS files of `datasets/` are pretty-printed, so the `data` field of an
+annotation ends on the first following line indented as its key. The spans
+are thus found with a few byte searches, and only the remaining skeleton
+(file metadata, sandboxes and annotation metadata) is parsed. Files that
+are not indented are parsed in full, and behave the same.
+
+Usage examples (from Python):
+    >>> jam = LazyJAMS("../datasets/MedleyDB/MusicDelta_Beatles.jams")
+    >>> jam.duration, jam.namespaces
+    >>> jam.annotations[3].data  # parsed now
+
+Run as a script, it sweeps the metadata of a corpus:
+    ./lazy_jams.py ../datasets/MedleyDB
+"""
+
+import argparse
+import logging
+import re
+import time
+
+import corpus_io
+import json_backend
+import pitch_encoding
+
+# Placeholder of a data span in the skeleton (a NUL character can only be
+# escaped in JSON strings, so it does not appear in real values)
+PLACEHOLDER = b'"\\u0000lazy:%d"'
+PLACEHOLDER_PREFIX = "\x00lazy:"
+DATA_KEY = b'"data":'
+CLOSING = {b"[": b"]", b"{": b"}"}
+
+
+def get_indent(raw):
+    """Gets the indentation unit of a pretty-printed JSON document, or None
+    if it is not indented."""
+    match = re.match(br'\s*\{\s*?\n( +)"', raw)
+    return len(match.group(1)) if match else None
+
+
+def split_spans(raw):
+    """Splits a pretty-printed JAMS document into a skeleton and the byte
+    spans of its annotation data.
+
+    Returns
+    -------
+    skeleton : bytes
+        The document with every annotation `data` replaced by a placeholder
+        string.
+    spans : list
+        (start, end) offsets of the data in raw, in document order.
+    """
+    indent = get_indent(raw)
+    if indent is None:
+        return raw, []
+    # Keys of annotations (in the list of a top-level key) are 3 levels deep
+    depth = 3 * indent
+    pieces, spans, position = [], [], 0
+    key = raw.find(DATA_KEY)
+    while key >= 0:
+        line = raw.rfind(b"\n", 0, key) + 1
+        if key - line != depth or raw[line:key].strip():
+            key = raw.find(DATA_KEY, key + 1)
+            continue
+        start = key + len(DATA_KEY)
+        while raw[start:start + 1] == b" ":
+            start += 1
+        close = CLOSING.get(raw[start:start + 1])
+        if close is None:
+            key = raw.find(DATA_KEY, start)
+            continue
+        if raw[start + 1:start + 64].lstrip()[:1] == close:
+            end = raw.index(close, start + 1) + 1
+        else:
+            end = raw.find(b"\n" + raw[line:key] + close, start)
+            if end < 0:
+                return raw, []
+            end += depth + 2
+        pieces += [raw[position:start], PLACEHOLDER % len(spans)]
+        spans.append((start, end))
+        position = end
+        key = raw.find(DATA_KEY, end)
+    pieces.append(raw[position:])
+    return b"".join(pieces), spans
+
+
+class LazyAnnotation(object):
+    """Annotation whose data is parsed on first access.
+
+    Parameters
+    ----------
+    raw : dict
+        The annotation, as parsed from the skeleton.
+    key : str
+        Top-level key of the annotation list (`annotations`, or the
+        namespace of early pyjams files).
+    loader : callable
+        Function returning the parsed data.
+    """
+    def __init__(self, raw, key, loader):
+        self.raw = raw
+        self.key = key
+        self._loader = loader
+        self._data = None
+
+    @property
+    def annotation_metadata(self):
+        return self.raw.get("annotation_metadata", {})
+
+    @property
+    def sandbox(self):
+        return self.raw.get("sandbox", {})
+
+    @property
+    def namespace(self):
+        """Namespace of the annotation, as given by
+        `corpus_io.iter_annotations`."""
+        if self.key == "annotations":
+            return self.raw["namespace"]
+        namespace = corpus_io.OLD_NAMESPACES[self.key]
+        # Rock Corpus chords are roman numerals
+        if namespace == "chord" and \
+                self.annotation_metadata.get("corpus") == "Rock Corpus":
+            namespace = "chord_roman"
+        return namespace
+
+    @property
+    def loaded(self):
+        """Whether the data was parsed."""
+        return self._data is not None
+
+    @property
+    def data(self):
+        """The raw `data` field of the annotation, parsed on first access."""
+        if self._data is None:
+            self._data = self._loader()
+        return self._data
+
+    @property
+    def columns(self):
+        """The observation columns of the annotation (see
+        `corpus_io.iter_annotations`)."""
+        if self.key != "annotations":
+            return corpus_io._old_columns(
+                self.data, self.annotation_metadata.get("corpus"))
+        encoding = self.sandbox.get(pitch_encoding.SANDBOX_KEY)
+        if encoding is not None:
+            return pitch_encoding.decode_uniform_hop(encoding)
+        return pitch_encoding.get_columns(self.data)
+
+    def to_dict(self):
+        """The full annotation, as a JSON dictionary."""
+        annotation = dict(self.raw)
+        annotation["data"] = self.data
+        return annotation
+
+
+class LazyJAMS(object):
+    """JAMS file with lazily parsed annotation data.
+
+    Parameters
+    ----------
+    jams_file : str
+        Path to the JAMS (or `.jamz`) file.
+    backend : str
+        Name of the JSON backend (see `json_backend.get_backend`).
+    """
+    def __init__(self, jams_file, backend=None):
+        self.jams_file = jams_file
+        self.backend = backend
+        with corpus_io.open_jams(jams_file) as fp:
+            self._raw = fp.read()
+        skeleton, self._spans = split_spans(self._raw)
+        if not self._spans:
+            self._raw = None
+        self.skeleton = json_backend.loads(skeleton, backend)
+
+        # Same order as corpus_io.iter_annotations
+        self.annotations = []
+        for key, annotations in sorted(self.skeleton.items()):
+            if key != "annotations" and key not in corpus_io.OLD_NAMESPACES:
+                continue
+            for annotation in annotations:
+                self.annotations.append(LazyAnnotation(
+                    annotation, key, self._get_loader(annotation)))
+        self._restore(self.skeleton, set(id(annotation.raw)
+                                         for annotation in self.annotations))
+
+    def _get_span(self, value):
+        """Index of the span of a placeholder, or None."""
+        if isinstance(value, str) and value.startswith(PLACEHOLDER_PREFIX):
+            return int(value[len(PLACEHOLDER_PREFIX):])
+        return None
+
+    def _load_span(self, i):
+        """Parses the i-th data span."""
+        start, end = self._spans[i]
+        return json_backend.loads(self._raw[start:end], self.backend)
+
+    def _get_loader(self, annotation):
+        """Function that loads the data of an annotation."""
+        i = self._get_span(annotation.get("data"))
+        if i is None:
+            data = annotation.get("data")
+            return lambda: data
+        return lambda: self._load_span(i)
+
+    def _restore(self, obj, lazy_ids):
+        """Parses the spans found outside of annotations (e.g., `data` keys
+        in sandboxes), which are not lazy. lazy_ids are the ids of the
+        annotation dictionaries."""
+        if isinstance(obj, dict):
+            items = list(obj.items())
+        elif isinstance(obj, list):
+            items = list(enumerate(obj))
+        else:
+            return
+        for key, value in items:
+            i = self._get_span(value)
+            if i is None:
+                self._restore(value, lazy_ids)
+            elif key != "data" or id(obj) not in lazy_ids:
+                obj[key] = self._load_span(i)
+
+    @property
+    def file_metadata(self):
+        return self.skeleton.get("file_metadata", {})
+
+    @property
+    def sandbox(self):
+        return self.skeleton.get("sandbox", {})
+
+    @property
+    def duration(self):
+        """Duration of the track, from the file metadata (or from the end of
+        its last observation, which loads all the data)."""
+        duration = self.file_metadata.get("duration")
+        if duration:
+            return float(duration)
+        return corpus_io.get_duration(self.to_dict())
+
+    @property
+    def namespaces(self):
+        """Namespaces of the annotations, in file order."""
+        return [annotation.namespace for annotation in self.annotations]
+
+    def search(self, namespace):
+        """Annotations of a given namespace."""
+        return [annotation for annotation in self.annotations
+                if annotation.namespace == namespace]
+
+    def iter_annotations(self, namespace=None):
+        """Same as `corpus_io.iter_annotations`, only parsing the data of
+        the annotations of the given namespace."""
+        for annotation in self.annotations:
+            if namespace is not None and annotation.namespace != namespace:
+                continue
+            yield {"namespace": annotation.namespace,
+                   "annotation_metadata": annotation.annotation_metadata,
+                   "sandbox": annotation.sandbox,
+                   "data": annotation.columns}
+
+    def to_dict(self):
+        """The full JAMS, as a JSON dictionary (loads all the data)."""
+        jam = dict(self.skeleton)
+        for key in jam:
+            if key == "annotations" or key in corpus_io.OLD_NAMESPACES:
+                jam[key] = [annotation.to_dict() for annotation in
+                            self.annotations if annotation.key == key]
+        return jam
+
+
+def main():
+    """Main function to sweep the metadata of a corpus."""
+    parser = argparse.ArgumentParser(
+        description="Sweeps the metadata of a corpus with lazy loading",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("in_dir",
+                        action="store",
+                        help="Folder with the JAMS files")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Sweep the metadata
+    duration, n_annotations = 0.0, 0
+    jams_files = corpus_io.find_jams(args.in_dir)
+    for jams_file in jams_files:
+        jam = LazyJAMS(jams_file)
+        duration += jam.file_metadata.get("duration") or 0.0
+        n_annotations += len(jam.annotations)
+    logging.info("%d files, %d annotations, %.1f hours.", len(jams_files),
+                 n_annotations, duration / 3600)
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
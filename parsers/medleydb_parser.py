@@ -8,7 +8,14 @@ The original data is found online at the following URL:
 
 
 Example:
-./medleydb_parser.py MedleyDB/ [-o MedleyDB_JAMS/]
+./medleydb_parser.py MedleyDB/ [-o MedleyDB_JAMS/] [-j 4] [--compact]
+
+Track metadata is read once into a table cached on disk (keyed by the
+modification time of each `_METADATA.yaml` file), so re-running the parser
+only re-parses the YAML files that changed.
+
+With `--compact`, the melody f0 annotations are stored with the uniform-hop
+encoding of `pitch_encoding.py`.
 
 """
 
@@ -21,13 +28,19 @@ __email__ = "rachel.bittner@nyu.edu"
 import argparse
 import logging
 import os
+import pickle
 import time
 import yaml
 import pandas as pd
 
+from joblib import Parallel, delayed
 from tqdm import tqdm
 
 import jams
+import journal
+import json_backend
+import pitch_encoding
+import sharding
 
 from medleydb import __version__ as VERSION
 
@@ -39,6 +52,12 @@ MEL2 = "The f0 curve of predominant melodic line drawn from multiple sources"
 MEL3 = "The f0 curves of all melodic lines drawn from multiple sources"
 MELODY_DEFS = {1: MEL1, 2: MEL2, 3: MEL3}
 
+# Use the libyaml bindings when available, they are an order of magnitude
+# faster than the pure-Python loader.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+METADATA_CACHE = ".medleydb_metadata.pkl"
+
 
 def fill_file_metadata(jam, artist, title, duration):
     """Fills the song-level metadata into the JAMS jam."""
@@ -93,18 +112,27 @@ def fill_genre_annotation(genre):
     fill_genre_annotation_metadata(ann)
     return ann
 
-def fill_melody_annotation(annot_fpath, mel_type):
-    """Fill a melody annotation with data from annot_fpath."""
+def fill_melody_annotation(annot_fpath, mel_type, compact=False):
+    """Fill a melody annotation with data from annot_fpath. If compact is
+    True and the f0 curve is uniformly sampled, the frames are stored with
+    the uniform-hop encoding instead."""
 
     ann = jams.Annotation(namespace='pitch_hz')
     df = pd.read_csv(annot_fpath, header=None, names=['time', 'value'])
-    df['duration'] = 0.0
-    df['confidence'] = None
 
     ann.time = 0.0
     ann.duration = df['time'].max()
 
-    ann.data = jams.JamsFrame.from_dataframe(df)
+    encoding = None
+    if compact:
+        encoding = pitch_encoding.encode_uniform_hop(df['time'].values,
+                                                     df['value'].values)
+    if encoding is not None:
+        ann.sandbox.update(**{pitch_encoding.SANDBOX_KEY: encoding})
+    else:
+        df['duration'] = 0.0
+        df['confidence'] = None
+        ann.data = jams.JamsFrame.from_dataframe(df)
 
     fill_melody_annotation_metadata(ann, mel_type)
 
@@ -127,13 +155,73 @@ def fill_instid_annotation(annot_fpath):
 
     return ann
 
-def create_JAMS(dataset_dir, trackid, out_file):
-    """Creates a JAMS file given the Isophonics lab file."""
+def get_metadata_file(dataset_dir, trackid):
+    """Path to the metadata YAML file of a given track."""
+    return os.path.join(dataset_dir, 'Audio', trackid,
+                        '{:s}_METADATA.yaml'.format(trackid))
 
-    metadata_file = os.path.join(dataset_dir, 'Audio', trackid, '{:s}_METADATA.yaml'.format(trackid))
 
+def read_metadata(metadata_file):
+    """Reads a single track metadata YAML file."""
     with open(metadata_file, 'r') as f_in:
-        metadata = yaml.load(f_in)
+        return yaml.load(f_in, Loader=YAML_LOADER)
+
+
+def load_metadata_table(dataset_dir, cache_file=None):
+    """Loads the metadata of all the tracks in the dataset.
+
+    Track ids are collected from the `Audio/` folder, which is where the
+    metadata files are actually read from. Parsed metadata is stored in
+    `cache_file`, and a file is only parsed again when its modification
+    time differs from the cached one.
+
+    Parameters
+    ----------
+    dataset_dir : str
+        Path to the MedleyDB main folder.
+    cache_file : str
+        Path to the metadata cache (None to disable caching).
+
+    Returns
+    -------
+    table : dict
+        Track metadata dictionaries, keyed by trackid.
+    """
+    cache = dict()
+    if cache_file is not None and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as f_in:
+                cache = pickle.load(f_in)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            logging.warning("Could not read metadata cache %s", cache_file)
+
+    audio_dir = os.path.join(dataset_dir, 'Audio')
+    table = dict()
+    entries = dict()
+    for trackid in sorted(os.listdir(audio_dir)):
+        metadata_file = get_metadata_file(dataset_dir, trackid)
+        if not os.path.isfile(metadata_file):
+            continue
+        mtime = os.path.getmtime(metadata_file)
+        entry = cache.get(trackid)
+        if entry is None or entry['mtime'] != mtime:
+            entry = dict(mtime=mtime, metadata=read_metadata(metadata_file))
+        entries[trackid] = entry
+        table[trackid] = entry['metadata']
+
+    if cache_file is not None and entries != cache:
+        with open(cache_file, 'wb') as f_out:
+            pickle.dump(entries, f_out, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return table
+
+
+def create_JAMS(dataset_dir, trackid, out_file, metadata=None,
+                compact=False):
+    """Creates a JAMS file given the Isophonics lab file."""
+
+    if metadata is None:
+        metadata = read_metadata(get_metadata_file(dataset_dir, trackid))
 
     # New JAMS and annotation
     jam = jams.JAMS()
@@ -147,11 +235,13 @@ def create_JAMS(dataset_dir, trackid, out_file):
 
     melody1_fpath = os.path.join(track_path, "{:s}_MELODY1.csv".format(trackid))
     if os.path.exists(melody1_fpath):
-        jam.annotations.append(fill_melody_annotation(melody1_fpath, 1))
+        jam.annotations.append(fill_melody_annotation(melody1_fpath, 1,
+                                                      compact))
 
     melody2_fpath = os.path.join(track_path, "{:s}_MELODY2.csv".format(trackid))
     if os.path.exists(melody2_fpath):
-        jam.annotations.append(fill_melody_annotation(melody2_fpath, 2))
+        jam.annotations.append(fill_melody_annotation(melody2_fpath, 2,
+                                                      compact))
 
     # Create SourceID Annotation
     instid_fpath = os.path.join(track_path, "{:s}_SOURCEID.lab".format(trackid))
@@ -166,23 +256,36 @@ def create_JAMS(dataset_dir, trackid, out_file):
     fill_file_metadata(jam, metadata['artist'], metadata['title'], duration)
 
     # Save JAMS
-    jam.save(out_file)
+    json_backend.save_jam(jam, out_file)
 
 
-def process(in_dir, out_dir):
+def process(in_dir, out_dir, n_jobs=1, cache_file=None, compact=False,
+            shard=None, resume=False):
     """Converts MedleyDB Annotations into JAMS format, and saves
-    them in the out_dir folder."""
-
-    # Collect all trackid's.
-    yaml_files = jams.util.find_with_extension(os.path.join(in_dir, 'Metadata'), 'yaml')
-    trackids = [jams.util.filebase(y).replace("_METADATA", "") for y in yaml_files]
+    them in the out_dir folder (only the tracks of the given (i, N) shard,
+    if any, and not done by the interrupted run if resume is set)."""
 
     jams.util.smkdirs(out_dir)
 
-    for trackid in tqdm(trackids):
-        jams_file = os.path.join(out_dir, "{:s}.jams".format(trackid))
-        #Create a JAMS file for this track
-        create_JAMS(in_dir, trackid, jams_file)
+    if cache_file is None:
+        cache_file = os.path.join(out_dir, METADATA_CACHE)
+
+    # Collect all trackid's and their metadata.
+    metadata_table = load_metadata_table(in_dir, cache_file)
+    tracks, trackids = sharding.select(sorted(metadata_table.items()), shard,
+                                       key=lambda track: track[0])
+
+    # Create a JAMS file for each track, journaling them as they complete
+    with journal.Journal(out_dir, shard, resume) as run:
+        tracks = run.todo(tracks, key=lambda track: track[0])
+        out_files = [os.path.join(out_dir, "{:s}.jams".format(trackid))
+                     for trackid, _ in tracks]
+        results = Parallel(n_jobs=n_jobs, return_as="generator")(
+            delayed(create_JAMS)(in_dir, trackid, out_file, metadata, compact)
+            for (trackid, metadata), out_file in zip(tqdm(tracks), out_files))
+        for (trackid, _), out_file, _ in zip(tracks, out_files, results):
+            run.add(trackid, out_file)
+    sharding.write_manifest(out_dir, shard, trackids, run.done)
 
 
 def main():
@@ -198,6 +301,32 @@ def main():
                         dest="out_dir",
                         default="outJAMS",
                         help="Output JAMS folder")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    parser.add_argument("--metadata_cache",
+                        action="store",
+                        dest="cache_file",
+                        default=None,
+                        help="Path to the metadata cache file (defaults to a "
+                             "file inside the output folder).")
+    parser.add_argument("--compact",
+                        action="store_true",
+                        help="Store uniformly sampled melody f0 curves with "
+                             "the compact uniform-hop encoding.")
+    parser.add_argument("--shard",
+                        action="store",
+                        type=sharding.parse_shard,
+                        default=None,
+                        help="Only convert the i-th of N shards of the "
+                        "tracks, given as i/N")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Resume an interrupted run, skipping the tracks "
+                        "in its journal")
     args = parser.parse_args()
     start_time = time.time()
 
@@ -205,7 +334,8 @@ def main():
     logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
 
     # Run the parser
-    process(args.in_dir, args.out_dir)
+    process(args.in_dir, args.out_dir, args.n_jobs, args.cache_file,
+            args.compact, args.shard, args.resume)
 
     # Done!
     logging.info("Done! Took %.2f seconds.", time.time() - start_time)
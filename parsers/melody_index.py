@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+"""
+Nearest-neighbor index of melodic contours, for query-by-example and
+query-by-humming over the melody corpora (`pitch_hz` annotations of
+MedleyDB, ADC2004, MIREX05, ...).
+
+Every f0 annotation is cut into overlapping windows (3 seconds every 0.5
+seconds by default). Each window is resampled to a fixed number of points
+(in MIDI pitch, interpolated over unvoiced frames) and its mean pitch is
+subtracted, which gives a transposition-invariant contour vector; windows
+that are mostly unvoiced are skipped. Queries by example (a window of a
+JAMS file) are sampled on exactly the same grid as the indexed windows.
+Hummed queries are converted the same way, but stretched to the number of
+points of a window whatever their duration (so they should last about a
+window), and compared with the RMS distance in semitones.
+
+The index is a folder of `.npy` arrays, memory-mapped when queried, plus
+`sources.json` (the JAMS file and annotation of each source) and
+`config.json`. Exact queries scan all the vectors with a single matrix
+product. With `--n_lists`, windows are also clustered with k-means into
+inverted lists, and approximate queries only scan the lists of the
+`n_probe` closest centroids.
+
+Usage examples:
+    ./melody_index.py build melody_idx ../datasets/MedleyDB \
+../datasets/ADC2004 ../datasets/MIREX05 --n_lists 64 -j 4
+    ./melody_index.py query melody_idx --f0 hummed.csv -k 10 --n_probe 8
+    ./melody_index.py query melody_idx \
+--jams ../datasets/ADC2004/daisy1REF.jams --start 2.0
+"""
+
+import argparse
+import functools
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+import corpus_io
+
+WINDOW = 3.0
+HOP = 0.5
+N_POINTS = 32
+MIN_VOICED = 0.8
+KMEANS_ITERATIONS = 10
+ARRAYS = ["vectors", "norms", "sources", "starts"]
+IVF_ARRAYS = ["centroids", "offsets"]
+
+
+def to_midi(columns):
+    """Sorted times, MIDI pitches and voicing of f0 observation columns
+    (unvoiced frames have a non-positive or null frequency)."""
+    times = np.asarray(columns["time"], dtype=np.float64)
+    freqs = np.array([np.nan if value is None else value
+                      for value in columns["value"]], dtype=np.float64)
+    order = np.argsort(times, kind="stable")
+    times, freqs = times[order], freqs[order]
+    voiced = np.nan_to_num(freqs) > 0
+    midi = np.zeros(len(freqs))
+    midi[voiced] = 69 + 12 * np.log2(freqs[voiced] / 440.0)
+    return times, midi, voiced
+
+
+def resample(times, midi, voiced, grid):
+    """Pitch (interpolated over the voiced frames) and voicing (of the
+    nearest frame) at the times of a grid."""
+    pitch = np.interp(grid, times[voiced], midi[voiced])
+    nearest = np.clip(np.searchsorted(times, grid), 1, len(times) - 1)
+    nearest -= (grid - times[nearest - 1]) < (times[nearest] - grid)
+    return pitch, voiced[nearest]
+
+
+def get_windows(columns, window=WINDOW, hop=HOP, n_points=N_POINTS,
+                min_voiced=MIN_VOICED):
+    """Cuts an f0 annotation into contour vectors.
+
+    Returns
+    -------
+    starts : np.ndarray
+        Start time of each window, in seconds.
+    vectors : np.ndarray
+        float32 `(n_windows, n_points)` contours, in semitones relative to
+        the mean pitch of each window.
+    """
+    times, midi, voiced = to_midi(columns)
+    empty = np.zeros(0), np.zeros((0, n_points), dtype=np.float32)
+    if voiced.sum() < 2:
+        return empty
+    step = window / n_points
+    grid = np.arange(times[0], times[-1], step)
+    if len(grid) < n_points:
+        return empty
+    pitch, grid_voiced = resample(times, midi, voiced, grid)
+
+    hop_steps = max(int(round(hop / step)), 1)
+    windows = np.lib.stride_tricks.sliding_window_view(
+        pitch, n_points)[::hop_steps]
+    voicing = np.lib.stride_tricks.sliding_window_view(
+        grid_voiced, n_points)[::hop_steps].mean(axis=1)
+    keep = voicing >= min_voiced
+    vectors = windows[keep] - windows[keep].mean(axis=1, keepdims=True)
+    return grid[::hop_steps][:len(windows)][keep], vectors.astype(np.float32)
+
+
+def get_window_contour(columns, start, window=WINDOW, n_points=N_POINTS):
+    """Contour vector of the window of an f0 annotation that starts at the
+    given time, sampled on the grid of the indexed windows (see
+    `get_windows`) and interpolated over the whole annotation."""
+    times, midi, voiced = to_midi(columns)
+    if voiced.sum() < 2:
+        raise ValueError("The annotation has less than two voiced frames")
+    grid = start + np.arange(n_points) * (window / n_points)
+    pitch, _ = resample(times, midi, voiced, grid)
+    return (pitch - pitch.mean()).astype(np.float32)
+
+
+def get_contour(times, freqs, n_points=N_POINTS):
+    """Contour vector of a whole query f0 track (e.g. hummed), stretched to
+    n_points whatever its duration."""
+    times, midi, voiced = to_midi(dict(time=times, value=freqs))
+    if voiced.sum() < 2:
+        raise ValueError("The query has less than two voiced frames")
+    grid = np.linspace(times[0], times[-1], n_points)
+    pitch, _ = resample(times, midi, voiced, grid)
+    return (pitch - pitch.mean()).astype(np.float32)
+
+
+def get_file_windows(jam, namespace="pitch_hz", **kwargs):
+    """Contour vectors of all the f0 annotations of a loaded JAMS.
+
+    Returns
+    -------
+    windows : list
+        (annotation index, starts, vectors) tuples.
+    """
+    return [(i,) + get_windows(annotation["data"], **kwargs)
+            for i, annotation in enumerate(corpus_io.iter_annotations(
+                jam, namespace))]
+
+
+def kmeans(vectors, n_clusters, n_iterations=KMEANS_ITERATIONS,
+           chunk_size=8192):
+    """Clusters vectors with Lloyd's k-means.
+
+    Returns
+    -------
+    centroids : np.ndarray
+        `(n_clusters, n_dims)` centroids.
+    labels : np.ndarray
+        Cluster of each vector.
+    """
+    rng = np.random.RandomState(0)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)]
+    for _ in range(n_iterations + 1):
+        labels = np.concatenate([
+            nearest_centroids(vectors[i:i + chunk_size], centroids, 1)[:, 0]
+            for i in range(0, len(vectors), chunk_size)])
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros(centroids.shape)
+        np.add.at(sums, labels, vectors)
+        # Empty clusters keep their centroid
+        filled = counts > 0
+        centroids = centroids.copy()
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids.astype(np.float32), labels
+
+
+def nearest_centroids(vectors, centroids, n):
+    """Indices of the n nearest centroids of each vector."""
+    distances = (centroids ** 2).sum(axis=1) - 2 * vectors.dot(centroids.T)
+    n = min(n, len(centroids))
+    nearest = np.argpartition(distances, n - 1, axis=1)[:, :n]
+    order = np.argsort(np.take_along_axis(distances, nearest, axis=1), axis=1)
+    return np.take_along_axis(nearest, order, axis=1)
+
+
+def build(out_dir, in_dirs, namespace="pitch_hz", window=WINDOW, hop=HOP,
+          n_points=N_POINTS, min_voiced=MIN_VOICED, n_lists=0, n_jobs=1):
+    """Builds a melody index.
+
+    Parameters
+    ----------
+    out_dir : str
+        Folder where the index is stored.
+    in_dirs : list
+        Folders with the JAMS files to index.
+    namespace : str
+        Namespace of the f0 annotations.
+    window : float
+        Duration of the windows, in seconds.
+    hop : float
+        Time between the starts of consecutive windows, in seconds.
+    n_points : int
+        Number of points of the contour vectors.
+    min_voiced : float
+        Minimum voiced fraction of an indexed window.
+    n_lists : int
+        Number of inverted lists of the approximate index (0 to only
+        support exact queries).
+    n_jobs : int
+        Number of parallel jobs.
+    """
+    jams_files = []
+    for in_dir in in_dirs:
+        jams_files += corpus_io.find_jams(in_dir)
+    func = functools.partial(get_file_windows, namespace=namespace,
+                             window=window, hop=hop, n_points=n_points,
+                             min_voiced=min_voiced)
+    sources, source_ids, starts, vectors = [], [], [], []
+    for jams_file, windows in corpus_io.iter_load(jams_files, n_jobs,
+                                                  func=func):
+        for i, file_starts, file_vectors in windows:
+            source_ids.append(np.full(len(file_starts), len(sources),
+                                      dtype=np.int32))
+            sources.append([jams_file, i])
+            starts.append(file_starts)
+            vectors.append(file_vectors)
+    arrays = dict(
+        vectors=np.concatenate(vectors + [np.zeros((0, n_points),
+                                                   dtype=np.float32)]),
+        sources=np.concatenate(source_ids + [np.zeros(0, dtype=np.int32)]),
+        starts=np.concatenate(starts + [np.zeros(0)]).astype(np.float32))
+
+    if n_lists and len(arrays["vectors"]):
+        logging.info("Clustering %d windows into %d lists...",
+                     len(arrays["vectors"]), n_lists)
+        centroids, labels = kmeans(arrays["vectors"], n_lists)
+        order = np.argsort(labels, kind="stable")
+        for name in list(arrays):
+            arrays[name] = arrays[name][order]
+        arrays["centroids"] = centroids
+        arrays["offsets"] = np.searchsorted(
+            labels[order], np.arange(len(centroids) + 1)).astype(np.int64)
+    arrays["norms"] = (arrays["vectors"].astype(np.float64) ** 2).sum(axis=1)
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, name + ".npy"), array)
+    with open(os.path.join(out_dir, "sources.json"), "w") as fp:
+        json.dump(sources, fp, indent=2)
+    with open(os.path.join(out_dir, "config.json"), "w") as fp:
+        json.dump(dict(namespace=namespace, window=window, hop=hop,
+                       n_points=n_points, min_voiced=min_voiced,
+                       n_lists=len(arrays.get("centroids", []))), fp, indent=2)
+    logging.info("Indexed %d windows of %d annotations from %d files.",
+                 len(arrays["vectors"]), len(sources), len(jams_files))
+
+
+class MelodyIndex(object):
+    """Melody index built by `build`.
+
+    Parameters
+    ----------
+    index_dir : str
+        Folder where the index is stored.
+    """
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "config.json"), "r") as fp:
+            self.config = json.load(fp)
+        with open(os.path.join(index_dir, "sources.json"), "r") as fp:
+            self.sources = json.load(fp)
+        names = ARRAYS + (IVF_ARRAYS if self.config["n_lists"] else [])
+        self.arrays = dict(
+            (name, np.load(os.path.join(index_dir, name + ".npy"),
+                           mmap_mode="r"))
+            for name in names)
+
+    def __len__(self):
+        return len(self.arrays["vectors"])
+
+    def get_contour(self, times, freqs):
+        """Contour vector of a query f0 track."""
+        return get_contour(times, freqs, self.config["n_points"])
+
+    def get_jams_contour(self, jams_file, start, annotation=0):
+        """Contour vector of the window of an f0 annotation of a JAMS file
+        that starts at the given time."""
+        jam = corpus_io.load_jam(jams_file)
+        columns = list(corpus_io.iter_annotations(
+            jam, self.config["namespace"]))[annotation]["data"]
+        return get_window_contour(columns, start, self.config["window"],
+                                  self.config["n_points"])
+
+    def _candidates(self, contour, n_probe):
+        """Indices of the windows to scan (None for all of them)."""
+        if n_probe is None or not self.config["n_lists"]:
+            return None
+        lists = nearest_centroids(contour[None, :],
+                                  self.arrays["centroids"], n_probe)[0]
+        offsets = self.arrays["offsets"]
+        return np.concatenate([np.arange(offsets[i], offsets[i + 1])
+                               for i in lists])
+
+    def query(self, contour, k=10, n_probe=None):
+        """Finds the windows closest to a contour vector.
+
+        Parameters
+        ----------
+        contour : np.ndarray
+            Query contour (see `get_contour`).
+        k : int
+            Number of results.
+        n_probe : int
+            If given (and the index has inverted lists), only the windows
+            of the n_probe lists closest to the query are scanned.
+
+        Returns
+        -------
+        results : list
+            (distance, JAMS file, annotation index, start time) tuples,
+            sorted by distance (RMS, in semitones).
+        """
+        contour = np.asarray(contour, dtype=np.float32)
+        candidates = self._candidates(contour, n_probe)
+        vectors, norms = self.arrays["vectors"], self.arrays["norms"]
+        if candidates is not None:
+            vectors, norms = vectors[candidates], norms[candidates]
+        distances = norms - 2 * vectors.dot(contour) + contour.dot(contour)
+        k = min(k, len(distances))
+        if k == 0:
+            return []
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best])]
+        rms = np.sqrt(np.maximum(distances[best], 0) / len(contour))
+        if candidates is not None:
+            best = candidates[best]
+        results = []
+        for distance, i in zip(rms, best):
+            jams_file, annotation = self.sources[self.arrays["sources"][i]]
+            results.append((float(distance), jams_file, annotation,
+                            float(self.arrays["starts"][i])))
+        return results
+
+
+def main():
+    """Main function to build or query a melody index."""
+    parser = argparse.ArgumentParser(
+        description="Melodic contour index with nearest-neighbor queries",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    build_parser = subparsers.add_parser("build", help="Build an index")
+    build_parser.add_argument("index_dir",
+                              action="store",
+                              help="Output index folder")
+    build_parser.add_argument("in_dirs",
+                              action="store",
+                              nargs="+",
+                              help="Folders with the JAMS files to index")
+    build_parser.add_argument("-n",
+                              action="store",
+                              dest="namespace",
+                              default="pitch_hz",
+                              help="Namespace of the f0 annotations")
+    build_parser.add_argument("--window",
+                              action="store",
+                              type=float,
+                              default=WINDOW,
+                              help="Duration of the windows, in seconds")
+    build_parser.add_argument("--hop",
+                              action="store",
+                              type=float,
+                              default=HOP,
+                              help="Hop between windows, in seconds")
+    build_parser.add_argument("--n_points",
+                              action="store",
+                              type=int,
+                              default=N_POINTS,
+                              help="Number of points of the contours")
+    build_parser.add_argument("--min_voiced",
+                              action="store",
+                              type=float,
+                              default=MIN_VOICED,
+                              help="Minimum voiced fraction of a window")
+    build_parser.add_argument("--n_lists",
+                              action="store",
+                              type=int,
+                              default=0,
+                              help="Number of k-means lists for approximate "
+                              "queries (0 for exact queries only)")
+    build_parser.add_argument("-j",
+                              action="store",
+                              dest="n_jobs",
+                              type=int,
+                              default=1,
+                              help="Number of CPUs to run in parallel.")
+    query_parser = subparsers.add_parser("query", help="Query an index")
+    query_parser.add_argument("index_dir",
+                              action="store",
+                              help="Index folder")
+    query_parser.add_argument("--f0",
+                              action="store",
+                              default=None,
+                              help="CSV file with the (time, frequency) "
+                              "rows of the query")
+    query_parser.add_argument("--jams",
+                              action="store",
+                              default=None,
+                              help="JAMS file of a query by example")
+    query_parser.add_argument("--start",
+                              action="store",
+                              type=float,
+                              default=0.0,
+                              help="Start time of the query in the JAMS file")
+    query_parser.add_argument("--annotation",
+                              action="store",
+                              type=int,
+                              default=0,
+                              help="Index of the f0 annotation of the JAMS "
+                              "file")
+    query_parser.add_argument("-k",
+                              action="store",
+                              type=int,
+                              default=10,
+                              help="Number of results")
+    query_parser.add_argument("--n_probe",
+                              action="store",
+                              type=int,
+                              default=None,
+                              help="Number of lists scanned by approximate "
+                              "queries (exact query by default)")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    if args.command == "build":
+        build(args.index_dir, args.in_dirs, args.namespace, args.window,
+              args.hop, args.n_points, args.min_voiced, args.n_lists,
+              args.n_jobs)
+    elif args.command == "query":
+        index = MelodyIndex(args.index_dir)
+        if args.f0 is not None:
+            f0 = np.loadtxt(args.f0, delimiter=",", ndmin=2)
+            contour = index.get_contour(f0[:, 0], f0[:, 1])
+        else:
+            contour = index.get_jams_contour(args.jams, args.start,
+                                             args.annotation)
+        query_time = time.time()
+        results = index.query(contour, args.k, args.n_probe)
+        logging.info("Query took %.2f ms.", 1000 * (time.time() - query_time))
+        for distance, jams_file, annotation, start in results:
+            print("%.3f\t%s\t%d\t%.2f" % (distance, jams_file, annotation,
+                                          start))
+    else:
+        parser.print_help()
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -21,12 +21,19 @@ __version__ = "1.0"
 __email__ = "justin.salamon@nyu.edu"
 
 import argparse
+import functools
+import io
 import logging
 import os
 import time
 import audioread
 
 import jams
+import journal
+import json_backend
+import pipeline
+import pitch_encoding
+import sharding
 
 
 def get_track_duration(filename):
@@ -56,40 +63,85 @@ def fill_annotation_metadata(annot):
     annot.annotation_metadata.annotator = {}
 
 
-def create_JAMS(lab_file, audio_file, out_file):
+def create_JAMS(lab_file, audio_file, out_file, compact=False):
     """
     Creates a JAMS file given the MIREX05 annotation file (*REF.txt) and
     the corresponding audio file (*.wav).
     """
 
+    track = (lab_file, audio_file, out_file)
+    write_track(track, build_JAMS(track, read_track(track), compact))
+
+
+def read_track(track):
+    """Reads the f0 annotation and the audio duration of a
+    (lab_file, audio_file, out_file) track."""
+    lab_file, audio_file, _ = track
+    with open(lab_file, "r") as fp:
+        return fp.read(), get_track_duration(audio_file)
+
+
+def build_JAMS(track, data, compact=False):
+    """Builds and validates the JAMS of a track from its f0 annotation and
+    audio duration (see `read_track`), and returns its JSON document."""
+    lab_file = track[0]
+    f0_text, duration = data
+
     # Import melody annotation
-    jam, melody_ann = jams.util.import_lab('pitch_hz', lab_file)
+    jam, melody_ann = jams.util.import_lab('pitch_hz', io.StringIO(f0_text))
+
+    # Store the f0 curve with the uniform-hop encoding, if requested
+    if compact:
+        pitch_encoding.compact_annotation(melody_ann)
 
     # Fill annotation metadata
     fill_annotation_metadata(melody_ann)
 
     # Fill file metadata
-    duration = get_track_duration(audio_file)
     fill_file_metadata(jam, lab_file, duration)
 
-    # Save JAMS
-    jam.save(out_file)
+    jam.validate()
+    return jam.__json__
+
 
+def write_track(track, document):
+    """Saves the JSON document of a track, and returns its path."""
+    json_backend.save_json(document, track[2])
+    return track[2]
 
-def process_folder(in_dir, out_dir):
+
+def process_folder(in_dir, out_dir, compact=False, shard=None,
+                   resume=False, n_jobs=1, n_readers=pipeline.N_READERS):
     """Converts the original f0 annotations into the JAMS format, and saves
-    them in the out_dir folder."""
+    them in the out_dir folder (only the tracks of the given (i, N) shard,
+    if any, and not done by the interrupted run if resume is set).
+
+    Reading the source files, building the JAMS and writing them are
+    pipelined (see `pipeline.py`), with n_readers threads reading and n_jobs
+    workers building."""
 
     # Collect all melody f0 annotations.
     f0_files = jams.util.find_with_extension(in_dir, '.txt', depth=1)
-
-    for f0_file in f0_files:
-        audio_file = f0_file.replace("REF.txt", ".wav")
-        jams_file = os.path.join(out_dir,
+    f0_files, track_ids = sharding.select(f0_files, shard,
+                                          key=jams.util.filebase)
+
+    with journal.Journal(out_dir, shard, resume) as run:
+        tracks = []
+        for f0_file in run.todo(f0_files, key=jams.util.filebase):
+            audio_file = f0_file.replace("REF.txt", ".wav")
+            jams_file = os.path.join(out_dir,
                             os.path.basename(f0_file).replace('.txt', '.jams'))
-        jams.util.smkdirs(os.path.split(jams_file)[0])
-        # Create a JAMS file for this track
-        create_JAMS(f0_file, audio_file, jams_file)
+            jams.util.smkdirs(os.path.split(jams_file)[0])
+            tracks.append((f0_file, audio_file, jams_file))
+
+        # Create a JAMS file for each track
+        pipeline.run(tracks, read_track,
+                     functools.partial(build_JAMS, compact=compact),
+                     write_track,
+                     on_done=lambda track, jams_file: run.add(
+                         jams.util.filebase(track[0]), jams_file),
+                     n_readers=n_readers, n_jobs=n_jobs)
+    sharding.write_manifest(out_dir, shard, track_ids, run.done)
 
 
 def main():
@@ -106,6 +158,32 @@ def main():
                         dest="out_dir",
                         default="mirex05TrainFiles_jams",
                         help="Output JAMS folder")
+    parser.add_argument("--compact",
+                        action="store_true",
+                        help="Store the f0 curves with the compact "
+                             "uniform-hop encoding")
+    parser.add_argument("--shard",
+                        action="store",
+                        type=sharding.parse_shard,
+                        default=None,
+                        help="Only convert the i-th of N shards of the "
+                        "tracks, given as i/N")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    parser.add_argument("--readers",
+                        action="store",
+                        dest="n_readers",
+                        type=int,
+                        default=pipeline.N_READERS,
+                        help="Number of threads reading the source files.")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Resume an interrupted run, skipping the tracks "
+                        "in its journal")
     args = parser.parse_args()
     start_time = time.time()
 
@@ -113,7 +191,8 @@ def main():
     logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
 
     # Run the parser
-    process_folder(args.in_dir, args.out_dir)
+    process_folder(args.in_dir, args.out_dir, args.compact, args.shard,
+                   args.resume, args.n_jobs, args.n_readers)
 
     # Done!
     logging.info("Done! Took %.2f seconds.", time.time() - start_time)
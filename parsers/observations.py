@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""
+Compact in-memory container for the observations of an annotation.
+
+Instead of a DataFrame with timedelta columns and object values, an
+`Observations` object holds:
+
+    - `time` and `duration`: float64 arrays, in seconds.
+    - `confidence`: float32 array.
+    - `values`: int64 or float64 array for numeric values (beat positions,
+      onsets, f0, ...), or int32 codes into `categories` for any other
+      values (labels, tags, roman numerals, ...). Category strings are
+      interned, so every occurrence of a label in memory is the same
+      object. With a corpus-level vocabulary (see `vocabulary.py`), the
+      codes are those of the vocabulary and all the containers of a
+      namespace share its list of labels.
+    - `nulls`: boolean masks of the null entries of the numeric columns
+      (stored as NaN in the arrays), keyed by column name, for the columns
+      that have any. Nulls and NaNs (e.g. the confidences of SMC) thus both
+      come back as they were.
+
+It converts to and from the JSON observation lists of JAMS files, and loads
+a corpus in a fraction of the memory of DataFrames. Run as a script, it
+reports the memory used by the annotations of a corpus:
+
+    ./observations.py ../datasets/Harmonix -n beat onset segment_open -j 4
+    ./observations.py ../datasets/SALAMI -v vocabularies.json -j 4
+"""
+
+import argparse
+import functools
+import json
+import logging
+import sys
+import time
+
+import numpy as np
+
+import corpus_io
+import vocabulary
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _encode_nulls(column):
+    """Replaces the nulls of a numeric column with NaN.
+
+    Returns
+    -------
+    column : list
+        Values of the column, with NaN for nulls.
+    nulls : np.ndarray
+        Boolean mask of the nulls (None if there are none).
+    """
+    nulls = np.array([x is None for x in column], dtype=bool)
+    if not nulls.any():
+        return list(column), None
+    return [np.nan if x is None else x for x in column], nulls
+
+
+def _restore_nulls(values, nulls=None):
+    """Puts back None at the masked nulls of a list of values (NaNs are
+    kept)."""
+    if nulls is not None:
+        for i in np.flatnonzero(nulls).tolist():
+            values[i] = None
+    return values
+
+
+def _category_key(value):
+    """Hashable key of a categorical value."""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def encode_values(values):
+    """Encodes observation values.
+
+    Returns
+    -------
+    values : np.ndarray
+        int64 array if all values are integers, float64 array if they are
+        all numbers or nulls (stored as NaN, see `_encode_nulls`), and int32
+        codes otherwise.
+    categories : list
+        Distinct values, in order of appearance, for categorical values
+        (None otherwise).
+    """
+    if all(_is_number(value) for value in values):
+        if all(isinstance(value, int) for value in values):
+            return np.array(values, dtype=np.int64), None
+        return np.array(values, dtype=np.float64), None
+    if all(value is None or _is_number(value) for value in values):
+        return np.array(_encode_nulls(values)[0], dtype=np.float64), None
+    codes = np.empty(len(values), dtype=np.int32)
+    categories, index = [], dict()
+    for i, value in enumerate(values):
+        key = _category_key(value)
+        code = index.get(key)
+        if code is None:
+            code = index[key] = len(categories)
+            categories.append(sys.intern(value) if isinstance(value, str)
+                              else value)
+        codes[i] = code
+    return codes, categories
+
+
+class Observations(object):
+    """Observations of an annotation, stored as arrays.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Start times, in seconds.
+    duration : np.ndarray
+        Durations, in seconds.
+    confidence : np.ndarray
+        Confidences.
+    values : np.ndarray
+        Numeric values, or codes into categories.
+    categories : list
+        Distinct values of categorical observations (None for numeric
+        values).
+    nulls : dict
+        Boolean masks of the null entries of the `time`, `duration`,
+        `confidence` and numeric `value` columns, for the columns that have
+        any.
+    """
+    __slots__ = ["time", "duration", "confidence", "values", "categories",
+                 "nulls"]
+
+    def __init__(self, time, duration, confidence, values, categories=None,
+                 nulls=None):
+        self.time = np.asarray(time, dtype=np.float64)
+        self.duration = np.asarray(duration, dtype=np.float64)
+        self.confidence = np.asarray(confidence, dtype=np.float32)
+        self.values = np.asarray(values)
+        self.categories = categories
+        self.nulls = dict() if nulls is None else nulls
+
+    @classmethod
+    def from_columns(cls, columns, vocab=None):
+        """Builds the container from a dictionary of `time`, `duration`,
+        `value` and `confidence` columns (see
+        `corpus_io.iter_annotations`). If a `vocabulary.Vocabulary` is
+        given, values are encoded with it (unknown values get the code
+        -1)."""
+        if vocab is None:
+            values, categories = encode_values(list(columns["value"]))
+        else:
+            values, categories = vocab.encode(columns["value"]), vocab.labels
+        nulls, arrays = dict(), dict()
+        for field in ["time", "duration", "confidence"]:
+            arrays[field], mask = _encode_nulls(columns[field])
+            if mask is not None:
+                nulls[field] = mask
+        if categories is None:
+            mask = _encode_nulls(columns["value"])[1]
+            if mask is not None:
+                nulls["value"] = mask
+        return cls(arrays["time"], arrays["duration"], arrays["confidence"],
+                   values, categories, nulls)
+
+    @classmethod
+    def from_json(cls, data):
+        """Builds the container from the `data` field of a JAMS annotation
+        (a list of observations, or a dictionary of columns)."""
+        if isinstance(data, dict):
+            return cls.from_columns(data)
+        return cls.from_columns(dict(
+            (field, [obs[field] for obs in data])
+            for field in corpus_io.FIELDS))
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def is_categorical(self):
+        return self.categories is not None
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays (and null masks), in bytes."""
+        return self.time.nbytes + self.duration.nbytes + \
+            self.confidence.nbytes + self.values.nbytes + \
+            sum(mask.nbytes for mask in self.nulls.values())
+
+    def get_values(self):
+        """The values of the observations, as a list (None for nulls)."""
+        if self.categories is None:
+            return _restore_nulls(self.values.tolist(),
+                                  self.nulls.get("value"))
+        return [self.categories[code] if code >= 0 else None
+                for code in self.values.tolist()]
+
+    def get_confidences(self):
+        """The confidences, as a list of floats (None for nulls). float32
+        values are converted with their shortest representation, so that
+        e.g. a confidence of 0.3 stays 0.3."""
+        return _restore_nulls([float(x) for x in
+                               self.confidence.astype(str).tolist()],
+                              self.nulls.get("confidence"))
+
+    def to_columns(self):
+        """Converts the container to a dictionary of columns."""
+        return dict(time=_restore_nulls(self.time.tolist(),
+                                        self.nulls.get("time")),
+                    duration=_restore_nulls(self.duration.tolist(),
+                                            self.nulls.get("duration")),
+                    value=self.get_values(),
+                    confidence=self.get_confidences())
+
+    def to_json(self):
+        """Converts the container to a JSON list of observations."""
+        columns = self.to_columns()
+        return [dict(time=obs_time, duration=duration, value=value,
+                     confidence=confidence)
+                for obs_time, duration, value, confidence in
+                zip(columns["time"], columns["duration"], columns["value"],
+                    columns["confidence"])]
+
+
+def get_observations(jam, namespaces=None, vocabularies=None):
+    """Converts the annotations of a loaded JAMS into containers.
+
+    Parameters
+    ----------
+    jam : dict
+        JAMS file loaded as JSON.
+    namespaces : list
+        If given, only annotations of these namespaces are converted.
+    vocabularies : vocabulary.VocabularyStore
+        If given, values of the namespaces in the store are encoded with
+        their vocabulary.
+
+    Returns
+    -------
+    annotations : list
+        (namespace, Observations) tuples.
+    """
+    annotations = []
+    for annotation in corpus_io.iter_annotations(jam):
+        namespace = annotation["namespace"]
+        if namespaces is not None and namespace not in namespaces:
+            continue
+        vocab = None if vocabularies is None else vocabularies.get(namespace)
+        annotations.append((namespace, Observations.from_columns(
+            annotation["data"], vocab)))
+    return annotations
+
+
+def load_corpus(in_dir, namespaces=None, n_jobs=1, vocabularies=None):
+    """Loads the annotations of a corpus into containers.
+
+    Returns
+    -------
+    corpus : dict
+        List of (namespace, Observations) tuples, keyed by track ID.
+    """
+    jams_files = corpus_io.find_jams(in_dir)
+    func = functools.partial(get_observations, namespaces=namespaces,
+                             vocabularies=vocabularies)
+    corpus = dict()
+    for jams_file, annotations in corpus_io.iter_load(jams_files, n_jobs,
+                                                      func=func):
+        if vocabularies is not None:
+            # Share the labels of the parent process vocabularies, instead
+            # of the copies sent back by the workers
+            for namespace, observations in annotations:
+                if namespace in vocabularies:
+                    observations.categories = vocabularies[namespace].labels
+        corpus[corpus_io.get_track_id(jams_file, in_dir)] = annotations
+    return corpus
+
+
+def main():
+    """Main function to load a corpus into compact containers."""
+    parser = argparse.ArgumentParser(
+        description="Loads a corpus into compact observation containers",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("in_dir",
+                        action="store",
+                        help="Folder with the JAMS files")
+    parser.add_argument("-n",
+                        action="store",
+                        dest="namespaces",
+                        nargs="+",
+                        default=None,
+                        help="Namespaces to load (all by default)")
+    parser.add_argument("-v",
+                        action="store",
+                        dest="vocabulary_file",
+                        default=None,
+                        help="Vocabulary store used to encode the values")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Load the corpus
+    vocabularies = None
+    if args.vocabulary_file is not None:
+        vocabularies = vocabulary.VocabularyStore(args.vocabulary_file)
+    corpus = load_corpus(args.in_dir, args.namespaces, args.n_jobs,
+                         vocabularies)
+    n_observations, n_bytes = 0, 0
+    for annotations in corpus.values():
+        for _, observations in annotations:
+            n_observations += len(observations)
+            n_bytes += observations.nbytes
+    logging.info("Loaded %d observations from %d files in %.2f MB.",
+                 n_observations, len(corpus), n_bytes / 1e6)
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+"""
+Array-backed index of the `pattern_jku` annotations (JKU-Patterns, HEMAN,
+...), whose observations are notes with a `pattern_id` and an
+`occurrence_id`.
+
+The notes of every annotation are grouped once by (pattern, occurrence)
+into flat arrays, sorted by source annotation, pattern, occurrence, onset
+and pitch:
+
+    - notes: `onsets`, `durations`, `pitches` (MIDI) and `morphs`
+      (morphetic pitch).
+    - occurrences: `occ_sources`, `occ_patterns`, `occ_ids`,
+      `occ_offsets` (first note of each occurrence, plus the total number
+      of notes), `occ_starts` and `occ_ends`, in seconds.
+
+Each occurrence is thus a pair of slices of the note arrays. The index is a
+folder of `.npy` arrays, memory-mapped when queried, plus `sources.json`,
+which records the hash of each file: building it again only reparses the
+corpora if a file changed. Queries:
+
+    - `occurrences`: all the occurrences of a pattern of a piece.
+    - `at`: the patterns of a piece with an occurrence sounding at a time.
+    - `match`: the occurrences of all the pieces with the same pitch
+      intervals as a given one (transposition-invariant), and optionally
+      the same rhythm.
+
+Usage examples:
+    ./pattern_index.py build pattern_idx ../datasets/JKU-Patterns -j 4
+    ./pattern_index.py occurrences pattern_idx \
+JKU-Patterns/bachBWV889Fg-polyphonic 1
+    ./pattern_index.py at pattern_idx JKU-Patterns/chopinOp24No4-monophonic 30
+    ./pattern_index.py match pattern_idx \
+JKU-Patterns/bachBWV889Fg-monophonic 1 1 --rhythm
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+from joblib import Parallel, delayed
+import numpy as np
+
+import corpus_io
+
+NAMESPACE = "pattern_jku"
+NOTE_ARRAYS = ["onsets", "durations", "pitches", "morphs"]
+OCC_ARRAYS = ["occ_sources", "occ_patterns", "occ_ids", "occ_offsets",
+              "occ_starts", "occ_ends"]
+TOLERANCE = 1e-3
+
+
+def read_patterns(jams_file):
+    """Reads the notes of the pattern annotations of a JAMS file.
+
+    Returns
+    -------
+    annotations : list
+        For each annotation, an array of (pattern_id, occurrence_id, onset,
+        duration, midi_pitch, morph_pitch) note rows, sorted.
+    """
+    jam = corpus_io.load_jam(jams_file)
+    annotations = []
+    for annotation in corpus_io.iter_annotations(jam, NAMESPACE):
+        data = annotation["data"]
+        rows = np.array([[value["pattern_id"], value["occurrence_id"], start,
+                          duration or 0.0, value["midi_pitch"],
+                          value.get("morph_pitch", np.nan)]
+                         for start, duration, value in
+                         zip(data["time"], data["duration"], data["value"])],
+                        dtype=np.float64).reshape(-1, 6)
+        order = np.lexsort((rows[:, 4], rows[:, 2], rows[:, 1], rows[:, 0]))
+        annotations.append(rows[order])
+    return annotations
+
+
+def build(out_dir, in_dirs, n_jobs=1):
+    """Builds a pattern index, unless it is up to date.
+
+    Parameters
+    ----------
+    out_dir : str
+        Folder where the index is stored.
+    in_dirs : list
+        Folders with the JAMS files to index.
+    n_jobs : int
+        Number of parallel jobs.
+    """
+    files = []
+    for in_dir in in_dirs:
+        corpus = os.path.basename(os.path.normpath(in_dir))
+        for jams_file in corpus_io.find_jams(in_dir):
+            files.append(dict(
+                track_id=corpus + "/" + corpus_io.get_track_id(jams_file,
+                                                               in_dir),
+                jams_file=jams_file, sha1=corpus_io.file_hash(jams_file)))
+    sources_file = os.path.join(out_dir, "sources.json")
+    if os.path.isfile(sources_file):
+        with open(sources_file, "r") as fp:
+            indexed = json.load(fp)["files"]
+        if indexed == files:
+            logging.info("The index is up to date.")
+            return
+
+    all_rows = Parallel(n_jobs=n_jobs)(
+        delayed(read_patterns)(f["jams_file"]) for f in files)
+    sources, rows, source_ids = [], [], []
+    for i, annotations in enumerate(all_rows):
+        for j, annotation_rows in enumerate(annotations):
+            source_ids.append(np.full(len(annotation_rows), len(sources),
+                                      dtype=np.int32))
+            sources.append([i, j])
+            rows.append(annotation_rows)
+    rows = np.concatenate(rows + [np.zeros((0, 6))])
+    source_ids = np.concatenate(source_ids + [np.zeros(0, dtype=np.int32)])
+
+    # Occurrences start where the (source, pattern, occurrence) key changes
+    keys = np.column_stack([source_ids, rows[:, 0], rows[:, 1]])
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+    starts = np.flatnonzero(first)
+    ends = rows[:, 2] + rows[:, 3]
+    arrays = dict(
+        onsets=rows[:, 2], durations=rows[:, 3],
+        pitches=rows[:, 4].astype(np.float32),
+        morphs=rows[:, 5].astype(np.float32),
+        occ_sources=source_ids[starts],
+        occ_patterns=rows[starts, 0].astype(np.int32),
+        occ_ids=rows[starts, 1].astype(np.int32),
+        occ_offsets=np.append(starts, len(rows)).astype(np.int64),
+        occ_starts=np.minimum.reduceat(rows[:, 2], starts)
+        if len(rows) else np.zeros(0),
+        occ_ends=np.maximum.reduceat(ends, starts)
+        if len(rows) else np.zeros(0))
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    for name in NOTE_ARRAYS + OCC_ARRAYS:
+        np.save(os.path.join(out_dir, name + ".npy"), arrays[name])
+    with open(sources_file, "w") as fp:
+        json.dump(dict(files=files, sources=sources), fp, indent=2)
+    logging.info("Indexed %d occurrences (%d notes) of %d annotations from "
+                 "%d files.", len(starts), len(rows), len(sources),
+                 len(files))
+
+
+class Occurrence(object):
+    """Occurrence of a pattern, whose notes are views of the index
+    arrays."""
+    __slots__ = ["track_id", "annotation", "pattern_id", "occurrence_id",
+                 "onsets", "pitches"]
+
+    def __init__(self, track_id, annotation, pattern_id, occurrence_id,
+                 onsets, pitches):
+        self.track_id = track_id
+        self.annotation = annotation
+        self.pattern_id = pattern_id
+        self.occurrence_id = occurrence_id
+        self.onsets = onsets
+        self.pitches = pitches
+
+    def __repr__(self):
+        return "%s\t%d\t%d\t%d\t%.3f-%.3f\t%d notes" % (
+            self.track_id, self.annotation, self.pattern_id,
+            self.occurrence_id, self.onsets.min(), self.onsets.max(),
+            len(self.onsets))
+
+
+class PatternIndex(object):
+    """Pattern index built by `build`.
+
+    Parameters
+    ----------
+    index_dir : str
+        Folder where the index is stored.
+    """
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "sources.json"), "r") as fp:
+            sources = json.load(fp)
+        self.files = sources["files"]
+        self.sources = sources["sources"]
+        self.arrays = dict(
+            (name, np.load(os.path.join(index_dir, name + ".npy"),
+                           mmap_mode="r"))
+            for name in NOTE_ARRAYS + OCC_ARRAYS)
+        self.n_notes = np.diff(self.arrays["occ_offsets"])
+
+    def __len__(self):
+        return len(self.arrays["occ_ids"])
+
+    def get_sources(self, track_id, annotation=None):
+        """Indices of the sources (annotations) of a track, by track ID
+        (`<corpus>/<track>`) or path to its JAMS file."""
+        return [i for i, (f, j) in enumerate(self.sources)
+                if track_id in (self.files[f]["track_id"],
+                                self.files[f]["jams_file"]) and
+                (annotation is None or annotation == j)]
+
+    def get(self, i):
+        """The i-th occurrence of the index."""
+        f, annotation = self.sources[self.arrays["occ_sources"][i]]
+        start, end = self.arrays["occ_offsets"][i:i + 2]
+        return Occurrence(self.files[f]["track_id"], annotation,
+                          int(self.arrays["occ_patterns"][i]),
+                          int(self.arrays["occ_ids"][i]),
+                          self.arrays["onsets"][start:end],
+                          self.arrays["pitches"][start:end])
+
+    def occurrences(self, track_id, pattern_id, annotation=None):
+        """All the occurrences of a pattern of a track."""
+        mask = np.isin(self.arrays["occ_sources"],
+                       self.get_sources(track_id, annotation)) & \
+            (self.arrays["occ_patterns"] == pattern_id)
+        return [self.get(i) for i in np.flatnonzero(mask)]
+
+    def at(self, track_id, time, annotation=None):
+        """Occurrences of a track sounding at a given time (in seconds)."""
+        mask = np.isin(self.arrays["occ_sources"],
+                       self.get_sources(track_id, annotation)) & \
+            (self.arrays["occ_starts"] <= time) & \
+            (self.arrays["occ_ends"] >= time)
+        return [self.get(i) for i in np.flatnonzero(mask)]
+
+    def match(self, onsets, pitches, rhythm=False, tolerance=TOLERANCE):
+        """Finds the occurrences with the same pitch intervals as a
+        sequence of notes (sorted by onset, then pitch), in any
+        transposition.
+
+        Parameters
+        ----------
+        onsets : np.ndarray
+            Onsets of the notes, in seconds.
+        pitches : np.ndarray
+            MIDI pitches of the notes.
+        rhythm : bool
+            Whether the onsets (relative to the first one) must match too.
+        tolerance : float
+            Tolerance of the comparisons, in semitones and seconds.
+
+        Returns
+        -------
+        occurrences : list
+            Matching occurrences.
+        """
+        n = len(pitches)
+        candidates = np.flatnonzero(self.n_notes == n)
+        if n == 0 or not len(candidates):
+            return []
+        # (n_candidates, n) matrices of the notes of the candidates
+        notes = self.arrays["occ_offsets"][candidates][:, None] + np.arange(n)
+        cand_pitches = np.asarray(self.arrays["pitches"])[notes]
+        cand_pitches = cand_pitches - cand_pitches[:, :1]
+        query = np.asarray(pitches, dtype=np.float32) - pitches[0]
+        mask = (np.abs(cand_pitches - query) <= tolerance).all(axis=1)
+        if rhythm:
+            cand_onsets = np.asarray(self.arrays["onsets"])[notes]
+            cand_onsets = cand_onsets - cand_onsets[:, :1]
+            query = np.asarray(onsets, dtype=np.float64) - onsets[0]
+            mask &= (np.abs(cand_onsets - query) <= tolerance).all(axis=1)
+        return [self.get(i) for i in candidates[mask]]
+
+
+def main():
+    """Main function to build or query a pattern index."""
+    parser = argparse.ArgumentParser(
+        description="Pattern occurrence index of pattern_jku annotations",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    build_parser = subparsers.add_parser("build", help="Build an index")
+    build_parser.add_argument("index_dir",
+                              action="store",
+                              help="Output index folder")
+    build_parser.add_argument("in_dirs",
+                              action="store",
+                              nargs="+",
+                              help="Folders with the JAMS files to index")
+    build_parser.add_argument("-j",
+                              action="store",
+                              dest="n_jobs",
+                              type=int,
+                              default=1,
+                              help="Number of CPUs to run in parallel.")
+    occ_parser = subparsers.add_parser(
+        "occurrences", help="List the occurrences of a pattern")
+    occ_parser.add_argument("index_dir",
+                            action="store",
+                            help="Index folder")
+    occ_parser.add_argument("track_id",
+                            action="store",
+                            help="Track (<corpus>/<track>)")
+    occ_parser.add_argument("pattern_id",
+                            action="store",
+                            type=int,
+                            help="Pattern ID")
+    at_parser = subparsers.add_parser(
+        "at", help="List the occurrences sounding at a time")
+    at_parser.add_argument("index_dir",
+                           action="store",
+                           help="Index folder")
+    at_parser.add_argument("track_id",
+                           action="store",
+                           help="Track (<corpus>/<track>)")
+    at_parser.add_argument("time",
+                           action="store",
+                           type=float,
+                           help="Time, in seconds")
+    match_parser = subparsers.add_parser(
+        "match", help="Find the transpositions of an occurrence")
+    match_parser.add_argument("index_dir",
+                              action="store",
+                              help="Index folder")
+    match_parser.add_argument("track_id",
+                              action="store",
+                              help="Track (<corpus>/<track>)")
+    match_parser.add_argument("pattern_id",
+                              action="store",
+                              type=int,
+                              help="Pattern ID")
+    match_parser.add_argument("occurrence_id",
+                              action="store",
+                              type=int,
+                              help="Occurrence ID")
+    match_parser.add_argument("--rhythm",
+                              action="store_true",
+                              help="Also match the relative onsets")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    if args.command == "build":
+        build(args.index_dir, args.in_dirs, args.n_jobs)
+    elif args.command is not None:
+        index = PatternIndex(args.index_dir)
+        if args.command == "occurrences":
+            occurrences = index.occurrences(args.track_id, args.pattern_id)
+        elif args.command == "at":
+            occurrences = index.at(args.track_id, args.time)
+        else:
+            occurrences = [
+                match for occurrence in
+                index.occurrences(args.track_id, args.pattern_id)
+                if occurrence.occurrence_id == args.occurrence_id
+                for match in index.match(occurrence.onsets,
+                                         occurrence.pitches, args.rhythm)]
+        for occurrence in occurrences:
+            print(occurrence)
+        logging.info("%d occurrences found.", len(occurrences))
+    else:
+        parser.print_help()
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
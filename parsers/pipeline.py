@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Pipelined read -> convert -> write executor for the parsers.
+
+Converting a track reads its source files (annotations, audio headers),
+builds and validates the JAMS object, and serializes it. Doing these steps
+in sequence leaves the disk idle while the CPU works and the other way
+around, which is slow on spinning disks and NFS mounts. This module overlaps
+them in three stages:
+
+    - readers: a pool of threads reading the source files of the tracks.
+    - converters: joblib workers building the JAMS objects (in the main
+      process if n_jobs is 1).
+    - writer: a thread serializing the documents and writing the files.
+
+Stages are connected by bounded queues (and joblib only dispatches a few
+tasks ahead), so a slow stage blocks the ones before it instead of piling
+up tracks in memory. The convert function runs in joblib workers, so it
+must be a module-level function and its inputs and outputs picklable.
+
+Usage example (from a parser):
+    >>> pipeline.run(tracks, read_track, build_JAMS, write_track,
+    ...              on_done=lambda track, out_file: run.add(...))
+"""
+
+import queue
+import threading
+
+from joblib import Parallel, delayed
+
+N_READERS = 4
+QUEUE_SIZE = 16
+
+# End of a stage's output
+_DONE = object()
+
+
+def _put(out_queue, obj, stop):
+    """Puts an object in a bounded queue, giving up if the pipeline
+    stops."""
+    while not stop.is_set():
+        try:
+            out_queue.put(obj, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _read(items, lock, read, out_queue, stop, errors):
+    """Reader thread: reads items until they are exhausted."""
+    while not stop.is_set():
+        with lock:
+            item = next(items, _DONE)
+        if item is _DONE:
+            break
+        try:
+            data = read(item)
+        except Exception as exc:
+            errors.append(exc)
+            stop.set()
+            break
+        if not _put(out_queue, (item, data), stop):
+            break
+    _put(out_queue, _DONE, stop)
+
+
+def _iter_read(read_queue, n_readers, stop):
+    """Iterates over the items read by the reader threads."""
+    n_done = 0
+    while n_done < n_readers and not stop.is_set():
+        try:
+            obj = read_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if obj is _DONE:
+            n_done += 1
+        else:
+            yield obj
+
+
+def _convert(convert, item, data):
+    """Converter task, keeping its item along."""
+    return item, convert(item, data)
+
+
+def _write(write_queue, write, on_done, stop, errors):
+    """Writer thread: writes the converted items until the end of the
+    queue."""
+    while True:
+        obj = write_queue.get()
+        if obj is _DONE:
+            break
+        if stop.is_set():
+            # Keep draining the queue so that the converters never block
+            continue
+        item, result = obj
+        try:
+            out = write(item, result)
+            if on_done is not None:
+                on_done(item, out)
+        except Exception as exc:
+            errors.append(exc)
+            stop.set()
+
+
+def run(items, read, convert, write, on_done=None, n_readers=N_READERS,
+        n_jobs=1, queue_size=QUEUE_SIZE):
+    """Runs the read, convert and write stages on all the items, overlapping
+    them.
+
+    Parameters
+    ----------
+    items : iterable
+        Items to process (e.g. tracks).
+    read : callable
+        read(item) returns the data read from the source files of an item.
+        Called from the reader threads.
+    convert : callable
+        convert(item, data) returns the converted item (e.g. the JSON
+        document of its JAMS). Called in the joblib workers.
+    write : callable
+        write(item, result) writes a converted item, and returns e.g. the
+        path of its output file. Called from the writer thread.
+    on_done : callable
+        on_done(item, out) is called with the output of write once an item
+        is written, from the writer thread (in the order items are
+        written).
+    n_readers : int
+        Number of reader threads.
+    n_jobs : int
+        Number of joblib workers converting items.
+    queue_size : int
+        Maximum number of items waiting between two stages.
+
+    Raises
+    ------
+    The first exception raised by a stage, once the pipeline is stopped.
+    """
+    stop = threading.Event()
+    errors = []
+    read_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+
+    items, lock = iter(items), threading.Lock()
+    readers = [threading.Thread(target=_read, args=(
+        items, lock, read, read_queue, stop, errors)) for _ in range(n_readers)]
+    writer = threading.Thread(target=_write, args=(
+        write_queue, write, on_done, stop, errors))
+    for thread in readers + [writer]:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        results = Parallel(n_jobs=n_jobs, return_as="generator_unordered",
+                           pre_dispatch="2*n_jobs")(
+            delayed(_convert)(convert, item, data)
+            for item, data in _iter_read(read_queue, n_readers, stop))
+        for result in results:
+            if not _put(write_queue, result, stop):
+                break
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        write_queue.put(_DONE)
+        writer.join()
+        stop.set()
+        for reader in readers:
+            reader.join()
+    if errors:
+        raise errors[0]
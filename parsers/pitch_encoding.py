@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""
+Compact storage of uniformly sampled `pitch_hz` annotations.
+
+Melody f0 tracks (MedleyDB, ADC2004, MIREX05) are sampled on a fixed hop
+grid, so storing an explicit time, duration and confidence for every frame
+is redundant. When the frame times of an annotation fit a grid
+`t0 + i * hop` (within a tolerance), the observations are replaced by a
+compact encoding stored in the annotation sandbox under `uniform_hop`:
+
+    {
+        "t0": 0.0,
+        "hop": 0.0058049886,
+        "n_frames": 6266,
+        "duration": 0.0,
+        "confidence": null,
+        "dtype": "<f4",
+        "runs": [[start_frame, n_frames, "<base64 packed values>"], ...]
+    }
+
+Frames not covered by any run are unvoiced (value 0.0), so silent regions
+are run-length encoded away. The annotation `data` is left empty.
+
+This script can also compact (or expand back) existing JAMS files.
+
+Usage example:
+    ./pitch_encoding.py ../datasets/MedleyDB/MusicDelta_Beatles.jams out.jams
+    ./pitch_encoding.py --expand out.jams MusicDelta_Beatles.jams
+"""
+
+import argparse
+import base64
+import logging
+import time
+
+import numpy as np
+
+import json_backend
+
+SANDBOX_KEY = "uniform_hop"
+
+# Maximum deviation (in seconds) between the actual frame times and the
+# fitted grid for an annotation to be considered uniformly sampled.
+DEFAULT_TOL = 1e-3
+
+
+def fit_grid(times, tol=DEFAULT_TOL):
+    """Fits a uniform grid to the given frame times.
+
+    Parameters
+    ----------
+    times : np.ndarray
+        Frame times in seconds.
+    tol : float
+        Maximum allowed deviation from the grid, in seconds.
+
+    Returns
+    -------
+    grid : tuple or None
+        `(t0, hop)` of the grid, or None if the times are not uniform.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) < 2:
+        return None
+    frames = np.arange(len(times), dtype=np.float64)
+    hop, t0 = np.polyfit(frames, times, 1)
+    if hop <= 0:
+        return None
+    if np.max(np.abs(t0 + hop * frames - times)) > tol:
+        return None
+    return float(t0), float(hop)
+
+
+def _is_null(value):
+    """Whether a value is None or NaN."""
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _uniform_value(values):
+    """Returns the single value shared by all items, or raises ValueError."""
+    values = [value.item() if isinstance(value, np.generic) else value
+              for value in values]
+    if not values:
+        return None
+    first = values[0]
+    for value in values:
+        if value != first and not (_is_null(value) and _is_null(first)):
+            raise ValueError("Values are not constant")
+    return None if _is_null(first) else first
+
+
+def encode_uniform_hop(times, values, durations=None, confidences=None,
+                       tol=DEFAULT_TOL, dtype="<f4"):
+    """Encodes an f0 track as a uniform-hop compact representation.
+
+    Parameters
+    ----------
+    times : np.ndarray
+        Frame times in seconds.
+    values : np.ndarray
+        Frequency values in Hz (0 for unvoiced frames).
+    durations : list
+        Frame durations (must be constant), or None.
+    confidences : list
+        Frame confidences (must be constant), or None.
+    tol : float
+        Maximum allowed deviation from the grid, in seconds.
+    dtype : str
+        Numpy dtype used to pack the values.
+
+    Returns
+    -------
+    encoding : dict or None
+        The compact encoding, or None if the track can not be encoded.
+    """
+    grid = fit_grid(times, tol=tol)
+    if grid is None:
+        return None
+    try:
+        duration = _uniform_value(durations) if durations is not None else 0.0
+        confidence = (_uniform_value(confidences)
+                      if confidences is not None else None)
+    except ValueError:
+        return None
+
+    values = np.asarray(values, dtype=np.float64)
+    voiced = np.concatenate(([False], values != 0, [False]))
+    edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+    runs = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        packed = values[start:end].astype(dtype).tobytes()
+        runs.append([int(start), int(end - start),
+                     base64.b64encode(packed).decode("ascii")])
+
+    return {
+        "t0": grid[0],
+        "hop": grid[1],
+        "n_frames": len(values),
+        "duration": duration,
+        "confidence": confidence,
+        "dtype": np.dtype(dtype).str,
+        "runs": runs
+    }
+
+
+def decode_uniform_hop(encoding):
+    """Decodes a uniform-hop encoding back into observation columns.
+
+    Parameters
+    ----------
+    encoding : dict
+        Encoding as produced by `encode_uniform_hop`.
+
+    Returns
+    -------
+    data : dict
+        Dictionary with `time`, `duration`, `value` and `confidence` lists.
+    """
+    n_frames = encoding["n_frames"]
+    values = np.zeros(n_frames, dtype=np.float64)
+    dtype = np.dtype(encoding["dtype"])
+    for start, count, packed in encoding["runs"]:
+        values[start:start + count] = np.frombuffer(
+            base64.b64decode(packed), dtype=dtype, count=count)
+    times = encoding["t0"] + encoding["hop"] * np.arange(n_frames)
+    return {
+        "time": times.tolist(),
+        "duration": [encoding["duration"]] * n_frames,
+        "value": values.tolist(),
+        "confidence": [encoding["confidence"]] * n_frames
+    }
+
+
+def compact_annotation(ann, tol=DEFAULT_TOL):
+    """Replaces the data of a `pitch_hz` jams.Annotation by its uniform-hop
+    encoding, if the annotation is uniformly sampled.
+
+    Parameters
+    ----------
+    ann : jams.Annotation
+        Annotation to compact in place.
+    tol : float
+        Maximum allowed deviation from the grid, in seconds.
+
+    Returns
+    -------
+    compacted : bool
+        Whether the annotation was compacted.
+    """
+    if ann.namespace != "pitch_hz" or len(ann.data) == 0:
+        return False
+    encoding = encode_uniform_hop(
+        ann.data["time"].dt.total_seconds().values,
+        ann.data["value"].values,
+        ann.data["duration"].dt.total_seconds().values,
+        ann.data["confidence"].values, tol=tol)
+    if encoding is None:
+        logging.warning("Annotation is not uniformly sampled, keeping the "
+                        "explicit observations.")
+        return False
+    ann.sandbox.update(**{SANDBOX_KEY: encoding})
+    ann.data.drop(ann.data.index, inplace=True)
+    return True
+
+
+def get_columns(data):
+    """Gets the observation columns of a raw (JSON) annotation `data`
+    field, which can be either a list of observations or a dictionary of
+    columns."""
+    if isinstance(data, dict):
+        return data
+    return {field: [obs[field] for obs in data]
+            for field in ["time", "duration", "value", "confidence"]}
+
+
+def compact_raw_annotation(annotation, tol=DEFAULT_TOL):
+    """Compacts a raw (JSON) `pitch_hz` annotation dictionary in place.
+
+    Returns whether the annotation was compacted."""
+    if annotation.get("namespace") != "pitch_hz" or not annotation["data"]:
+        return False
+    columns = get_columns(annotation["data"])
+    encoding = encode_uniform_hop(columns["time"], columns["value"],
+                                  columns["duration"], columns["confidence"],
+                                  tol=tol)
+    if encoding is None:
+        return False
+    annotation.setdefault("sandbox", {})[SANDBOX_KEY] = encoding
+    annotation["data"] = []
+    return True
+
+
+def expand_raw_annotation(annotation):
+    """Expands a compacted raw (JSON) annotation dictionary in place.
+
+    Returns whether the annotation was expanded."""
+    encoding = annotation.get("sandbox", {}).pop(SANDBOX_KEY, None)
+    if encoding is None:
+        return False
+    columns = decode_uniform_hop(encoding)
+    annotation["data"] = [dict(zip(columns, obs))
+                          for obs in zip(*columns.values())]
+    return True
+
+
+def process(in_file, out_file, expand=False, tol=DEFAULT_TOL):
+    """Compacts (or expands) the `pitch_hz` annotations of a JAMS file."""
+    jam = json_backend.load(in_file)
+
+    n_changed = 0
+    for annotation in jam["annotations"]:
+        if expand:
+            n_changed += expand_raw_annotation(annotation)
+        else:
+            n_changed += compact_raw_annotation(annotation, tol=tol)
+    logging.info("%d annotations %s in %s", n_changed,
+                 "expanded" if expand else "compacted", in_file)
+
+    json_backend.save_json(jam, out_file)
+
+
+def main():
+    """Main function to compact or expand pitch_hz annotations."""
+    parser = argparse.ArgumentParser(
+        description="Stores pitch_hz annotations with a uniform-hop compact "
+                    "encoding",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("in_file",
+                        action="store",
+                        help="Input JAMS file")
+    parser.add_argument("out_file",
+                        action="store",
+                        help="Output JAMS file")
+    parser.add_argument("--expand",
+                        action="store_true",
+                        help="Expand compacted annotations back into "
+                             "explicit observations")
+    parser.add_argument("--tol",
+                        action="store",
+                        type=float,
+                        default=DEFAULT_TOL,
+                        help="Maximum deviation from the hop grid, in "
+                             "seconds")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Run the conversion
+    process(args.in_file, args.out_file, args.expand, args.tol)
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
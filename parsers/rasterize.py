@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+"""
+Rasterizes the annotations of a given namespace into frame-level label
+matrices, and caches them as `.npy` files that can be memory-mapped.
+
+Frame `i` covers the time `i / frame_rate`. An observation is active in all
+the frames whose time falls in `[time, time + duration)`; instantaneous
+observations (beats, onsets) activate the frame closest to their time.
+Values are mapped to the columns of the matrix through a vocabulary, which
+is built from all the input files unless one is given. For `beat` and
+`onset` the values are ignored and a single column is used.
+
+Matrices are cached in `cache_dir`, keyed by the hash of the JAMS file, the
+namespace, the frame rate, the vocabulary and the output format, so
+rasterizing a corpus is a one-time cost. Dense matrices have one column per
+vocabulary entry; for large vocabularies (e.g. chords at 10 ms) the sparse
+(frame, label) coordinate format is much smaller.
+
+Usage example:
+    ./rasterize.py ../datasets/Billboard-Chords chord raster_cache/ -r 100 -j 4
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+
+from joblib import Parallel, delayed
+import numpy as np
+
+import corpus_io
+
+# Namespaces whose values are not used as labels
+VALUELESS_NAMESPACES = ["beat", "onset"]
+
+
+def value_key(value):
+    """Hashable key of an observation value (dictionaries and lists are
+    serialized)."""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def get_labels(annotation):
+    """Gets the label keys of the observations of an annotation."""
+    if annotation["namespace"] in VALUELESS_NAMESPACES:
+        return [annotation["namespace"]] * len(annotation["data"]["value"])
+    return [value_key(value) for value in annotation["data"]["value"]]
+
+
+def get_file_labels(jams_file, namespace):
+    """Gets the set of labels of a namespace in a JAMS file."""
+    jam = corpus_io.load_jam(jams_file)
+    labels = set()
+    for annotation in corpus_io.iter_annotations(jam, namespace):
+        labels.update(get_labels(annotation))
+    return labels
+
+
+def build_vocabulary(jams_files, namespace, n_jobs=1):
+    """Builds the sorted vocabulary of the labels of a namespace.
+
+    Parameters
+    ----------
+    jams_files : list
+        Paths to the JAMS files.
+    namespace : str
+        Namespace of the annotations.
+    n_jobs : int
+        Number of parallel jobs.
+
+    Returns
+    -------
+    vocabulary : list
+        Sorted list of labels.
+    """
+    labels = set()
+    for file_set in Parallel(n_jobs=n_jobs)(
+            delayed(get_file_labels)(jams_file, namespace)
+            for jams_file in jams_files):
+        labels.update(file_set)
+    return sorted(labels, key=lambda x: (str(type(x)), x))
+
+
+def get_frames(times, durations, frame_rate):
+    """Computes the [start, end) frame ranges of a set of observations.
+
+    Parameters
+    ----------
+    times : np.ndarray
+        Start times of the observations, in seconds.
+    durations : np.ndarray
+        Durations of the observations, in seconds.
+    frame_rate : float
+        Frames per second.
+
+    Returns
+    -------
+    starts : np.ndarray
+        First frame of each observation.
+    ends : np.ndarray
+        Frame after the last one of each observation.
+    """
+    starts = np.ceil(times * frame_rate - 1e-9).astype(np.int64)
+    ends = np.ceil((times + durations) * frame_rate - 1e-9).astype(np.int64)
+    events = durations <= 0
+    starts[events] = np.round(times[events] * frame_rate).astype(np.int64)
+    ends[events] = starts[events] + 1
+    return starts, ends
+
+
+def rasterize(annotation, vocabulary, frame_rate, n_frames, sparse=False):
+    """Rasterizes an annotation into a frame-level label matrix.
+
+    Parameters
+    ----------
+    annotation : dict
+        Annotation as returned by `corpus_io.iter_annotations`.
+    vocabulary : list
+        Labels corresponding to the columns of the matrix. Observations
+        whose label is not in the vocabulary are ignored.
+    frame_rate : float
+        Frames per second.
+    n_frames : int
+        Number of frames of the matrix.
+    sparse : bool
+        Whether to return the matrix in sparse format.
+
+    Returns
+    -------
+    matrix : np.ndarray
+        If sparse is False, a uint8 `(n_frames, len(vocabulary))` matrix.
+        Otherwise, an int32 `(nnz, 2)` array of the (frame, label)
+        coordinates of the active cells.
+    """
+    index = dict((label, i) for i, label in enumerate(vocabulary))
+    codes = np.array([index.get(label, -1) for label in get_labels(annotation)],
+                     dtype=np.int64)
+    times = np.asarray(annotation["data"]["time"], dtype=np.float64)
+    durations = np.nan_to_num(np.asarray(annotation["data"]["duration"],
+                                         dtype=np.float64))
+    starts, ends = get_frames(times, durations, frame_rate)
+    starts = np.clip(starts, 0, n_frames)
+    ends = np.clip(ends, 0, n_frames)
+    keep = (codes >= 0) & (ends > starts)
+    starts, ends, codes = starts[keep], ends[keep], codes[keep]
+
+    # Expand every [start, end) range into its frame indices at once
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    frames = np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)
+    labels = np.repeat(codes, lengths)
+
+    if sparse:
+        coords = np.unique(np.stack([frames, labels], axis=1), axis=0)
+        return coords.reshape(-1, 2).astype(np.int32)
+    matrix = np.zeros((n_frames, len(vocabulary)), dtype=np.uint8)
+    matrix[frames, labels] = 1
+    return matrix
+
+
+def to_scipy(coords, n_frames, n_labels):
+    """Converts the sparse coordinates returned by `rasterize` into a
+    `scipy.sparse.csr_matrix`."""
+    import scipy.sparse
+    return scipy.sparse.csr_matrix(
+        (np.ones(len(coords), dtype=np.uint8), (coords[:, 0], coords[:, 1])),
+        shape=(n_frames, n_labels))
+
+
+def get_cache_file(cache_dir, jams_hash, namespace, frame_rate, vocabulary,
+                   index, sparse, ext=".npy"):
+    """Path to the cached matrix of the index-th annotation of a namespace
+    in a JAMS file."""
+    vocab_hash = hashlib.sha1(
+        json.dumps(vocabulary).encode("utf-8")).hexdigest()
+    key = "|".join([jams_hash, namespace, repr(float(frame_rate)), vocab_hash,
+                    str(index), "sparse" if sparse else "dense"])
+    return os.path.join(cache_dir, namespace,
+                        hashlib.sha1(key.encode("utf-8")).hexdigest() + ext)
+
+
+def rasterize_file(jams_file, namespace, vocabulary, frame_rate, cache_dir,
+                   sparse=False, mmap_mode="r"):
+    """Rasterizes all the annotations of a namespace in a JAMS file, using
+    the cached matrices when available.
+
+    Parameters
+    ----------
+    jams_file : str
+        Path to the JAMS file.
+    namespace : str
+        Namespace of the annotations to rasterize.
+    vocabulary : list
+        Labels corresponding to the columns of the matrices.
+    frame_rate : float
+        Frames per second.
+    cache_dir : str
+        Folder where the matrices are cached.
+    sparse : bool
+        Whether to store the matrices in sparse format.
+    mmap_mode : str
+        Memory-map mode used to load the cached matrices (None to load
+        them in memory).
+
+    Returns
+    -------
+    matrices : list
+        One matrix per annotation of the namespace (see `rasterize`).
+    """
+    jams_hash = corpus_io.file_hash(jams_file)
+    count_file = get_cache_file(cache_dir, jams_hash, namespace, frame_rate,
+                                vocabulary, "count", sparse, ext=".json")
+
+    # The number of annotations is written last, once all the matrices of
+    # the file are in the cache
+    if os.path.isfile(count_file):
+        with open(count_file, "r") as fp:
+            n_annotations = json.load(fp)
+        cache_files = [get_cache_file(cache_dir, jams_hash, namespace,
+                                      frame_rate, vocabulary, index, sparse)
+                       for index in range(n_annotations)]
+        if all(os.path.isfile(cache_file) for cache_file in cache_files):
+            return [np.load(cache_file, mmap_mode=mmap_mode)
+                    for cache_file in cache_files]
+
+    jam = corpus_io.load_jam(jams_file)
+    n_frames = int(np.ceil(corpus_io.get_duration(jam) * frame_rate))
+    if not os.path.isdir(os.path.dirname(count_file)):
+        os.makedirs(os.path.dirname(count_file))
+
+    matrices = []
+    annotations = corpus_io.iter_annotations(jam, namespace)
+    for index, annotation in enumerate(annotations):
+        cache_file = get_cache_file(cache_dir, jams_hash, namespace,
+                                    frame_rate, vocabulary, index, sparse)
+        np.save(cache_file, rasterize(annotation, vocabulary, frame_rate,
+                                      n_frames, sparse=sparse))
+        matrices.append(np.load(cache_file, mmap_mode=mmap_mode))
+
+    with open(count_file, "w") as fp:
+        json.dump(len(matrices), fp)
+    return matrices
+
+
+def process(in_dir, namespace, cache_dir, frame_rate, vocabulary_file=None,
+            sparse=False, n_jobs=1):
+    """Rasterizes all the annotations of a namespace in a corpus.
+
+    Returns
+    -------
+    n_matrices : dict
+        Number of rasterized annotations, keyed by JAMS file.
+    """
+    jams_files = corpus_io.find_jams(in_dir)
+
+    if vocabulary_file is not None and os.path.isfile(vocabulary_file):
+        with open(vocabulary_file, "r") as fp:
+            vocabulary = json.load(fp)
+    else:
+        logging.info("Building %s vocabulary...", namespace)
+        vocabulary = build_vocabulary(jams_files, namespace, n_jobs)
+        if vocabulary_file is not None:
+            with open(vocabulary_file, "w") as fp:
+                json.dump(vocabulary, fp, indent=2)
+    logging.info("Vocabulary size: %d", len(vocabulary))
+
+    matrices = Parallel(n_jobs=n_jobs)(delayed(rasterize_file)(
+        jams_file, namespace, vocabulary, frame_rate, cache_dir, sparse)
+        for jams_file in jams_files)
+    return dict((jams_file, len(file_matrices))
+                for jams_file, file_matrices in zip(jams_files, matrices))
+
+
+def main():
+    """Main function to rasterize a corpus."""
+    parser = argparse.ArgumentParser(
+        description="Rasterizes the annotations of a namespace into cached "
+                    "frame-level label matrices",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("in_dir",
+                        action="store",
+                        help="Folder with the JAMS files")
+    parser.add_argument("namespace",
+                        action="store",
+                        help="Namespace of the annotations to rasterize")
+    parser.add_argument("cache_dir",
+                        action="store",
+                        help="Folder where the matrices are cached")
+    parser.add_argument("-r",
+                        action="store",
+                        dest="frame_rate",
+                        type=float,
+                        default=100.0,
+                        help="Frame rate (frames per second)")
+    parser.add_argument("-v",
+                        action="store",
+                        dest="vocabulary_file",
+                        default=None,
+                        help="JSON vocabulary file (built and saved here if "
+                             "it does not exist)")
+    parser.add_argument("--sparse",
+                        action="store_true",
+                        help="Store the matrices in sparse (frame, label) "
+                             "coordinate format")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Run the rasterization
+    n_matrices = process(args.in_dir, args.namespace, args.cache_dir,
+                         args.frame_rate, args.vocabulary_file, args.sparse,
+                         args.n_jobs)
+    logging.info("Rasterized %d annotations from %d files.",
+                 sum(n_matrices.values()), len(n_matrices))
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
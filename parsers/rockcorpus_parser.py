@@ -104,9 +104,11 @@ __version__ = "1.0"
 __email__ = "jpf211@nyu.edu"
 
 import argparse
-import json
+import journal
+import json_backend
 import logging
 import os
+import sharding
 import sys
 import tempfile
 import time
@@ -323,7 +325,8 @@ def parse_timing_file(timing_file, jam):
 
 
 def create_JAMS(in_dir, out_dir, filebase, artist, album, timing_added=True):
-    """Add all annotations for given song to a JAMS object and write it out."""
+    """Add all annotations for given song to a JAMS object and write it out,
+    returning the path of the JAMS file."""
 
     jam = pyjams.JAMS()
 
@@ -358,18 +361,24 @@ def create_JAMS(in_dir, out_dir, filebase, artist, album, timing_added=True):
 
     # Save JAMS
     out_file = os.path.join(out_dir, '%s.jams' % filebase)
-    with open(out_file, "w") as fp:
-        json.dump(jam, fp, indent=2)
+    json_backend.save_json(jam, out_file)
+    return out_file
 
 
-def process(in_dir, out_dir):
-    """Parse the whole dataset."""
+def process(in_dir, out_dir, shard=None, resume=False):
+    """Parse the whole dataset (only the songs of the given (i, N) shard, if
+    any, and not done by the interrupted run if resume is set)."""
     pyjams.util.smkdirs(out_dir)
     song_map = get_audio_sources_info(os.path.join(in_dir, AUDIO_SOURCES_FILE))
-    for songname, info in song_map.items():
-        logging.info('processing %s', songname)
-        create_JAMS(in_dir=in_dir, out_dir=out_dir, filebase=songname,
-                    artist=info['artist'], album=info['album'])
+    songs, songnames = sharding.select(sorted(song_map.items()), shard,
+                                       key=lambda song: song[0])
+    with journal.Journal(out_dir, shard, resume) as run:
+        for songname, info in run.todo(songs, key=lambda song: song[0]):
+            logging.info('processing %s', songname)
+            run.add(songname, create_JAMS(
+                in_dir=in_dir, out_dir=out_dir, filebase=songname,
+                artist=info['artist'], album=info['album']))
+    sharding.write_manifest(out_dir, shard, songnames, run.done)
 
 
 def main():
@@ -386,6 +395,16 @@ def main():
                         # TODO(ejhumphrey): This should be a config, no?
                         default="outJAMS",
                         help="Output JAMS folder")
+    parser.add_argument("--shard",
+                        action="store",
+                        type=sharding.parse_shard,
+                        default=None,
+                        help="Only convert the i-th of N shards of the "
+                        "tracks, given as i/N")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Resume an interrupted run, skipping the tracks "
+                        "in its journal")
     args = parser.parse_args()
     start_time = time.time()
 
@@ -394,7 +413,7 @@ def main():
                         level=logging.INFO)
 
     # Run the parser
-    process(args.in_dir, args.out_dir)
+    process(args.in_dir, args.out_dir, args.shard, args.resume)
     # Done!
     logging.info("Done! Took %.2f seconds.", time.time() - start_time)
 
@@ -4,6 +4,10 @@ This script parses the SALAMI v2.0 dataset into the JAMS format.
 
 Usage example:
     ./salami_parser.py salami-data-public/ OutputSalamiJAMS
+
+With --watch, it then keeps watching the SALAMI folder, and reconverts the
+tracks whose annotation files (or metadata rows) change:
+    ./salami_parser.py salami-data-public/ OutputSalamiJAMS --watch
 """
 
 import argparse
@@ -18,6 +22,11 @@ import time
 
 import jams
 
+import journal
+import json_backend
+import sharding
+import watch
+
 __author__ = "Oriol Nieto"
 __copyright__ = "Copyright 2016, Music and Audio Research Lab (MARL)"
 __license__ = "MIT"
@@ -216,13 +225,19 @@ def create_JAMS(in_dir, metadata, out_file):
         Metadata read from the CSV file
     out_file : str
         Output JAMS file
+
+    Returns
+    -------
+    written : bool
+        Whether the JAMS file was written (False if the track has no
+        annotations folder).
     """
     path = os.path.join(in_dir, "annotations", metadata[0], )
 
     # Sanity check
     if not os.path.exists(path):
         logging.warning("Path not found %s", path)
-        return
+        return False
 
     # New JAMS and annotation
     jam = jams.JAMS()
@@ -241,23 +256,27 @@ def create_JAMS(in_dir, metadata, out_file):
     fill_global_metadata(jam, metadata, dur)
 
     # Save JAMS
-    jam.save(out_file)
+    json_backend.save_jam(jam, out_file)
+    return True
 
 
 def process_one(metadata, in_dir, out_dir):
-    """Processes one track given its metadata."""
+    """Processes one track given its metadata, and returns the path of its
+    JAMS file (None if it was not written)."""
     if metadata[0] == "SONG_ID":
         return
 
     # Create a JAMS file for this track
     logging.info("Parsing file %s..." % metadata[0])
-    create_JAMS(in_dir, metadata,
-                os.path.join(out_dir, os.path.basename(metadata[0]) + ".jams"))
+    out_file = os.path.join(out_dir, os.path.basename(metadata[0]) + ".jams")
+    if create_JAMS(in_dir, metadata, out_file):
+        return out_file
 
 
-def process(in_dir, out_dir, n_jobs):
+def process(in_dir, out_dir, n_jobs, shard=None, resume=False):
     """Converts the original SALAMI files into the JAMS format, and saves
-    them in the out_dir folder."""
+    them in the out_dir folder (only the tracks of the given (i, N) shard,
+    if any, and not done by the interrupted run if resume is set)."""
 
     # Check if output folder and create it if needed:
     if not os.path.exists(out_dir):
@@ -265,9 +284,62 @@ def process(in_dir, out_dir, n_jobs):
 
     # Open CSV with metadata and parse
     with open(os.path.join(in_dir, "metadata", "metadata.csv")) as fh:
-        csv_reader = csv.reader(fh)
-        Parallel(n_jobs=n_jobs)(delayed(process_one)(
-            metadata, in_dir, out_dir) for metadata in list(csv_reader)[:])
+        rows = [row for row in csv.reader(fh) if row and row[0] != "SONG_ID"]
+    rows, song_ids = sharding.select(rows, shard, key=lambda row: row[0])
+    with journal.Journal(out_dir, shard, resume) as run:
+        rows = run.todo(rows, key=lambda row: row[0])
+        out_files = Parallel(n_jobs=n_jobs, return_as="generator")(
+            delayed(process_one)(metadata, in_dir, out_dir)
+            for metadata in rows)
+        for metadata, out_file in zip(rows, out_files):
+            if out_file is not None:
+                run.add(metadata[0], out_file)
+    sharding.write_manifest(out_dir, shard, song_ids, run.done)
+
+
+def read_metadata(in_dir):
+    """Reads the rows of the SALAMI metadata CSV, keyed by SONG_ID."""
+    with open(os.path.join(in_dir, "metadata", "metadata.csv")) as fh:
+        return dict((row[0], row) for row in csv.reader(fh)
+                    if row and row[0] != "SONG_ID")
+
+
+def get_changed_tracks(in_dir, paths):
+    """Gets the SONG_IDs of the tracks whose annotation files are in
+    paths."""
+    song_ids = set()
+    for path in paths:
+        parts = os.path.relpath(path, in_dir).split(os.sep)
+        if len(parts) > 2 and parts[0] == "annotations":
+            song_ids.add(parts[1])
+    return song_ids
+
+
+def watch_changes(in_dir, out_dir):
+    """Watches the SALAMI folder and reconverts the tracks whose annotation
+    files or metadata change, until interrupted."""
+    metadata_file = os.path.join(in_dir, "metadata", "metadata.csv")
+    metadata = read_metadata(in_dir)
+
+    def on_change(paths):
+        song_ids = get_changed_tracks(in_dir, paths)
+        if metadata_file in paths:
+            new_metadata = read_metadata(in_dir)
+            song_ids.update(song_id for song_id, row in new_metadata.items()
+                            if metadata.get(song_id) != row)
+            metadata.clear()
+            metadata.update(new_metadata)
+        for song_id in sorted(song_ids):
+            if song_id not in metadata:
+                continue
+            # Files being edited may be empty or invalid for a while, so an
+            # error only skips the track until its next change
+            try:
+                process_one(metadata[song_id], in_dir, out_dir)
+            except Exception:
+                logging.exception("Could not convert track %s", song_id)
+
+    watch.watch(in_dir, on_change)
 
 
 if __name__ == '__main__':
@@ -286,6 +358,20 @@ if __name__ == '__main__':
                         type=int,
                         default=2,
                         help="Number of CPUs to run in parallel.")
+    parser.add_argument("--watch",
+                        action="store_true",
+                        help="Keep watching the SALAMI folder and reconvert "
+                        "the tracks whose files change")
+    parser.add_argument("--shard",
+                        action="store",
+                        type=sharding.parse_shard,
+                        default=None,
+                        help="Only convert the i-th of N shards of the "
+                        "tracks, given as i/N")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Resume an interrupted run, skipping the tracks "
+                        "in its journal")
     args = parser.parse_args()
     start_time = time.time()
 
@@ -293,7 +379,9 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
 
     # Run the parser
-    process(args.in_dir, args.out_dir, args.n_jobs)
+    process(args.in_dir, args.out_dir, args.n_jobs, args.shard, args.resume)
+    if args.watch:
+        watch_changes(args.in_dir, args.out_dir)
 
     # Done!
     logging.info("Done! Took %.2f seconds." % (time.time() - start_time))
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""
+Exports JAMS corpora to WebDataset-style tar shards, for training jobs that
+stream their data sequentially.
+
+Tracks are sorted by corpus and track ID and split into shards of a fixed
+number of records, so a given export always produces the same shards with
+the same records in the same order. Each record is a group of tar members
+sharing a key (`<corpus>/<track ID>`, with dots replaced by underscores):
+
+    - `<key>.json`: the corpus and track ID.
+    - `<key>.jams`: the JAMS document. With `--compact`, it is written
+      without indentation and its `pitch_hz` annotations use the uniform-hop
+      encoding of `pitch_encoding.py`.
+    - `<key>.<namespace>.npz`: for each requested namespace, the `time`,
+      `duration`, `confidence` and `value` arrays of all its annotations
+      concatenated, and `offsets` delimiting each annotation. Numeric values
+      are stored as float64 (NaN for nulls), other values as JSON strings,
+      or as int32 codes if a vocabulary store (see `vocabulary.py`) has the
+      namespace. The vocabularies used are copied to the output folder.
+
+Shards are written in parallel, and `manifest.json` lists every shard with
+its number of records, size in bytes, and first and last keys.
+
+Usage example:
+    ./shard_export.py shards/ ../datasets/SALAMI ../datasets/Harmonix \
+-n segment_open beat -s 256 --compact -j 4
+    ./shard_export.py shards/ ../datasets/Billboard-Chords -n chord \
+-v vocabularies.json
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import tarfile
+import time
+
+from joblib import Parallel, delayed
+import numpy as np
+
+import corpus_io
+import json_backend
+import pitch_encoding
+import vocabulary
+
+SHARD_NAME = "shard-%06d.tar"
+MANIFEST = "manifest.json"
+VOCABULARIES = "vocabularies.json"
+
+
+def get_key(corpus, track_id):
+    """Key of the record of a track. WebDataset splits member names at the
+    first dot of their basename, so dots are replaced by underscores."""
+    return "%s/%s" % (corpus, track_id.replace(".", "_"))
+
+
+def get_value_array(values):
+    """Converts observation values to a float64 array if they are all
+    numeric (or null), and to an array of JSON strings otherwise."""
+    if all(value is None or (isinstance(value, (int, float)) and
+                             not isinstance(value, bool))
+           for value in values):
+        return np.array([np.nan if value is None else value
+                         for value in values], dtype=np.float64)
+    return np.array([json.dumps(value) for value in values], dtype=np.str_)
+
+
+def get_arrays(jam, namespace, vocab=None):
+    """Gets the observation arrays of all the annotations of a namespace,
+    encoding the values with the given `vocabulary.Vocabulary` if any.
+
+    Returns
+    -------
+    arrays : dict
+        `time`, `duration`, `confidence`, `value` and `offsets` arrays.
+    """
+    columns = dict((field, []) for field in corpus_io.FIELDS)
+    offsets = [0]
+    for annotation in corpus_io.iter_annotations(jam, namespace):
+        for field in corpus_io.FIELDS:
+            columns[field] += list(annotation["data"][field])
+        offsets.append(len(columns["time"]))
+    arrays = dict(offsets=np.array(offsets, dtype=np.int64))
+    for field in ["time", "duration", "confidence"]:
+        arrays[field] = np.array([np.nan if x is None else x
+                                  for x in columns[field]], dtype=np.float64)
+    if vocab is None:
+        arrays["value"] = get_value_array(columns["value"])
+    else:
+        arrays["value"] = vocab.encode(columns["value"])
+    return arrays
+
+
+def get_record(jams_file, corpus, track_id, namespaces, compact=False,
+               vocabularies=None):
+    """Builds the members of the record of a track.
+
+    Returns
+    -------
+    members : list
+        (name, bytes) tuples, in the order they are written.
+    """
+    key = get_key(corpus, track_id)
+    with corpus_io.open_jams(jams_file) as fp:
+        data = fp.read()
+    jam = json_backend.loads(data)
+    if compact:
+        for annotation in jam.get("annotations", []):
+            pitch_encoding.compact_raw_annotation(annotation)
+        data = json_backend.dumps(jam)
+    info = dict(corpus=corpus, track_id=track_id)
+    members = [(key + ".json", json.dumps(info, sort_keys=True).encode(
+        "utf-8")), (key + ".jams", data)]
+    for namespace in namespaces:
+        buf = io.BytesIO()
+        vocab = None if vocabularies is None else vocabularies.get(namespace)
+        np.savez(buf, **get_arrays(jam, namespace, vocab))
+        members.append(("%s.%s.npz" % (key, namespace), buf.getvalue()))
+    return members
+
+
+def write_shard(shard_file, tracks, namespaces, compact=False,
+                vocabularies=None):
+    """Writes a tar shard with the records of the given tracks.
+
+    Members get fixed ownership and modification times, so that the shard
+    only depends on its records.
+
+    Parameters
+    ----------
+    shard_file : str
+        Path to the output shard.
+    tracks : list
+        (jams_file, corpus, track_id) tuples, in record order.
+    namespaces : list
+        Namespaces whose arrays are exported.
+    compact : bool
+        Whether to compact the JAMS documents.
+    vocabularies : vocabulary.VocabularyStore
+        Vocabularies used to encode the values.
+
+    Returns
+    -------
+    n_bytes : int
+        Size of the shard.
+    """
+    with tarfile.open(shard_file, "w", format=tarfile.PAX_FORMAT) as tar:
+        for jams_file, corpus, track_id in tracks:
+            for name, data in get_record(jams_file, corpus, track_id,
+                                         namespaces, compact, vocabularies):
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                member.mode = 0o644
+                tar.addfile(member, io.BytesIO(data))
+    return os.path.getsize(shard_file)
+
+
+def export(out_dir, in_dirs, namespaces=(), shard_size=1000, compact=False,
+           vocabulary_file=None, n_jobs=1):
+    """Exports corpora to tar shards.
+
+    Parameters
+    ----------
+    out_dir : str
+        Folder where the shards and the manifest are written.
+    in_dirs : list
+        Corpus folders to export. The corpus name is the folder name.
+    namespaces : list
+        Namespaces whose arrays are exported.
+    shard_size : int
+        Number of records per shard (the last one may have fewer).
+    compact : bool
+        Whether to compact the JAMS documents.
+    vocabulary_file : str
+        Vocabulary store used to encode the values of its namespaces.
+    n_jobs : int
+        Number of shards written in parallel.
+
+    Returns
+    -------
+    manifest : dict
+        The shard manifest.
+    """
+    tracks = []
+    for in_dir in in_dirs:
+        corpus = os.path.basename(os.path.normpath(in_dir))
+        for jams_file in corpus_io.find_jams(in_dir):
+            tracks.append((jams_file, corpus,
+                           corpus_io.get_track_id(jams_file, in_dir)))
+    tracks.sort(key=lambda track: (track[1], track[2]))
+    shards = [tracks[i:i + shard_size]
+              for i in range(0, len(tracks), shard_size)]
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    vocabularies = None
+    encoded = []
+    if vocabulary_file is not None:
+        store = vocabulary.VocabularyStore(vocabulary_file)
+        encoded = [namespace for namespace in namespaces
+                   if namespace in store]
+        vocabularies = vocabulary.VocabularyStore(
+            os.path.join(out_dir, VOCABULARIES))
+        vocabularies.vocabularies = dict((namespace, store[namespace])
+                                         for namespace in encoded)
+        vocabularies.save()
+    sizes = Parallel(n_jobs=n_jobs)(
+        delayed(write_shard)(os.path.join(out_dir, SHARD_NAME % i), shard,
+                             namespaces, compact, vocabularies)
+        for i, shard in enumerate(shards))
+
+    manifest = dict(
+        n_records=len(tracks),
+        n_bytes=sum(sizes),
+        namespaces=list(namespaces),
+        compact=compact,
+        encoded_namespaces=encoded,
+        shards=[dict(name=SHARD_NAME % i,
+                     n_records=len(shard),
+                     n_bytes=n_bytes,
+                     first_key=get_key(*shard[0][1:]),
+                     last_key=get_key(*shard[-1][1:]))
+                for i, (shard, n_bytes) in enumerate(zip(shards, sizes))])
+    with open(os.path.join(out_dir, MANIFEST), "w") as fp:
+        json.dump(manifest, fp, indent=2)
+    return manifest
+
+
+def main():
+    """Main function to export corpora to tar shards."""
+    parser = argparse.ArgumentParser(
+        description="Exports JAMS corpora to WebDataset-style tar shards",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("out_dir",
+                        action="store",
+                        help="Output folder for the shards")
+    parser.add_argument("in_dirs",
+                        action="store",
+                        nargs="+",
+                        help="Corpus folders to export")
+    parser.add_argument("-n",
+                        action="store",
+                        dest="namespaces",
+                        nargs="+",
+                        default=[],
+                        help="Namespaces whose arrays are exported")
+    parser.add_argument("-s",
+                        action="store",
+                        dest="shard_size",
+                        type=int,
+                        default=1000,
+                        help="Number of records per shard")
+    parser.add_argument("--compact",
+                        action="store_true",
+                        help="Compact the JAMS documents")
+    parser.add_argument("-v",
+                        action="store",
+                        dest="vocabulary_file",
+                        default=None,
+                        help="Vocabulary store used to encode the values")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Export the shards
+    manifest = export(args.out_dir, args.in_dirs, args.namespaces,
+                      args.shard_size, args.compact, args.vocabulary_file,
+                      args.n_jobs)
+    logging.info("Exported %d records (%d bytes) into %d shards.",
+                 manifest["n_records"], manifest["n_bytes"],
+                 len(manifest["shards"]))
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Deterministic sharding of the parser runs, to split a conversion across
+several nodes that share a file system.
+
+With `--shard i/N`, a parser only converts the tracks whose stable hash
+(the SHA-1 of the track ID, e.g. the SALAMI SONG_ID or the MedleyDB track
+ID) modulo N is i, so N runs with i from 0 to N - 1 convert every track
+exactly once, without any coordination. Once done, each run writes the
+manifest of its shard in the `.shards` folder of the output folder, with
+the tracks of the shard, the output files of the tracks it actually
+converted (see `journal.py`), and a hash of the full track list it saw.
+
+Run as a script, it merges the manifests of an output folder and verifies
+that all the shards are done, that they saw the same track list, that
+every track of each shard was converted and its output files exist, and
+that together they cover the track list exactly once:
+
+    ./salami_parser.py salami-data-public/ OutputSalamiJAMS --shard 0/4
+    ...
+    ./salami_parser.py salami-data-public/ OutputSalamiJAMS --shard 3/4
+    ./sharding.py OutputSalamiJAMS
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+SHARDS_FOLDER = ".shards"
+MANIFEST_NAME = "shard-%d-of-%d.json"
+
+
+def parse_shard(text):
+    """Parses a `i/N` shard argument into an (i, N) tuple."""
+    try:
+        index, n_shards = [int(x) for x in text.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Shards are given as i/N, got %s" %
+                                         text)
+    if not 0 <= index < n_shards:
+        raise argparse.ArgumentTypeError("Shard %d is not in [0, %d)" %
+                                         (index, n_shards))
+    return index, n_shards
+
+
+def get_shard(track_id, n_shards):
+    """Shard of a track: stable hash of its ID, modulo the number of
+    shards."""
+    digest = hashlib.sha1(str(track_id).encode("utf-8")).hexdigest()
+    return int(digest[:16], 16) % n_shards
+
+
+def select(items, shard, key):
+    """Selects the items of a shard.
+
+    Parameters
+    ----------
+    items : list
+        Items to convert (files, metadata rows, ...).
+    shard : tuple
+        (i, N) shard, or None to select all the items.
+    key : callable
+        Function returning the track ID of an item.
+
+    Returns
+    -------
+    items : list
+        Items of the shard.
+    track_ids : list
+        Track IDs of all the items.
+    """
+    items = list(items)
+    track_ids = [key(item) for item in items]
+    if shard is None:
+        return items, track_ids
+    index, n_shards = shard
+    return [item for item, track_id in zip(items, track_ids)
+            if get_shard(track_id, n_shards) == index], track_ids
+
+
+def hash_tracks(track_ids):
+    """Hash of a track list (independent of order and duplicates)."""
+    return hashlib.sha1("\n".join(sorted(set(
+        str(track_id) for track_id in track_ids))).encode("utf-8")).hexdigest()
+
+
+def write_manifest(out_dir, shard, track_ids, outputs):
+    """Writes the manifest of a completed shard (nothing if shard is None).
+
+    Parameters
+    ----------
+    out_dir : str
+        Output folder of the run.
+    shard : tuple
+        (i, N) shard.
+    track_ids : list
+        Track IDs of all the items (see `select`).
+    outputs : dict
+        Output file (or list of files), relative to out_dir, of each track
+        converted by the run, keyed by track ID (e.g. `journal.Journal.done`).
+    """
+    if shard is None:
+        return
+    index, n_shards = shard
+    all_tracks = set(str(track_id) for track_id in track_ids)
+    tracks = sorted(track_id for track_id in all_tracks
+                    if get_shard(track_id, n_shards) == index)
+    converted = dict()
+    for track_id, out_files in outputs.items():
+        if not isinstance(out_files, list):
+            out_files = [out_files]
+        converted[str(track_id)] = sorted(out_file for out_file in out_files
+                                          if out_file is not None)
+    shards_dir = os.path.join(out_dir, SHARDS_FOLDER)
+    if not os.path.isdir(shards_dir):
+        os.makedirs(shards_dir)
+    manifest_file = os.path.join(shards_dir, MANIFEST_NAME % shard)
+    with open(manifest_file + ".tmp", "w") as fp:
+        json.dump(dict(shard=index, n_shards=n_shards,
+                       n_tracks=len(all_tracks),
+                       tracks_hash=hash_tracks(track_ids), tracks=tracks,
+                       outputs=converted),
+                  fp, indent=2, sort_keys=True)
+    os.rename(manifest_file + ".tmp", manifest_file)
+    logging.info("Shard %d/%d: %d of %d tracks, %d converted.", index,
+                 n_shards, len(tracks), len(all_tracks), len(converted))
+
+
+def verify(out_dir):
+    """Verifies that the shard manifests of an output folder cover the full
+    track list exactly once, with existing output files.
+
+    Returns
+    -------
+    errors : list
+        Description of each problem found (empty if the shards are
+        complete).
+    """
+    manifests = []
+    for manifest_file in sorted(glob.glob(os.path.join(
+            out_dir, SHARDS_FOLDER, MANIFEST_NAME.replace("%d", "*")))):
+        with open(manifest_file, "r") as fp:
+            manifests.append(json.load(fp))
+    if not manifests:
+        return ["No shard manifest in %s" % out_dir]
+
+    errors = []
+    for field in ["n_shards", "n_tracks", "tracks_hash"]:
+        values = set(manifest[field] for manifest in manifests)
+        if len(values) > 1:
+            errors.append("Shards disagree on %s: %s" %
+                          (field, sorted(values)))
+    n_shards = manifests[0]["n_shards"]
+    done = set(manifest["shard"] for manifest in manifests)
+    missing = sorted(set(range(n_shards)) - done)
+    if missing:
+        errors.append("Missing shards: %s" % missing)
+
+    owners = dict()
+    for manifest in manifests:
+        outputs = manifest.get("outputs", dict())
+        skipped = sorted(set(manifest["tracks"]) - set(outputs))
+        if skipped:
+            errors.append("Shard %d did not convert %d tracks: %s" %
+                          (manifest["shard"], len(skipped),
+                           ", ".join(skipped)))
+        for track_id, out_files in sorted(outputs.items()):
+            owners.setdefault(track_id, []).append(manifest["shard"])
+            for out_file in out_files:
+                if not os.path.isfile(os.path.join(out_dir, out_file)):
+                    errors.append("Output %s of track %s is missing" %
+                                  (out_file, track_id))
+    for track_id, shards in sorted(owners.items()):
+        if len(shards) > 1:
+            errors.append("Track %s is in shards %s" % (track_id, shards))
+    if not missing and len(owners) != manifests[0]["n_tracks"]:
+        errors.append("The shards cover %d tracks instead of %d" %
+                      (len(owners), manifests[0]["n_tracks"]))
+    return errors
+
+
+def main():
+    """Main function to verify the shards of a parser run."""
+    parser = argparse.ArgumentParser(
+        description="Verifies that the shards of a parser run cover all the "
+        "tracks exactly once",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("out_dir",
+                        action="store",
+                        help="Output JAMS folder of the sharded runs")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Verify the shards
+    errors = verify(args.out_dir)
+    for error in errors:
+        logging.error(error)
+    if not errors:
+        logging.info("All the shards are complete.")
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
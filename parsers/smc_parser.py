@@ -16,6 +16,10 @@ import jams
 
 from jams.util import find_with_extension
 
+import journal
+import json_backend
+import sharding
+
 __curator__ = dict(name='Matthew Davies', email='mdavies@inescporto.pt')
 __corpus__ = 'SMC_MIREX'
 
@@ -120,11 +124,18 @@ def save_jam(output_dir, jam):
     outfile = os.path.join(output_dir, outfile)
 
     print('Saving {:s}'.format(outfile))
-    jam.save(outfile)
+    json_backend.save_jam(jam, outfile)
+    return outfile
+
+
+def get_track_id(wav_file):
+    '''SMC index of a track (e.g. SMC_001), from its audio file'''
+    return os.path.splitext(os.path.basename(wav_file))[0]
 
 
-def parse_smc(input_dir, output_dir):
-    '''Convert smc to jams'''
+def parse_smc(input_dir, output_dir, shard=None, resume=False):
+    '''Convert smc to jams (only the tracks of the given (i, N) shard, if
+    any, and not done by the interrupted run if resume is set)'''
 
     # Get a list of the wavs, tags, and txts
 
@@ -144,25 +155,31 @@ def parse_smc(input_dir, output_dir):
     assert len(wav_files) == len(ann_files)
     assert len(wav_files) == len(tag_files)
 
-    for wav, ann, tag in zip(wav_files, ann_files, tag_files):
-        # Get the file metadata
-        metadata = smc_file_metadata(wav)
+    files, track_ids = sharding.select(zip(wav_files, ann_files, tag_files),
+                                       shard, key=lambda x: get_track_id(x[0]))
+    with journal.Journal(output_dir, shard, resume) as run:
+        for wav, ann, tag in run.todo(files,
+                                      key=lambda x: get_track_id(x[0])):
+            # Get the file metadata
+            metadata = smc_file_metadata(wav)
 
-        # Get the annotation
-        beat_annotation = smc_annotation(ann)
+            # Get the annotation
+            beat_annotation = smc_annotation(ann)
 
-        # Get the tags
-        tag_annotation = smc_tags(tag, metadata.duration)
+            # Get the tags
+            tag_annotation = smc_tags(tag, metadata.duration)
 
-        jam = jams.JAMS(file_metadata=metadata)
-        jam.annotations.append(beat_annotation)
-        jam.annotations.append(tag_annotation)
+            jam = jams.JAMS(file_metadata=metadata)
+            jam.annotations.append(beat_annotation)
+            jam.annotations.append(tag_annotation)
 
-        # Add content path to the top-level sandbox
-        jam.sandbox.content_path = os.path.basename(wav)
+            # Add content path to the top-level sandbox
+            jam.sandbox.content_path = os.path.basename(wav)
 
-        # Save the jam
-        save_jam(output_dir, jam)
+            # Save the jam
+            run.add(get_track_id(wav), save_jam(output_dir, jam))
+
+    sharding.write_manifest(output_dir, shard, track_ids, run.done)
 
 
 def parse_arguments(args):
@@ -177,6 +194,18 @@ def parse_arguments(args):
                         type=str,
                         help='Path to output jam files')
 
+    parser.add_argument('--shard',
+                        dest='shard',
+                        type=sharding.parse_shard,
+                        default=None,
+                        help='Only convert the i-th of N shards of the '
+                        'tracks, given as i/N')
+
+    parser.add_argument('--resume', dest='resume',
+                        action='store_true',
+                        help='Resume an interrupted run, skipping the tracks '
+                        'in its journal')
+
     return vars(parser.parse_args(args))
 
 
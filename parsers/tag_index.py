@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""
+Inverted index of the tag annotations (`tag_cal500`, `tag_cal10k`,
+`tag_open`, `tag_medleydb_instruments`, ...) of one or several corpora.
+
+Every (namespace, tag) pair is a term, with a posting list of the tracks
+annotated with it and the corresponding confidence. Tags without a
+confidence (everything but CAL500, whose confidences are the product of its
+hard and soft annotations) get a confidence of 1. When a tag appears several
+times in a track, the highest confidence is kept.
+
+The index is a folder of `.npy` arrays, memory-mapped when queried, plus
+`tracks.json` and `terms.json`. Boolean queries combine posting lists with
+sorted-array set operations:
+
+    - all_of: tracks with all of the tags (AND)
+    - any_of: tracks with at least one of the tags (OR)
+    - none_of: tracks with none of the tags (NOT)
+
+where each tag only counts if its confidence reaches `min_confidence`.
+
+Usage examples:
+    ./tag_index.py build tag_idx ../datasets/CAL500 ../datasets/CAL10K \
+../datasets/SMC_MIREX ../datasets/MedleyDB -j 4
+    ./tag_index.py query tag_idx --all "Instrument_-_Electric_Guitar_(distorted)" \
+--not "NOT-Emotion-Angry_/_Aggressive" --min_confidence 0.5
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+from joblib import Parallel, delayed
+import numpy as np
+
+import corpus_io
+
+TAG_PREFIX = "tag_"
+ARRAYS = ["offsets", "track_ids", "confidences"]
+
+
+def read_tags(jams_file):
+    """Reads the tags of all the tag annotations of a JAMS file.
+
+    Returns
+    -------
+    tags : dict
+        Highest confidence of each tag, keyed by (namespace, value).
+    """
+    jam = corpus_io.load_jam(jams_file)
+    tags = dict()
+    for annotation in corpus_io.iter_annotations(jam):
+        if not annotation["namespace"].startswith(TAG_PREFIX):
+            continue
+        for value, confidence in zip(annotation["data"]["value"],
+                                     annotation["data"]["confidence"]):
+            term = (annotation["namespace"], value)
+            confidence = 1.0 if confidence is None else float(confidence)
+            tags[term] = max(tags.get(term, confidence), confidence)
+    return tags
+
+
+def build(out_dir, in_dirs, n_jobs=1):
+    """Builds a tag inverted index.
+
+    Parameters
+    ----------
+    out_dir : str
+        Folder where the index is stored.
+    in_dirs : list
+        Folders with the JAMS files to index.
+    n_jobs : int
+        Number of parallel jobs.
+    """
+    jams_files = []
+    for in_dir in in_dirs:
+        jams_files += corpus_io.find_jams(in_dir)
+    all_tags = Parallel(n_jobs=n_jobs)(delayed(read_tags)(jams_file)
+                                       for jams_file in jams_files)
+
+    terms = sorted(set(term for tags in all_tags for term in tags))
+    term_ids = dict((term, i) for i, term in enumerate(terms))
+    n_postings = sum(len(tags) for tags in all_tags)
+    term_col = np.zeros(n_postings, dtype=np.int64)
+    track_col = np.zeros(n_postings, dtype=np.int32)
+    confidence_col = np.zeros(n_postings, dtype=np.float32)
+    i = 0
+    for track_id, tags in enumerate(all_tags):
+        for term, confidence in tags.items():
+            term_col[i] = term_ids[term]
+            track_col[i] = track_id
+            confidence_col[i] = confidence
+            i += 1
+
+    # Sort the postings by term, then by track
+    order = np.lexsort((track_col, term_col))
+    arrays = dict(
+        offsets=np.searchsorted(term_col[order],
+                                np.arange(len(terms) + 1)).astype(np.int64),
+        track_ids=track_col[order],
+        confidences=confidence_col[order])
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    for name in ARRAYS:
+        np.save(os.path.join(out_dir, name + ".npy"), arrays[name])
+    with open(os.path.join(out_dir, "tracks.json"), "w") as fp:
+        json.dump(jams_files, fp, indent=2)
+    with open(os.path.join(out_dir, "terms.json"), "w") as fp:
+        json.dump([list(term) for term in terms], fp, indent=2)
+    logging.info("Indexed %d postings of %d tags from %d files.", n_postings,
+                 len(terms), len(jams_files))
+
+
+class TagIndex(object):
+    """Tag inverted index built by `build`.
+
+    Parameters
+    ----------
+    index_dir : str
+        Folder where the index is stored.
+    """
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "tracks.json"), "r") as fp:
+            self.tracks = json.load(fp)
+        with open(os.path.join(index_dir, "terms.json"), "r") as fp:
+            self.terms = [tuple(term) for term in json.load(fp)]
+        self.term_ids = dict()
+        for i, (namespace, value) in enumerate(self.terms):
+            self.term_ids.setdefault(value, []).append((namespace, i))
+        self.arrays = dict(
+            (name, np.load(os.path.join(index_dir, name + ".npy"),
+                           mmap_mode="r"))
+            for name in ARRAYS)
+
+    def postings(self, tag, namespace=None):
+        """Gets the posting list of a tag.
+
+        Parameters
+        ----------
+        tag : str
+            Tag value.
+        namespace : str
+            If given, only the postings of this namespace are returned;
+            otherwise the postings of all namespaces are merged.
+
+        Returns
+        -------
+        track_ids : np.ndarray
+            Sorted track ids annotated with the tag.
+        confidences : np.ndarray
+            Confidence of the tag for each track.
+        """
+        track_ids, confidences = [], []
+        for term_namespace, i in self.term_ids.get(tag, []):
+            if namespace is not None and term_namespace != namespace:
+                continue
+            start, end = self.arrays["offsets"][i:i + 2]
+            track_ids.append(self.arrays["track_ids"][start:end])
+            confidences.append(self.arrays["confidences"][start:end])
+        if len(track_ids) == 1:
+            return np.asarray(track_ids[0]), np.asarray(confidences[0])
+        track_ids = np.concatenate(track_ids + [np.zeros(0, dtype=np.int32)])
+        confidences = np.concatenate(confidences +
+                                     [np.zeros(0, dtype=np.float32)])
+        # Keep the highest confidence of tracks in several namespaces
+        order = np.lexsort((-confidences, track_ids))
+        track_ids, confidences = track_ids[order], confidences[order]
+        first = np.ones(len(track_ids), dtype=bool)
+        first[1:] = track_ids[1:] != track_ids[:-1]
+        return track_ids[first], confidences[first]
+
+    def _tracks(self, tag, namespace, min_confidence):
+        """Sorted ids of the tracks with the tag above the threshold."""
+        track_ids, confidences = self.postings(tag, namespace)
+        return track_ids[confidences >= min_confidence]
+
+    def query(self, all_of=(), any_of=(), none_of=(), min_confidence=0.0,
+              namespace=None):
+        """Runs a boolean tag query.
+
+        Parameters
+        ----------
+        all_of : list
+            Tags that all tracks must have.
+        any_of : list
+            Tags of which all tracks must have at least one.
+        none_of : list
+            Tags that no track may have.
+        min_confidence : float
+            Minimum confidence for a tag to count as present.
+        namespace : str
+            If given, only tags of this namespace are considered.
+
+        Returns
+        -------
+        tracks : list
+            Paths to the JAMS files of the matching tracks.
+        """
+        result = None
+        for tag in all_of:
+            tracks = self._tracks(tag, namespace, min_confidence)
+            result = tracks if result is None else \
+                np.intersect1d(result, tracks, assume_unique=True)
+        if any_of:
+            tracks = np.unique(np.concatenate(
+                [self._tracks(tag, namespace, min_confidence)
+                 for tag in any_of]))
+            result = tracks if result is None else \
+                np.intersect1d(result, tracks, assume_unique=True)
+        if result is None:
+            result = np.arange(len(self.tracks))
+        for tag in none_of:
+            result = np.setdiff1d(result, self._tracks(tag, namespace,
+                                                       min_confidence),
+                                  assume_unique=True)
+        return [self.tracks[i] for i in result]
+
+
+def main():
+    """Main function to build or query a tag index."""
+    parser = argparse.ArgumentParser(
+        description="Tag inverted index with boolean queries",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    build_parser = subparsers.add_parser("build", help="Build an index")
+    build_parser.add_argument("index_dir",
+                              action="store",
+                              help="Output index folder")
+    build_parser.add_argument("in_dirs",
+                              action="store",
+                              nargs="+",
+                              help="Folders with the JAMS files to index")
+    build_parser.add_argument("-j",
+                              action="store",
+                              dest="n_jobs",
+                              type=int,
+                              default=1,
+                              help="Number of CPUs to run in parallel.")
+    query_parser = subparsers.add_parser("query", help="Query an index")
+    query_parser.add_argument("index_dir",
+                              action="store",
+                              help="Index folder")
+    query_parser.add_argument("--all",
+                              action="store",
+                              dest="all_of",
+                              nargs="+",
+                              default=[],
+                              help="Tags that all tracks must have")
+    query_parser.add_argument("--any",
+                              action="store",
+                              dest="any_of",
+                              nargs="+",
+                              default=[],
+                              help="Tags of which tracks must have one")
+    query_parser.add_argument("--not",
+                              action="store",
+                              dest="none_of",
+                              nargs="+",
+                              default=[],
+                              help="Tags that tracks must not have")
+    query_parser.add_argument("--min_confidence",
+                              action="store",
+                              type=float,
+                              default=0.0,
+                              help="Minimum confidence of a tag")
+    query_parser.add_argument("--namespace",
+                              action="store",
+                              default=None,
+                              help="Only consider tags of this namespace")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    if args.command == "build":
+        build(args.index_dir, args.in_dirs, args.n_jobs)
+    elif args.command == "query":
+        index = TagIndex(args.index_dir)
+        tracks = index.query(args.all_of, args.any_of, args.none_of,
+                             args.min_confidence, args.namespace)
+        for track in tracks:
+            print(track)
+        logging.info("%d tracks found.", len(tracks))
+    else:
+        parser.print_help()
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+"""
+Time index for point and range queries over the observations of JAMS
+annotations.
+
+Each annotation is indexed by its observations sorted by start time, plus
+the running maximum of their end times. For a query time `t`, the
+observations that may contain it lie between the first one whose running
+maximum end exceeds `t` and the last one starting before `t`, and both
+bounds are found with a binary search. Queries are batched with
+`np.searchsorted`, so each one costs O(log n) plus the number of candidate
+observations.
+
+Indexes are built lazily, the first time a namespace is queried, and cached
+in a `.tidx.npz` file next to the JAMS file (or in a separate cache folder,
+named after the file and a hash of its absolute path, as e.g. the files of
+different corpora share names).
+A cached index is rebuilt when the size or modification time of its JAMS
+file changes.
+
+Usage examples:
+    ./time_index.py ../datasets/SALAMI/10.jams segment_salami_upper \
+--at 53.2
+    ./time_index.py ../datasets/Harmonix/0001_12step.jams beat \
+--between 30 60
+    ./time_index.py ../datasets/SALAMI --build -j 4
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+
+from joblib import Parallel, delayed
+import numpy as np
+
+import corpus_io
+
+INDEX_EXTENSION = ".tidx.npz"
+
+
+class AnnotationIndex(object):
+    """Time index of the observations of a single annotation.
+
+    Parameters
+    ----------
+    starts : np.ndarray
+        Start times of the observations, sorted.
+    ends : np.ndarray
+        End times of the observations, in the order of `starts`.
+    order : np.ndarray
+        Position of each sorted observation in the original annotation.
+    values : np.ndarray
+        JSON-encoded values of the observations, in the order of `starts`.
+    """
+    def __init__(self, starts, ends, order, values):
+        self.starts = starts
+        self.ends = ends
+        self.order = order
+        self.values = values
+        self.max_ends = np.maximum.accumulate(ends) if len(ends) else ends
+        self.positions = np.empty_like(order)
+        self.positions[order] = np.arange(len(order))
+
+    @classmethod
+    def from_annotation(cls, annotation):
+        """Builds the index of an annotation as returned by
+        `corpus_io.iter_annotations`."""
+        times = np.asarray(annotation["data"]["time"], dtype=np.float64)
+        durations = np.nan_to_num(np.asarray(annotation["data"]["duration"],
+                                             dtype=np.float64))
+        order = np.argsort(times, kind="mergesort")
+        values = np.array([json.dumps(value)
+                           for value in annotation["data"]["value"]],
+                          dtype=np.str_)
+        return cls(times[order], times[order] + durations[order], order,
+                   values[order] if len(values) else values)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _candidates(self, lows, highs):
+        """Expands the [low, high) candidate ranges of a batch of queries.
+
+        Returns the query number and the sorted position of every
+        candidate."""
+        lengths = np.maximum(highs - lows, 0)
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(lengths.sum()) - np.repeat(offsets - lows,
+                                                         lengths)
+        queries = np.repeat(np.arange(len(lows)), lengths)
+        return queries, positions
+
+    def _split(self, queries, positions, n_queries):
+        """Groups the matching positions by query, as original indices."""
+        bounds = np.searchsorted(queries, np.arange(1, n_queries))
+        return np.split(self.order[positions], bounds)
+
+    def at(self, times):
+        """Finds the observations active at each of the given times.
+
+        An observation is active at `t` if `start <= t < end`, or if it is
+        instantaneous and `start == t`.
+
+        Parameters
+        ----------
+        times : np.ndarray
+            Query times, in seconds.
+
+        Returns
+        -------
+        matches : list
+            For each query, the array of indices of the active observations
+            in the annotation.
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        lows = np.searchsorted(self.max_ends, times, side="left")
+        highs = np.searchsorted(self.starts, times, side="right")
+        queries, positions = self._candidates(lows, highs)
+        t = times[queries]
+        keep = (self.ends[positions] > t) | (self.starts[positions] == t)
+        return self._split(queries[keep], positions[keep], len(times))
+
+    def between(self, start_times, end_times):
+        """Finds the observations overlapping each of the given ranges.
+
+        An observation overlaps `[t0, t1)` if it starts before `t1` and
+        either ends after `t0` or starts at or after `t0`.
+
+        Parameters
+        ----------
+        start_times : np.ndarray
+            Start times of the query ranges, in seconds.
+        end_times : np.ndarray
+            End times of the query ranges, in seconds.
+
+        Returns
+        -------
+        matches : list
+            For each query, the array of indices of the overlapping
+            observations in the annotation.
+        """
+        start_times = np.atleast_1d(np.asarray(start_times, dtype=np.float64))
+        end_times = np.atleast_1d(np.asarray(end_times, dtype=np.float64))
+        lows = np.searchsorted(self.max_ends, start_times, side="left")
+        highs = np.searchsorted(self.starts, end_times, side="left")
+        queries, positions = self._candidates(lows, highs)
+        t0 = start_times[queries]
+        keep = (self.ends[positions] > t0) | (self.starts[positions] >= t0)
+        return self._split(queries[keep], positions[keep], len(start_times))
+
+    def get_values(self, indices):
+        """Decodes the values of the observations at the given indices of
+        the annotation."""
+        return [json.loads(value)
+                for value in self.values[self.positions[indices]]]
+
+
+def get_index_file(jams_file, cache_dir=None):
+    """Path to the cached index of a JAMS file."""
+    base = os.path.splitext(jams_file)[0]
+    if cache_dir is not None:
+        path_hash = hashlib.sha1(
+            os.path.abspath(jams_file).encode("utf-8")).hexdigest()
+        base = os.path.join(cache_dir, "%s.%s" % (os.path.basename(base),
+                                                  path_hash[:16]))
+    return base + INDEX_EXTENSION
+
+
+def get_stamp(jams_file):
+    """Size and modification time of a JAMS file, used to invalidate its
+    cached index."""
+    stat = os.stat(jams_file)
+    return np.array([stat.st_size, stat.st_mtime], dtype=np.float64)
+
+
+class JamsTimeIndex(object):
+    """Lazily built time indexes of all the annotations of a JAMS file.
+
+    Parameters
+    ----------
+    jams_file : str
+        Path to the JAMS file.
+    cache_dir : str
+        Folder where the index is cached. By default, the index is stored
+        next to the JAMS file.
+    """
+    def __init__(self, jams_file, cache_dir=None):
+        self.jams_file = jams_file
+        self.index_file = get_index_file(jams_file, cache_dir)
+        self._namespaces = None
+        self._indexes = dict()
+
+    def _load(self):
+        """Loads the cached index, or builds and caches it."""
+        stamp = get_stamp(self.jams_file)
+        if os.path.isfile(self.index_file):
+            with np.load(self.index_file) as arrays:
+                if np.array_equal(arrays["stamp"], stamp):
+                    self._namespaces = arrays["namespaces"].tolist()
+                    for i in range(len(self._namespaces)):
+                        self._indexes[i] = AnnotationIndex(
+                            arrays["starts_%d" % i], arrays["ends_%d" % i],
+                            arrays["order_%d" % i], arrays["values_%d" % i])
+                    return
+        self.build()
+
+    def build(self):
+        """Builds the indexes of all the annotations and caches them."""
+        jam = corpus_io.load_jam(self.jams_file)
+        self._namespaces = []
+        arrays = dict(stamp=get_stamp(self.jams_file))
+        for i, annotation in enumerate(corpus_io.iter_annotations(jam)):
+            index = AnnotationIndex.from_annotation(annotation)
+            self._namespaces.append(annotation["namespace"])
+            self._indexes[i] = index
+            arrays["starts_%d" % i] = index.starts
+            arrays["ends_%d" % i] = index.ends
+            arrays["order_%d" % i] = index.order
+            arrays["values_%d" % i] = index.values
+        arrays["namespaces"] = np.array(self._namespaces, dtype=np.str_)
+        index_dir = os.path.dirname(self.index_file)
+        if index_dir and not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        with open(self.index_file, "wb") as fp:
+            np.savez(fp, **arrays)
+
+    @property
+    def namespaces(self):
+        """Namespaces of the annotations, in file order."""
+        if self._namespaces is None:
+            self._load()
+        return self._namespaces
+
+    def __getitem__(self, i):
+        """Index of the i-th annotation of the file."""
+        if self._namespaces is None:
+            self._load()
+        return self._indexes[i]
+
+    def search(self, namespace):
+        """Indexes of all the annotations of a given namespace."""
+        return [self[i] for i, ns in enumerate(self.namespaces)
+                if ns == namespace]
+
+
+def build_index(jams_file, cache_dir=None):
+    """Builds and caches the index of a JAMS file. Returns the number of
+    indexed annotations."""
+    index = JamsTimeIndex(jams_file, cache_dir)
+    return len(index.namespaces)
+
+
+def process(in_dir, cache_dir=None, n_jobs=1):
+    """Builds the time indexes of all the JAMS files in a folder."""
+    jams_files = corpus_io.find_jams(in_dir)
+    counts = Parallel(n_jobs=n_jobs)(delayed(build_index)(jams_file,
+                                                          cache_dir)
+                                     for jams_file in jams_files)
+    logging.info("Indexed %d annotations from %d files.", sum(counts),
+                 len(jams_files))
+
+
+def main():
+    """Main function to build or query time indexes."""
+    parser = argparse.ArgumentParser(
+        description="Point and range queries over JAMS annotations",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("jams_path",
+                        action="store",
+                        help="JAMS file to query, or folder to index")
+    parser.add_argument("namespace",
+                        action="store",
+                        nargs="?",
+                        help="Namespace of the annotations to query")
+    parser.add_argument("--at",
+                        action="store",
+                        type=float,
+                        nargs="+",
+                        help="Times at which to find the active observations")
+    parser.add_argument("--between",
+                        action="store",
+                        type=float,
+                        nargs=2,
+                        help="Time range in which to find the observations")
+    parser.add_argument("--build",
+                        action="store_true",
+                        help="Build the indexes of all the files in the "
+                             "folder")
+    parser.add_argument("--cache_dir",
+                        action="store",
+                        default=None,
+                        help="Folder where the indexes are cached (next to "
+                             "the JAMS files by default)")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    if args.build:
+        process(args.jams_path, args.cache_dir, args.n_jobs)
+    else:
+        jam_index = JamsTimeIndex(args.jams_path, args.cache_dir)
+        for i, index in enumerate(jam_index.search(args.namespace)):
+            if args.at is not None:
+                for t, matches in zip(args.at, index.at(args.at)):
+                    print("[%d] %.3f: %s" % (i, t, index.get_values(matches)))
+            if args.between is not None:
+                matches = index.between(*args.between)[0]
+                print("[%d] %.3f-%.3f: %s" % (i, args.between[0],
+                                              args.between[1],
+                                              index.get_values(matches)))
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -19,9 +19,12 @@ __version__ = "1.0"
 __email__ = "ejhumphrey@nyu.edu"
 
 import argparse
-import json
+import journal
+import json_backend
 import logging
 import os
+import pipeline
+import sharding
 import sys
 import time
 
@@ -53,7 +56,23 @@ def fill_annotation_metadata(annot):
 
 
 def create_JAMS(lab_file, out_file):
-    """Creates a JAMS file given the Isophonics lab file."""
+    """Creates a JAMS file given the Isophonics lab file, and returns its
+    path."""
+    track = (lab_file, out_file)
+    return write_track(track, build_JAMS(track, read_track(track)))
+
+
+def read_track(track):
+    """Reads the chord intervals and labels of a (lab_file, out_file)
+    track."""
+    return pyjams.util.read_lab(track[0], 3)
+
+
+def build_JAMS(track, data):
+    """Builds the JAMS of a track from its chord intervals and labels (see
+    `read_track`)."""
+    lab_file = track[0]
+    start_times, end_times, chord_labels = data
 
     # New JAMS and annotation
     jam = pyjams.JAMS()
@@ -62,21 +81,29 @@ def create_JAMS(lab_file, out_file):
     fill_file_metadata(jam, lab_file)
 
     # Create Chord annotation
-    start_times, end_times, chord_labels = pyjams.util.read_lab(lab_file, 3)
     chord_annot = jam.chord.create_annotation()
     pyjams.util.fill_range_annotation_data(
         start_times, end_times, chord_labels, chord_annot)
     fill_annotation_metadata(chord_annot)
     jam.file_metadata.duration = end_times[-1]
+    return jam
+
 
-    # Save JAMS
-    with open(out_file, "w") as fp:
-        json.dump(jam, fp, indent=2)
+def write_track(track, jam):
+    """Saves the JAMS of a track, and returns its path."""
+    json_backend.save_json(jam, track[1])
+    return track[1]
 
 
-def process(in_dir, out_dir):
+def process(in_dir, out_dir, shard=None, resume=False, n_jobs=1,
+            n_readers=pipeline.N_READERS):
     """Converts the original chord labfiles into the JAMS format, and saves
-    them in the out_dir folder."""
+    them in the out_dir folder (only the tracks of the given (i, N) shard,
+    if any, and not done by the interrupted run if resume is set).
+
+    Reading the labfiles, building the JAMS and writing them are pipelined
+    (see `pipeline.py`), with n_readers threads reading and n_jobs workers
+    building."""
 
     # Collect all chord labfiles.
     lab_files = list()
@@ -84,12 +111,23 @@ def process(in_dir, out_dir):
         lab_files += pyjams.util.expand_filepaths(
             in_dir, pyjams.util.load_textlist(os.path.join(in_dir, dset)))
 
-    for lab_file in lab_files:
-        jams_file = os.path.join(
-            out_dir, os.path.basename(lab_file).replace('.lab', '.jams'))
-        pyjams.util.smkdirs(os.path.split(jams_file)[0])
-        #Create a JAMS file for this track
-        create_JAMS(lab_file, jams_file)
+    get_track_id = lambda lab_file: os.path.splitext(
+        os.path.basename(lab_file))[0]
+    lab_files, track_ids = sharding.select(lab_files, shard, key=get_track_id)
+    with journal.Journal(out_dir, shard, resume) as run:
+        tracks = []
+        for lab_file in run.todo(lab_files, key=get_track_id):
+            jams_file = os.path.join(
+                out_dir, os.path.basename(lab_file).replace('.lab', '.jams'))
+            pyjams.util.smkdirs(os.path.split(jams_file)[0])
+            tracks.append((lab_file, jams_file))
+
+        #Create a JAMS file for each track
+        pipeline.run(tracks, read_track, build_JAMS, write_track,
+                     on_done=lambda track, jams_file: run.add(
+                         get_track_id(track[0]), jams_file),
+                     n_readers=n_readers, n_jobs=n_jobs)
+    sharding.write_manifest(out_dir, shard, track_ids, run.done)
 
 
 def main():
@@ -106,6 +144,28 @@ def main():
                         # TODO(ejhumphrey): This should be a config, no?
                         default="outJAMS",
                         help="Output JAMS folder")
+    parser.add_argument("--shard",
+                        action="store",
+                        type=sharding.parse_shard,
+                        default=None,
+                        help="Only convert the i-th of N shards of the "
+                        "tracks, given as i/N")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    parser.add_argument("--readers",
+                        action="store",
+                        dest="n_readers",
+                        type=int,
+                        default=pipeline.N_READERS,
+                        help="Number of threads reading the source files.")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Resume an interrupted run, skipping the tracks "
+                        "in its journal")
     args = parser.parse_args()
     start_time = time.time()
 
@@ -113,7 +173,8 @@ def main():
     logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
 
     # Run the parser
-    process(args.in_dir, args.out_dir)
+    process(args.in_dir, args.out_dir, args.shard, args.resume, args.n_jobs,
+            args.n_readers)
 
     # Done!
     logging.info("Done! Took %.2f seconds.", time.time() - start_time)
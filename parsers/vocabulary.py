@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+Corpus-level label vocabularies, to encode observation values as integer
+codes.
+
+A vocabulary store holds one sorted vocabulary per namespace (chords,
+segment labels, tags, ...), built once from one or several corpora and
+persisted as a JSON file. Values are then encoded as int32 codes, shared by
+all the tracks and corpora: `observations.load_corpus` uses them for the
+categorical values of its containers, and `shard_export.py` for the value
+arrays it exports. Labels are compared as integers, and each label is held
+in memory once.
+
+Dictionary and list values (e.g. Rock Corpus roman numerals) are keyed by
+their JSON serialization with sorted keys, as in `rasterize.py`. Values
+that are not in a vocabulary are encoded as -1.
+
+Usage example:
+    ./vocabulary.py vocabularies.json ../datasets/Billboard-Chords \
+../datasets/Isophonics ../datasets/tmc323 ../datasets/SALAMI -n chord \
+segment_salami_upper segment_salami_lower -j 4
+"""
+
+import argparse
+import functools
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+import corpus_io
+import rasterize
+
+UNKNOWN = -1
+
+
+class Vocabulary(object):
+    """Vocabulary of the values of a namespace.
+
+    Parameters
+    ----------
+    namespace : str
+        Namespace of the values.
+    labels : list
+        Values of the vocabulary, in code order.
+    """
+    __slots__ = ["namespace", "labels", "index"]
+
+    def __init__(self, namespace, labels):
+        self.namespace = namespace
+        self.labels = labels
+        self.index = dict((rasterize.value_key(label), code)
+                          for code, label in enumerate(labels))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, value):
+        return rasterize.value_key(value) in self.index
+
+    def encode(self, values):
+        """Encodes values as an int32 array of codes (-1 for unknown
+        values)."""
+        index = self.index
+        return np.array([index.get(rasterize.value_key(value), UNKNOWN)
+                         for value in values], dtype=np.int32)
+
+    def decode(self, codes):
+        """Decodes an array of codes into a list of values (None for unknown
+        values)."""
+        labels = self.labels
+        return [labels[code] if code != UNKNOWN else None
+                for code in np.asarray(codes).tolist()]
+
+
+def get_file_labels(jam, namespaces=None):
+    """Gets the distinct values of each namespace of a loaded JAMS.
+
+    Returns
+    -------
+    labels : dict
+        For each namespace, a dictionary of its values keyed by
+        `rasterize.value_key`.
+    """
+    labels = dict()
+    for annotation in corpus_io.iter_annotations(jam):
+        namespace = annotation["namespace"]
+        if namespaces is not None and namespace not in namespaces:
+            continue
+        namespace_labels = labels.setdefault(namespace, dict())
+        for value in annotation["data"]["value"]:
+            namespace_labels.setdefault(rasterize.value_key(value), value)
+    return labels
+
+
+class VocabularyStore(object):
+    """Persisted vocabularies of several namespaces.
+
+    Parameters
+    ----------
+    vocabulary_file : str
+        Path to the JSON file of the store. It is loaded if it exists.
+    """
+    def __init__(self, vocabulary_file):
+        self.vocabulary_file = vocabulary_file
+        self.vocabularies = dict()
+        if os.path.isfile(vocabulary_file):
+            with open(vocabulary_file, "r") as fp:
+                for namespace, labels in json.load(fp).items():
+                    self.vocabularies[namespace] = Vocabulary(namespace,
+                                                              labels)
+
+    def __contains__(self, namespace):
+        return namespace in self.vocabularies
+
+    def __getitem__(self, namespace):
+        return self.vocabularies[namespace]
+
+    def get(self, namespace):
+        """Vocabulary of a namespace, or None."""
+        return self.vocabularies.get(namespace)
+
+    @property
+    def namespaces(self):
+        return sorted(self.vocabularies)
+
+    def build(self, in_dirs, namespaces=None, n_jobs=1):
+        """Builds the vocabularies of the given corpora (replacing those of
+        the same namespaces) and saves the store.
+
+        Parameters
+        ----------
+        in_dirs : list
+            Folders with the JAMS files.
+        namespaces : list
+            Namespaces to build (all the namespaces found by default).
+        n_jobs : int
+            Number of processes loading the files.
+        """
+        jams_files = []
+        for in_dir in in_dirs:
+            jams_files += corpus_io.find_jams(in_dir)
+        func = functools.partial(get_file_labels, namespaces=namespaces)
+        labels = dict()
+        for _, file_labels in corpus_io.iter_load(jams_files, n_jobs,
+                                                  func=func):
+            for namespace, namespace_labels in file_labels.items():
+                labels.setdefault(namespace, dict()).update(namespace_labels)
+        for namespace, namespace_labels in labels.items():
+            keys = sorted(namespace_labels,
+                          key=lambda x: (str(type(x)), x))
+            self.vocabularies[namespace] = Vocabulary(
+                namespace, [namespace_labels[key] for key in keys])
+        self.save()
+
+    def save(self):
+        """Writes the store to its JSON file."""
+        with open(self.vocabulary_file, "w") as fp:
+            json.dump(dict((namespace, vocabulary.labels)
+                           for namespace, vocabulary in
+                           sorted(self.vocabularies.items())),
+                      fp, indent=2)
+
+
+def main():
+    """Main function to build a vocabulary store."""
+    parser = argparse.ArgumentParser(
+        description="Builds per-namespace label vocabularies",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("vocabulary_file",
+                        action="store",
+                        help="JSON file of the vocabulary store")
+    parser.add_argument("in_dirs",
+                        action="store",
+                        nargs="+",
+                        help="Folders with the JAMS files")
+    parser.add_argument("-n",
+                        action="store",
+                        dest="namespaces",
+                        nargs="+",
+                        default=None,
+                        help="Namespaces to build (all by default)")
+    parser.add_argument("-j",
+                        action="store",
+                        dest="n_jobs",
+                        type=int,
+                        default=1,
+                        help="Number of CPUs to run in parallel.")
+    args = parser.parse_args()
+    start_time = time.time()
+
+    # Setup the logger
+    logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+    # Build the vocabularies
+    store = VocabularyStore(args.vocabulary_file)
+    store.build(args.in_dirs, args.namespaces, args.n_jobs)
+    for namespace in store.namespaces:
+        logging.info("%s: %d labels", namespace, len(store[namespace]))
+
+    # Done!
+    logging.info("Done! Took %.2f seconds.", time.time() - start_time)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+Watches a source tree and reports the files that changed, for the
+`--watch` mode of the parsers.
+
+Changes are detected with inotify when the optional `inotify_simple` module
+is installed (Linux only), and otherwise by polling the modification time
+and size of every file of the tree. Editors save files in bursts (temporary
+file, rename, metadata update, ...), so changes are debounced: the paths
+changed during a burst are reported together, once no change happened for
+`debounce` seconds.
+
+Usage example (from a parser):
+    >>> watch.watch(in_dir, lambda paths: reconvert(paths))
+"""
+
+import importlib
+import logging
+import os
+import time
+
+DEBOUNCE = 0.2
+POLL_INTERVAL = 0.5
+
+
+def _import_inotify():
+    """Imports `inotify_simple`, returning None if it is not installed."""
+    try:
+        return importlib.import_module("inotify_simple")
+    except ImportError:
+        return None
+
+
+class PollingWatcher(object):
+    """Detects changes by comparing snapshots of the tree.
+
+    Parameters
+    ----------
+    root : str
+        Folder to watch.
+    poll_interval : float
+        Time between snapshots, in seconds.
+    """
+    def __init__(self, root, poll_interval=POLL_INTERVAL):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        """(mtime, size) of every file of the tree, keyed by path."""
+        snapshot = dict()
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def read(self, timeout):
+        """Waits up to timeout seconds, and returns the set of paths
+        created, modified or deleted since the last call."""
+        time.sleep(min(timeout, self.poll_interval))
+        snapshot = self._scan()
+        changed = set(path for path, stat in snapshot.items()
+                      if self.snapshot.get(path) != stat)
+        changed.update(set(self.snapshot) - set(snapshot))
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Detects changes with inotify, watching every folder of the tree.
+
+    Parameters
+    ----------
+    root : str
+        Folder to watch.
+    """
+    def __init__(self, root):
+        self.inotify_simple = _import_inotify()
+        flags = self.inotify_simple.flags
+        self.mask = flags.CLOSE_WRITE | flags.CREATE | flags.DELETE | \
+            flags.MOVED_FROM | flags.MOVED_TO
+        self.inotify = self.inotify_simple.INotify()
+        self.folders = dict()
+        for dirpath, _, _ in os.walk(root):
+            self._add(dirpath)
+
+    def _add(self, folder):
+        """Watches a folder."""
+        self.folders[self.inotify.add_watch(folder, self.mask)] = folder
+
+    def read(self, timeout):
+        """Waits up to timeout seconds for changes, and returns the set of
+        paths created, modified or deleted."""
+        flags = self.inotify_simple.flags
+        changed = set()
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            folder = self.folders.get(event.wd)
+            if folder is None or not event.name:
+                continue
+            path = os.path.join(folder, event.name)
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO):
+                    # Watch the new folder, and report its files
+                    for dirpath, _, filenames in os.walk(path):
+                        self._add(dirpath)
+                        changed.update(os.path.join(dirpath, filename)
+                                       for filename in filenames)
+                continue
+            # Files are reported once written (CLOSE_WRITE), not on CREATE
+            if not event.mask & flags.CREATE:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        self.inotify.close()
+
+
+def get_watcher(root, use_inotify=None, poll_interval=POLL_INTERVAL):
+    """Gets a watcher of a tree: inotify if it is available (or requested),
+    and polling otherwise."""
+    if use_inotify is None:
+        use_inotify = _import_inotify() is not None
+    if use_inotify:
+        return InotifyWatcher(root)
+    return PollingWatcher(root, poll_interval)
+
+
+def watch(root, on_change, debounce=DEBOUNCE, use_inotify=None,
+          poll_interval=POLL_INTERVAL, max_events=None):
+    """Watches a tree and calls on_change with the paths changed by each
+    burst of changes, until interrupted.
+
+    Parameters
+    ----------
+    root : str
+        Folder to watch.
+    on_change : callable
+        Function called with the sorted list of changed paths.
+    debounce : float
+        Time without changes that ends a burst, in seconds.
+    use_inotify : bool
+        Whether to use inotify (by default, if `inotify_simple` is
+        installed).
+    poll_interval : float
+        Time between snapshots of the polling watcher, in seconds.
+    max_events : int
+        Number of bursts after which to stop (None to watch forever).
+    """
+    watcher = get_watcher(root, use_inotify, poll_interval)
+    logging.info("Watching %s with %s...", root,
+                 "inotify" if isinstance(watcher, InotifyWatcher)
+                 else "polling")
+    pending, last_change = set(), None
+    n_events = 0
+    try:
+        while max_events is None or n_events < max_events:
+            changed = watcher.read(debounce if pending else poll_interval)
+            if changed:
+                pending.update(changed)
+                last_change = time.time()
+            elif pending and time.time() - last_change >= debounce:
+                on_change(sorted(pending))
+                pending = set()
+                n_events += 1
+    except KeyboardInterrupt:
+        logging.info("Stopped watching %s.", root)
+    finally:
+        watcher.close()